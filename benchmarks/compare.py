@@ -0,0 +1,83 @@
+"""
+Compare two benchmark result files written by ``benchmarks/run.py``.
+
+Prints the change in throughput and p99 latency for every case present in
+both files. With ``--fail-above`` the exit status is 1 if any case lost more
+throughput than the given percentage, which makes it usable in CI.
+
+Example:
+    python benchmarks/compare.py before.json after.json --fail-above 10
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+CASE_FIELDS = ("backend", "locking", "serializer", "layout", "shape", "write_behind", "state_bytes",
+               "threads", "processes")
+
+
+def case_key(result: Dict[str, Any]) -> Tuple[Any, ...]:
+    if result["backend"] == "sqlite" and result.get("locking") is None:
+        # Results written before SQLite locking modes were benchmarked
+        result = dict(result, locking="file")
+    if result.get("shape") is None:
+        # Results written before payload shapes were benchmarked
+        result = dict(result, shape="string")
+    if result.get("write_behind") is None:
+        result = dict(result, write_behind=False)
+    return tuple(result.get(field) for field in CASE_FIELDS)
+
+
+def load_results(path: str) -> Dict[Tuple[Any, ...], Dict[str, Any]]:
+    with open(path) as f:
+        report = json.load(f)
+    return {case_key(result): result for result in report["results"]}
+
+
+def change(old: float, new: float) -> float:
+    """Relative change in percent."""
+    return (new - old) / old * 100 if old else 0.0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--fail-above", type=float, default=None,
+                        help="Exit with status 1 if throughput drops by more than this percentage")
+    args = parser.parse_args(argv)
+
+    baseline = load_results(args.baseline)
+    candidate = load_results(args.candidate)
+
+    print(f"{'CASE':<52} {'CALLS/S':>10} {'CHANGE':>8} {'P99 MS':>9} {'CHANGE':>8}")
+    print("-" * 91)
+    worst = 0.0
+    for key in sorted(set(baseline) & set(candidate), key=str):
+        old, new = baseline[key], candidate[key]
+        throughput = change(old["calls_per_sec"], new["calls_per_sec"])
+        p99 = change(old["latency"]["p99"], new["latency"]["p99"])
+        worst = min(worst, throughput)
+        backend, locking, serializer, layout, shape, write_behind, size, threads, processes = key
+        if locking:
+            backend = f"{backend}:{locking}"
+        if shape != "string":
+            layout = f"{layout}/{shape}"
+        if write_behind:
+            layout = f"{layout}/cached"
+        name = f"{backend}/{serializer}/{layout} {size}B t={threads} p={processes}"
+        print(f"{name:<52} {new['calls_per_sec']:>10.0f} {throughput:>+7.1f}% "
+              f"{new['latency']['p99'] * 1000:>9.3f} {p99:>+7.1f}%")
+
+    missing = set(baseline) ^ set(candidate)
+    if missing:
+        print(f"\n{len(missing)} cases are only present in one of the files", file=sys.stderr)
+    if args.fail_above is not None and -worst > args.fail_above:
+        print(f"\nThroughput dropped by {-worst:.1f}% (limit {args.fail_above}%)", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,411 @@
+"""
+Benchmark stateful calls across backends, serializers, state sizes and concurrency.
+
+Every case decorates a function that updates a counter next to a payload of
+the requested size and calls it repeatedly from one or more threads or
+processes. Results (calls/sec, latency percentiles and, for in-process runs,
+the per-phase timings from ``statefulpy.stats()``) are written as JSON so that
+runs from different commits can be compared with ``benchmarks/compare.py``.
+
+Redis cases use, in order of preference: ``--redis-url``, a ``redis-server``
+found on PATH (started on a free port and stopped afterwards), or
+``fakeredis`` as an in-process stand-in (thread runs only).
+
+Examples:
+    python benchmarks/run.py --quick
+    python benchmarks/run.py --backends sqlite --sizes 100 10000 --threads 1 4 -o before.json
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from typing import Any, Dict, List, Optional
+
+# Allow running from a source checkout without installing the package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+
+import statefulpy  # noqa: E402
+from statefulpy import stateful  # noqa: E402
+
+# The pickle serializer warns on every instantiation; benchmarks use trusted data
+warnings.filterwarnings("ignore", message=".*[Pp]ickle.*", category=UserWarning)
+
+DEFAULT_SIZES = [100, 10_000, 1_000_000, 10_000_000]
+QUICK_SIZES = [100, 10_000]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def make_function(case: Dict[str, Any], redis_url: Optional[str]) -> Any:
+    """Decorate a fresh benchmark function for a case."""
+    options: Dict[str, Any] = {
+        "serializer": case["serializer"],
+        "function_id": case["function_id"],
+    }
+    if case["backend"] not in ("shm", "log", "server"):
+        options["layout"] = case["layout"]
+    if case.get("write_behind"):
+        options["cache"] = True
+    if case["backend"] == "sqlite":
+        options["db_path"] = case["db_path"]
+        options["locking"] = case["locking"]
+        if case.get("synchronous"):
+            options["synchronous"] = case["synchronous"]
+        if case.get("group_commit"):
+            options["group_commit"] = True
+        if case.get("stream_threshold"):
+            options["stream_threshold"] = case["stream_threshold"]
+    elif case["backend"] == "redis":
+        options["redis_url"] = redis_url
+        options["prefix"] = case["prefix"]
+    elif case["backend"] == "shm":
+        options["name"] = case["shm_name"]
+    elif case["backend"] == "server":
+        options["socket_path"] = case["socket_path"]
+    elif case["backend"] == "log":
+        options["path"] = case["log_path"]
+        if case.get("sync"):
+            options["sync"] = case["sync"]
+    else:
+        options["name"] = case["prefix"]
+    nested = case.get("shape") == "nested"
+    if nested:
+        # Entries of about 50 serialized bytes; every call changes one in place
+        payload: Any = {f"k{i}": {"n": i, "tags": ["a", "b"]}
+                        for i in range(max(1, case["state_bytes"] // 50))}
+    else:
+        payload = "x" * case["state_bytes"]
+
+    @stateful(backend=case["backend"], **options)
+    def bench():
+        if "payload" not in bench.state:
+            bench.state["payload"] = payload
+            bench.state["calls"] = 0
+        bench.state["calls"] += 1
+        if nested:
+            bench.state["payload"]["k0"]["n"] += 1
+        return bench.state["calls"]
+
+    return bench
+
+
+def run_calls(func: Any, deadline: float, min_calls: int) -> List[float]:
+    """Call ``func`` until the deadline (and at least ``min_calls`` times); return latencies."""
+    latencies = []
+    perf_counter = time.perf_counter
+    while len(latencies) < min_calls or perf_counter() < deadline:
+        start = perf_counter()
+        func()
+        latencies.append(perf_counter() - start)
+    return latencies
+
+
+def _process_worker(case: Dict[str, Any], redis_url: Optional[str], duration: float,
+                    min_calls: int, start_at: float, queue: Any) -> None:
+    """Entry point of a benchmark process; reports its latencies through ``queue``."""
+    func = make_function(case, redis_url)
+    func()  # Warm up: create the connection and load the state
+    while time.time() < start_at:
+        time.sleep(0.001)
+    begin = time.perf_counter()
+    latencies = run_calls(func, begin + duration, min_calls)
+    queue.put((latencies, time.perf_counter() - begin))
+
+
+def run_case(case: Dict[str, Any], redis_url: Optional[str], duration: float,
+             min_calls: int) -> Dict[str, Any]:
+    """Run one benchmark case and summarize it."""
+    statefulpy.reset_stats()
+    all_latencies: List[float] = []
+
+    if case["processes"] > 1:
+        context = multiprocessing.get_context("spawn")
+        queue = context.Queue()
+        # Start all workers together once they had time to import and warm up
+        start_at = time.time() + 2.0 + 0.2 * case["processes"]
+        workers = [
+            context.Process(target=_process_worker,
+                            args=(case, redis_url, duration, min_calls, start_at, queue))
+            for _ in range(case["processes"])
+        ]
+        for worker in workers:
+            worker.start()
+        elapsed = 0.0
+        for _ in workers:
+            latencies, seconds = queue.get()
+            all_latencies.extend(latencies)
+            elapsed = max(elapsed, seconds)
+        for worker in workers:
+            worker.join()
+    else:
+        func = make_function(case, redis_url)
+        func()
+        statefulpy.reset_stats()
+        results: List[List[float]] = [[] for _ in range(case["threads"])]
+        barrier = threading.Barrier(case["threads"])
+
+        def thread_main(index: int) -> None:
+            barrier.wait()
+            results[index] = run_calls(func, time.perf_counter() + duration, min_calls)
+
+        threads = [threading.Thread(target=thread_main, args=(i,)) for i in range(case["threads"])]
+        begin = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - begin
+        for latencies in results:
+            all_latencies.extend(latencies)
+
+    all_latencies.sort()
+    summary = {key: value for key, value in case.items()
+               if key not in ("db_path", "prefix", "function_id", "shm_name", "log_path",
+                              "socket_path")}
+    summary.update({
+        "calls": len(all_latencies),
+        "seconds": elapsed,
+        "calls_per_sec": len(all_latencies) / elapsed if elapsed else 0.0,
+        "latency": {
+            "mean": sum(all_latencies) / len(all_latencies) if all_latencies else 0.0,
+            "p50": percentile(all_latencies, 0.50),
+            "p90": percentile(all_latencies, 0.90),
+            "p99": percentile(all_latencies, 0.99),
+            "max": all_latencies[-1] if all_latencies else 0.0,
+        },
+    })
+    if case["processes"] == 1:
+        phases = statefulpy.stats(case["function_id"])
+        summary["phases"] = {
+            phase: {key: values[key] for key in ("count", "mean", "p50", "p99", "max")}
+            for phase, values in phases.items()
+        }
+    return summary
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+class RedisServer:
+    """Locates or starts the Redis server used by the benchmark."""
+
+    def __init__(self, url: Optional[str]):
+        self.url = url
+        self.kind = "external" if url else None
+        self._process: Optional[subprocess.Popen] = None
+        self._tempdir: Optional[str] = None
+
+    def start(self) -> Optional[str]:
+        """Return a description of the server in use, or None if Redis is unavailable."""
+        if self.url:
+            return self.kind
+        executable = shutil.which("redis-server")
+        if executable:
+            port = free_port()
+            self._tempdir = tempfile.mkdtemp(prefix="statefulpy-bench-redis-")
+            self._process = subprocess.Popen(
+                [executable, "--port", str(port), "--save", "", "--appendonly", "no",
+                 "--dir", self._tempdir],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            self.url = f"redis://127.0.0.1:{port}/0"
+            self.kind = "redis-server"
+            self._wait_until_ready()
+            return self.kind
+        try:
+            import fakeredis
+            import redis
+            import redis.asyncio
+        except ImportError:
+            return None
+        # In-process stand-in: every client shares one fake server
+        server = fakeredis.FakeServer()
+        redis.from_url = lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs)
+        self.url = "redis://fakeredis/0"
+        self.kind = "fakeredis"
+        return self.kind
+
+    def _wait_until_ready(self) -> None:
+        import redis
+        client = redis.from_url(self.url)
+        for _ in range(100):
+            try:
+                client.ping()
+                return
+            except redis.ConnectionError:
+                time.sleep(0.05)
+        raise RuntimeError("redis-server did not start")
+
+    def stop(self) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+        if self._tempdir is not None:
+            shutil.rmtree(self._tempdir, ignore_errors=True)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backends", nargs="+", default=["sqlite", "redis"],
+                        choices=["sqlite", "redis", "memory", "shm", "log", "server"])
+    parser.add_argument("--serializers", nargs="+", default=["pickle", "json"])
+    parser.add_argument("--layouts", nargs="+", default=["blob"], choices=["blob", "fields"])
+    parser.add_argument("--sqlite-locking", nargs="+", default=["file"],
+                        choices=["file", "transaction"], help="SQLite locking modes")
+    parser.add_argument("--sqlite-synchronous", choices=["OFF", "NORMAL", "FULL", "EXTRA"],
+                        help="PRAGMA synchronous for SQLite cases (default: SQLite's)")
+    parser.add_argument("--sqlite-group-commit", action="store_true",
+                        help="Commit SQLite saves through the group-commit writer thread")
+    parser.add_argument("--sqlite-stream-threshold", type=int,
+                        help="Stream SQLite states of at least this many bytes with blob I/O")
+    parser.add_argument("--log-sync", choices=["always", "interval", "none"],
+                        help="When the log backend fsyncs appends (default: the backend's)")
+    parser.add_argument("--sizes", nargs="+", type=int, default=None,
+                        help="State payload sizes in bytes (default: 100 B to 10 MB)")
+    parser.add_argument("--shapes", nargs="+", default=["string"], choices=["string", "nested"],
+                        help="Payload of one string, or a dict of small dicts changed in place")
+    parser.add_argument("--write-behind", action="store_true",
+                        help="Decorate with cache=True; multi-process cases are skipped")
+    parser.add_argument("--threads", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--processes", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--duration", type=float, default=2.0,
+                        help="Seconds to run each case (default: 2)")
+    parser.add_argument("--min-calls", type=int, default=3,
+                        help="Minimum calls per thread or process (default: 3)")
+    parser.add_argument("--redis-url", help="Use this Redis server instead of starting one")
+    parser.add_argument("--quick", action="store_true",
+                        help="Small sizes, single-threaded and 0.5 s per case")
+    parser.add_argument("-o", "--output", help="Write results to this file (default: stdout)")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.sizes = args.sizes or QUICK_SIZES
+        args.threads, args.processes, args.duration = [1], [1], 0.5
+    args.sizes = args.sizes or DEFAULT_SIZES
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="statefulpy-bench-")
+    redis_server = RedisServer(args.redis_url)
+    redis_kind = redis_server.start() if "redis" in args.backends else None
+    if "redis" in args.backends and redis_kind is None:
+        print("Redis is not available; skipping redis cases", file=sys.stderr)
+
+    state_server = None
+    if "server" in args.backends:
+        # Run the state server in this process; cases connect over its socket
+        from statefulpy.server import StateServer
+        state_server = StateServer(os.path.join(workdir, "state.sock"),
+                                   db_path=os.path.join(workdir, "server.db"))
+        threading.Thread(target=state_server.serve_forever, daemon=True).start()
+
+    results = []
+    try:
+        # Threads and processes are varied separately: N threads in one
+        # process, or N single-threaded processes
+        concurrency = sorted({(t, 1) for t in args.threads} | {(1, p) for p in args.processes})
+        for number, (backend, locking, serializer, layout, shape, size, (threads, processes)) in enumerate(
+                itertools.product(args.backends, args.sqlite_locking, args.serializers,
+                                  args.layouts, args.shapes, args.sizes, concurrency)):
+            if backend == "redis" and (redis_kind is None or locking != args.sqlite_locking[0] or
+                                       (redis_kind == "fakeredis" and processes > 1)):
+                continue
+            # Write-behind state belongs to a single process
+            if args.write_behind and processes > 1:
+                continue
+            # Memory stores and logs are private to a process
+            if backend in ("memory", "log") and (locking != args.sqlite_locking[0] or processes > 1):
+                continue
+            # These backends have no storage layouts
+            if backend in ("shm", "log", "server") and (
+                    locking != args.sqlite_locking[0] or layout != "blob"):
+                continue
+            case = {
+                "backend": backend,
+                "locking": locking if backend == "sqlite" else None,
+                "synchronous": args.sqlite_synchronous if backend == "sqlite" else None,
+                "group_commit": args.sqlite_group_commit if backend == "sqlite" else None,
+                "stream_threshold": args.sqlite_stream_threshold if backend == "sqlite" else None,
+                "sync": args.log_sync if backend == "log" else None,
+                "serializer": serializer,
+                "layout": layout,
+                "shape": shape,
+                "write_behind": args.write_behind,
+                "state_bytes": size,
+                "threads": threads,
+                "processes": processes,
+                "function_id": f"bench_{number}",
+                "db_path": os.path.join(workdir, f"bench_{number}.db"),
+                "prefix": f"statefulpy-bench:{os.getpid()}:{number}:",
+                "shm_name": f"spybench{os.getpid()}_{number}",
+                "log_path": os.path.join(workdir, f"bench_{number}.log"),
+                "socket_path": state_server.socket_path if state_server else None,
+            }
+            mode = f"{backend}:{locking}" if backend == "sqlite" else backend
+            print(f"{mode}/{serializer}/{layout} {shape} {size} B, {threads} threads, "
+                  f"{processes} processes ...", file=sys.stderr)
+            results.append(run_case(case, redis_server.url, args.duration, args.min_calls))
+            if backend == "shm":
+                from statefulpy.backends.shm import SharedMemoryBackend
+                SharedMemoryBackend(name=case["shm_name"]).unlink()
+    finally:
+        redis_server.stop()
+        if state_server is not None:
+            state_server.shutdown()
+            state_server.server_close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "statefulpy_version": statefulpy.__version__,
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "redis": redis_kind,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "duration_per_case": args.duration,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
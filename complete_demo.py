@@ -18,7 +18,8 @@ import time
 import random
 import os
 from datetime import datetime
-from statefulpy import stateful, set_backend
+from statefulpy import stateful, stateful_cache, set_backend
+from statefulpy.containers import CappedDeque
 
 # -----------------------------------------------------------------------------
 # PART 1: Basic Usage - SQLite Backend (Default)
@@ -56,43 +57,19 @@ print("The state is automatically saved to demo.db in the current directory.")
 # -----------------------------------------------------------------------------
 print("\n=== PART 2: Function Caching/Memoization ===\n")
 
-@stateful(backend="sqlite", db_path="demo.db")
+@stateful_cache(backend="sqlite", db_path="demo.db", maxsize=1000)
 def fibonacci(n):
     """
     Calculate the nth Fibonacci number with persistent caching.
     
-    This function demonstrates how stateful functions can be used
-    for memoization/caching, with the cache persisting between runs.
-    
-    This version uses an iterative approach to avoid recursion lock issues.
+    stateful_cache stores every result under a hash of its arguments, so
+    results persist between runs and a lookup reads only the entry it needs.
+    The least recently used results are evicted beyond maxsize entries.
     """
-    # Initialize the cache if it doesn't exist
-    if "cache" not in fibonacci.state:
-        print("Initializing fibonacci cache...")
-        fibonacci.state["cache"] = {0: 0, 1: 1}
-    
-    # Check if we've already calculated this value
-    if n in fibonacci.state["cache"]:
-        print(f"Cache hit for fibonacci({n})")
-        return fibonacci.state["cache"][n]
-    
-    # Calculate iteratively to avoid recursive locking issues
-    print(f"Cache miss for fibonacci({n}), calculating iteratively...")
-    
-    # Find the highest number we've already cached
-    highest_cached = max(fibonacci.state["cache"].keys())
-    if highest_cached < n:
-        # Start from our highest cached value
-        a = fibonacci.state["cache"][highest_cached-1] if highest_cached > 0 else 0
-        b = fibonacci.state["cache"][highest_cached]
-        
-        # Fill in all missing values in sequence
-        for i in range(highest_cached + 1, n + 1):
-            a, b = b, a + b
-            fibonacci.state["cache"][i] = b
-            print(f"Cached fibonacci({i}) = {b}")
-    
-    return fibonacci.state["cache"][n]
+    print(f"Cache miss for fibonacci({n}), calculating...")
+    if n < 2:
+        return n
+    return fibonacci(n - 1) + fibonacci(n - 2)
 
 # Calculate some Fibonacci numbers
 print(f"Fibonacci(10): {fibonacci(10)}")
@@ -259,7 +236,7 @@ def analytics_tracker(event=None, metadata=None):
     # Initialize with a more complex structure
     if "data" not in analytics_tracker.state:
         analytics_tracker.state["data"] = {
-            "events": [],
+            "events": CappedDeque(maxlen=100),
             "event_counts": {},
             "first_seen": str(datetime.now()),
             "last_seen": None,
@@ -277,9 +254,8 @@ def analytics_tracker(event=None, metadata=None):
             "timestamp": str(datetime.now())
         }
         
-        # Add to events list (keep only the last 100 events to prevent unbounded growth)
+        # The capped deque keeps only the last 100 events to prevent unbounded growth
         analytics_tracker.state["data"]["events"].append(event_data)
-        analytics_tracker.state["data"]["events"] = analytics_tracker.state["data"]["events"][-100:]
         
         # Update event counts
         analytics_tracker.state["data"]["event_counts"][event] = \
@@ -8,12 +8,14 @@ recover function-internal state like counters, caches, and partial results.
 __version__ = "0.1.3"
 
 # Import core components to make them available at the package level
-from statefulpy.decorator import stateful, _flush_all_state
+from statefulpy.decorator import stateful, StateConflictError, _flush_all_state
+from statefulpy.cache import stateful_cache
+from statefulpy.containers import LRUDict, TTLDict, CappedDeque
 from statefulpy.config import set_backend, get_config
+from statefulpy.metrics import stats, reset_stats
 
-# Register exit handlers for graceful shutdown
-import atexit
-atexit.register(_flush_all_state)
+# The decorator module registers its own exit handler that flushes pending
+# state (honouring save_on_exit) and releases locks.
 
 def flush_state() -> None:
     """Force flush of all pending state to the backend."""
@@ -21,7 +23,14 @@ def flush_state() -> None:
 
 __all__ = [
     "stateful",
+    "stateful_cache",
     "set_backend",
     "get_config",
     "flush_state",
+    "stats",
+    "reset_stats",
+    "StateConflictError",
+    "LRUDict",
+    "TTLDict",
+    "CappedDeque",
 ]
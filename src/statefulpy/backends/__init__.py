@@ -1,4 +1,11 @@
 """
 Backend implementations for StatefulPy.
 """
-from statefulpy.backends.base import StateBackend, register_backend, get_backend
+from statefulpy.backends.base import (
+    StateBackend,
+    AsyncStateBackend,
+    register_backend,
+    register_async_backend,
+    get_backend,
+    get_async_backend,
+)
@@ -2,10 +2,35 @@
 Base interface for state persistence backends.
 """
 from abc import ABC, abstractmethod
+import asyncio
 import typing as t
 import importlib
 from typing import Any, cast
 
+# Durability levels accepted by the ``durability`` option of the built-in backends
+DURABILITY_LEVELS = ("strict", "normal", "relaxed")
+
+
+def check_durability(durability: t.Optional[str]) -> t.Optional[str]:
+    """
+    Validate a durability level.
+    
+    Args:
+        durability: 'strict', 'normal', 'relaxed' or None for the backend default
+        
+    Returns:
+        The durability level
+        
+    Raises:
+        ValueError: If the level is unknown
+    """
+    if durability is not None and durability not in DURABILITY_LEVELS:
+        raise ValueError(
+            f"Unknown durability level: {durability}. "
+            f"Valid levels are: {', '.join(DURABILITY_LEVELS)}"
+        )
+    return durability
+
 
 class StateBackend(ABC):
     """Abstract base class for state persistence backends."""
@@ -20,6 +45,89 @@ class StateBackend(ABC):
         """Save state for the given function ID."""
         pass
     
+    def get_version(self, fn_id: str) -> t.Optional[int]:
+        """
+        Return the version of the stored state for the given function ID.
+        
+        Versions increase on every save and are 0 for missing state. Backends
+        that do not track versions return None, which makes callers reload the
+        state every time.
+        """
+        return None
+    
+    def load_state_versioned(self, fn_id: str) -> t.Tuple[t.Optional[dict], t.Optional[int]]:
+        """Load state together with its version for the given function ID."""
+        return self.load_state(fn_id), self.get_version(fn_id)
+    
+    def load_fields(self, fn_id: str, fields: t.Iterable[str]) -> dict:
+        """
+        Load a subset of the top-level keys of the state for the given function ID.
+        
+        Backends with field-level storage read only the requested keys; the
+        default implementation loads the whole state.
+        """
+        state = self.load_state(fn_id) or {}
+        return {field: state[field] for field in fields if field in state}
+    
+    def save_state_versioned(self, fn_id: str, data: dict,
+                             changed: t.Optional[t.Set[str]] = None) -> t.Tuple[bool, t.Optional[int]]:
+        """
+        Save state for the given function ID and return the new version.
+        
+        Args:
+            fn_id: Function identifier
+            data: The full state
+            changed: Top-level keys that changed since the state was loaded.
+                Backends with field-level storage write only these; others
+                ignore the hint and save the full state.
+        
+        Returns:
+            A tuple of (success, new version or None if versions are not tracked)
+        """
+        if not self.save_state(fn_id, data):
+            return False, None
+        return True, self.get_version(fn_id)
+    
+    def compare_and_swap(self, fn_id: str, data: dict,
+                         expected_version: t.Optional[int],
+                         changed: t.Optional[t.Set[str]] = None) -> t.Tuple[bool, t.Optional[int]]:
+        """
+        Save state only if its stored version still equals ``expected_version``.
+        
+        The default implementation emulates the conditional write with the
+        backend lock; backends override it with a native conditional update.
+        ``changed`` is the same hint as for :meth:`save_state_versioned`.
+        
+        Returns:
+            A tuple of (saved, new version). ``saved`` is False if the version
+            changed in the meantime or the write failed.
+        """
+        if not self.acquire_lock(fn_id):
+            return False, None
+        try:
+            current = self.get_version(fn_id)
+            if current is not None and current != expected_version:
+                return False, None
+            return self.save_state_versioned(fn_id, data, changed=changed)
+        finally:
+            self.release_lock(fn_id)
+    
+    def save_and_release(self, fn_id: str, data: dict,
+                         changed: t.Optional[t.Set[str]] = None) -> t.Tuple[bool, t.Optional[int]]:
+        """
+        Save state like :meth:`save_state_versioned`, then release the lock.
+        
+        The lock is released even if the save fails. Backends override this to
+        combine both in a single round trip.
+        
+        Returns:
+            A tuple of (success, new version) of the save
+        """
+        try:
+            return self.save_state_versioned(fn_id, data, changed=changed)
+        finally:
+            self.release_lock(fn_id)
+    
     @abstractmethod
     def acquire_lock(self, fn_id: str, timeout: float = 10.0) -> bool:
         """Acquire a lock for the given function ID."""
@@ -36,9 +144,141 @@ class StateBackend(ABC):
         pass
 
 
+class AsyncStateBackend(ABC):
+    """
+    Abstract base class for non-blocking state persistence backends.
+    
+    Mirrors :class:`StateBackend` with coroutine methods; used for stateful
+    ``async def`` functions so that I/O and lock waits never block the event loop.
+    """
+    
+    @abstractmethod
+    async def load_state(self, fn_id: str) -> t.Optional[dict]:
+        """Load state for the given function ID."""
+        pass
+    
+    @abstractmethod
+    async def save_state(self, fn_id: str, data: dict) -> bool:
+        """Save state for the given function ID."""
+        pass
+    
+    async def get_version(self, fn_id: str) -> t.Optional[int]:
+        """Return the version of the stored state (see :meth:`StateBackend.get_version`)."""
+        return None
+    
+    async def load_state_versioned(self, fn_id: str) -> t.Tuple[t.Optional[dict], t.Optional[int]]:
+        """Load state together with its version for the given function ID."""
+        return await self.load_state(fn_id), await self.get_version(fn_id)
+    
+    async def load_fields(self, fn_id: str, fields: t.Iterable[str]) -> dict:
+        """Load a subset of the top-level keys of the state (see :meth:`StateBackend.load_fields`)."""
+        state = await self.load_state(fn_id) or {}
+        return {field: state[field] for field in fields if field in state}
+    
+    async def save_state_versioned(self, fn_id: str, data: dict,
+                                   changed: t.Optional[t.Set[str]] = None) -> t.Tuple[bool, t.Optional[int]]:
+        """Save state and return (success, new version) (see :meth:`StateBackend.save_state_versioned`)."""
+        if not await self.save_state(fn_id, data):
+            return False, None
+        return True, await self.get_version(fn_id)
+    
+    async def compare_and_swap(self, fn_id: str, data: dict,
+                               expected_version: t.Optional[int],
+                               changed: t.Optional[t.Set[str]] = None) -> t.Tuple[bool, t.Optional[int]]:
+        """Save state only if its version still equals ``expected_version``."""
+        if not await self.acquire_lock(fn_id):
+            return False, None
+        try:
+            current = await self.get_version(fn_id)
+            if current is not None and current != expected_version:
+                return False, None
+            return await self.save_state_versioned(fn_id, data, changed=changed)
+        finally:
+            await self.release_lock(fn_id)
+    
+    async def save_and_release(self, fn_id: str, data: dict,
+                               changed: t.Optional[t.Set[str]] = None) -> t.Tuple[bool, t.Optional[int]]:
+        """Save state, then release the lock (see :meth:`StateBackend.save_and_release`)."""
+        try:
+            return await self.save_state_versioned(fn_id, data, changed=changed)
+        finally:
+            await self.release_lock(fn_id)
+    
+    @abstractmethod
+    async def acquire_lock(self, fn_id: str, timeout: float = 10.0) -> bool:
+        """Acquire a lock for the given function ID."""
+        pass
+    
+    @abstractmethod
+    async def release_lock(self, fn_id: str) -> bool:
+        """Release the lock for the given function ID."""
+        pass
+    
+    @abstractmethod
+    async def close(self) -> None:
+        """Close any resources used by the backend."""
+        pass
+
+
+class AsyncRLock:
+    """
+    A reentrant asyncio lock owned by the task that acquired it.
+    
+    The same task may acquire it several times; it is released once every
+    acquisition has been matched by a release. The underlying asyncio lock is
+    created lazily so that it binds to the running event loop.
+    """
+    
+    def __init__(self) -> None:
+        self._lock: t.Optional[asyncio.Lock] = None
+        self._owner: t.Optional["asyncio.Task[t.Any]"] = None
+        self._count = 0
+    
+    async def acquire(self, timeout: t.Optional[float] = None) -> bool:
+        """Acquire the lock, returning False if it could not be taken within ``timeout``."""
+        task = asyncio.current_task()
+        if self._owner is not None and self._owner is task:
+            self._count += 1
+            return True
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        try:
+            await asyncio.wait_for(self._lock.acquire(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._owner = task
+        self._count = 1
+        return True
+    
+    def owned(self) -> bool:
+        """Return True if the current task holds the lock."""
+        return self._owner is not None and self._owner is asyncio.current_task()
+    
+    def release(self) -> bool:
+        """Release one acquisition; returns False if the current task does not own the lock."""
+        if self._lock is None or not self.owned():
+            return False
+        self._count -= 1
+        if self._count == 0:
+            self._owner = None
+            self._lock.release()
+        return True
+    
+    async def __aenter__(self) -> "AsyncRLock":
+        await self.acquire()
+        return self
+    
+    async def __aexit__(self, *exc_info: t.Any) -> None:
+        self.release()
+
+
 _BACKENDS = {
     'sqlite': 'statefulpy.backends.sqlite:SQLiteBackend',
     'redis': 'statefulpy.backends.redis:RedisBackend',
+    'memory': 'statefulpy.backends.memory:MemoryBackend',
+    'shm': 'statefulpy.backends.shm:SharedMemoryBackend',
+    'log': 'statefulpy.backends.log:LogBackend',
+    'server': 'statefulpy.backends.server:ServerBackend',
 }
 
 
@@ -57,3 +297,26 @@ def get_backend(backend_type: str, **kwargs: Any) -> StateBackend:
     backend_class = getattr(module, class_name)
     backend = backend_class(**kwargs)
     return cast(StateBackend, backend)
+
+
+_ASYNC_BACKENDS = {
+    'sqlite': 'statefulpy.backends.sqlite:AsyncSQLiteBackend',
+    'redis': 'statefulpy.backends.redis:AsyncRedisBackend',
+}
+
+
+def register_async_backend(name: str, backend_path: str) -> None:
+    """Register a custom non-blocking backend implementation."""
+    _ASYNC_BACKENDS[name] = backend_path
+
+
+def get_async_backend(backend_type: str, **kwargs: Any) -> AsyncStateBackend:
+    """Get a non-blocking backend instance by type."""
+    if backend_type not in _ASYNC_BACKENDS:
+        raise ValueError(f"No asyncio backend available for type: {backend_type}")
+    
+    module_path, class_name = _ASYNC_BACKENDS[backend_type].split(':')
+    module = importlib.import_module(module_path)
+    backend_class = getattr(module, class_name)
+    backend = backend_class(**kwargs)
+    return cast(AsyncStateBackend, backend)
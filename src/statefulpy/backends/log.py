@@ -0,0 +1,701 @@
+"""
+Log-structured backend for statefulpy.
+
+Saves are appended to segment files in a directory instead of overwriting the
+stored value, so every write is sequential. A save is either a full state or,
+when the caller names the keys that changed, a delta holding only those keys;
+loading a state reads its last full record and the deltas written after it.
+An in-memory index maps each function id to these records. It is rebuilt by
+replaying the segments when the log is opened.
+
+Segments are sealed once they reach ``segment_size`` bytes. A background
+thread compacts the sealed segments into one when enough of their bytes
+belong to superseded records, copying the live records verbatim.
+
+Record format (little endian)::
+
+    crc32 (4) | key length (4) | value length (4) | version (8) | kind (1) | key | value
+
+The CRC covers everything after itself; a torn record at the end of the
+newest segment, left by a crash, is truncated on recovery.
+
+The log belongs to one process: it is locked when opened, and backends for
+the same directory in one process share it.
+"""
+import logging
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Set, Tuple, cast
+
+import portalocker
+
+from statefulpy import metrics
+from statefulpy.backends.base import StateBackend, check_durability
+from statefulpy.serializers import get_serializer
+
+logger = logging.getLogger(__name__)
+
+_RECORD = struct.Struct("<IIIQB")
+_FULL = 0
+_DELTA = 1
+
+_SEGMENT_NAME = re.compile(r"^(\d{8})\.log$")
+
+_SYNC_MODES = ("always", "interval", "none")
+
+# Sync mode used for each durability level unless set explicitly
+_DURABILITY_SYNC = {"strict": "always", "normal": "interval", "relaxed": "none"}
+
+# A record's location: (segment id, offset, length)
+_Location = Tuple[int, int, int]
+
+
+class _Entry:
+    """Index entry: the version of a state and its last full record followed by deltas."""
+
+    __slots__ = ("version", "chain")
+
+    def __init__(self, version: int, chain: List[_Location]):
+        self.version = version
+        self.chain = chain
+
+
+def _segment_file(path: str, segment: int) -> str:
+    return os.path.join(path, f"{segment:08d}.log")
+
+
+def _fsync_directory(path: str) -> None:
+    """Persist file creations and renames in a directory."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _Log:
+    """Segment files, index and background threads of one log directory."""
+
+    def __init__(self, path: str, segment_size: int, sync: str, sync_interval: float,
+                 compact_ratio: float, compact_interval: Optional[float]):
+        self.path = path
+        self.settings = (segment_size, sync, sync_interval, compact_ratio, compact_interval)
+        self.segment_size = segment_size
+        self.sync = sync
+        self.compact_ratio = compact_ratio
+        # Number of open backends using the log
+        self.users = 0
+        # Function locks, shared by all backends using the log
+        self.locks: Dict[str, threading.RLock] = {}
+        self._locks_mutex = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+        self._dir_lock = portalocker.Lock(os.path.join(path, "LOCK"), mode="a",
+                                          timeout=0, fail_when_locked=True)
+        try:
+            self._dir_lock.acquire()
+        except portalocker.exceptions.LockException:
+            raise ValueError(f"Log {path} is already open in another process")
+
+        # Guards the index, the segment bookkeeping and appends
+        self._lock = threading.Lock()
+        self.index: Dict[str, _Entry] = {}
+        self._fds: Dict[int, int] = {}
+        self._sizes: Dict[int, int] = {}
+        self._live: Dict[int, int] = {}
+        self._active = 0
+        # Bytes appended and bytes known to be on disk, for group fsync
+        self._appended = 0
+        self._synced = 0
+        self._syncing = False
+        self._sync_cond = threading.Condition()
+        self._compact_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._wakeup = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+        try:
+            self._recover()
+        except BaseException:
+            self._close_files()
+            self._dir_lock.release()
+            raise
+
+        if sync == "interval":
+            self._start(self._sync_loop, sync_interval, "sync")
+        if compact_interval is not None:
+            self._start(self._compact_loop, compact_interval, "compact")
+
+    def lock_for(self, fn_id: str) -> threading.RLock:
+        """Return the lock of a function, creating it on first use."""
+        with self._locks_mutex:
+            lock = self.locks.get(fn_id)
+            if lock is None:
+                lock = self.locks[fn_id] = threading.RLock()
+            return lock
+
+    def _start(self, target: Any, interval: float, role: str) -> None:
+        thread = threading.Thread(target=target, args=(interval,),
+                                  name=f"statefulpy-log-{role}", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    # Recovery
+
+    def _recover(self) -> None:
+        """Rebuild the index by replaying all segments in order."""
+        segments = sorted(int(match.group(1)) for match in map(_SEGMENT_NAME.match, os.listdir(self.path))
+                          if match)
+        for position, segment in enumerate(segments):
+            newest = position == len(segments) - 1
+            with open(_segment_file(self.path, segment), "rb") as f:
+                data = f.read()
+            valid = self._replay(segment, data)
+            if valid < len(data):
+                if newest:
+                    logger.warning(f"Truncating torn record at offset {valid} of log segment {segment}")
+                    with open(_segment_file(self.path, segment), "r+b") as f:
+                        f.truncate(valid)
+                else:
+                    logger.error(f"Ignoring corrupt records after offset {valid} of log segment {segment}")
+            self._fds[segment] = os.open(_segment_file(self.path, segment), os.O_RDONLY)
+            self._sizes[segment] = valid
+            self._live.setdefault(segment, 0)
+
+        if segments and self._sizes[segments[-1]] < self.segment_size:
+            # Keep appending to the newest segment
+            self._active = segments[-1]
+            os.close(self._fds[self._active])
+        else:
+            self._active = segments[-1] + 1 if segments else 1
+            self._sizes[self._active] = 0
+            self._live[self._active] = 0
+        self._fds[self._active] = os.open(_segment_file(self.path, self._active),
+                                          os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self._appended = self._synced = sum(self._sizes.values())
+
+    def _replay(self, segment: int, data: bytes) -> int:
+        """Add the records of a segment to the index; return the length of its valid prefix."""
+        offset = 0
+        while offset + _RECORD.size <= len(data):
+            crc, key_len, value_len, version, kind = _RECORD.unpack_from(data, offset)
+            end = offset + _RECORD.size + key_len + value_len
+            if end > len(data) or zlib.crc32(data[offset + 4:end]) != crc or kind not in (_FULL, _DELTA):
+                break
+            key_start = offset + _RECORD.size
+            fn_id = data[key_start:key_start + key_len].decode("utf-8")
+            if kind == _FULL or fn_id in self.index:
+                self._index(fn_id, version, kind, (segment, offset, end - offset))
+            offset = end
+        return offset
+
+    def _index(self, fn_id: str, version: int, kind: int, location: _Location) -> None:
+        """Point the index at a new record; needs the lock."""
+        entry = self.index.get(fn_id)
+        if entry is None:
+            entry = self.index[fn_id] = _Entry(version, [])
+        if kind == _FULL:
+            for segment, _, length in entry.chain:
+                self._live[segment] -= length
+            entry.chain = []
+        entry.chain.append(location)
+        entry.version = version
+        self._live[location[0]] = self._live.get(location[0], 0) + location[2]
+
+    # Reads and writes
+
+    def chain_length(self, fn_id: str) -> int:
+        """Return the number of records a load of the state reads, 0 if it does not exist."""
+        with self._lock:
+            entry = self.index.get(fn_id)
+            return len(entry.chain) if entry is not None else 0
+
+    def version(self, fn_id: str) -> int:
+        with self._lock:
+            entry = self.index.get(fn_id)
+            return entry.version if entry is not None else 0
+
+    def read(self, fn_id: str) -> Tuple[int, List[Tuple[int, bytes]]]:
+        """Return the version of a state and the (kind, value) of its records."""
+        with self._lock:
+            entry = self.index.get(fn_id)
+            if entry is None:
+                return 0, []
+            records = []
+            for segment, offset, length in entry.chain:
+                data = os.pread(self._fds[segment], length, offset)
+                _, key_len, _, _, kind = _RECORD.unpack_from(data, 0)
+                records.append((kind, data[_RECORD.size + key_len:]))
+            return entry.version, records
+
+    def append(self, fn_id: str, kind: int, value: bytes,
+               expected_version: Optional[int] = None) -> Optional[int]:
+        """
+        Append a record and wait until it is synced as the sync mode requires.
+
+        Returns:
+            The new version; None if ``expected_version`` did not match or a
+            delta was given for a state that has no full record
+        """
+        key = fn_id.encode("utf-8")
+        with self._lock:
+            entry = self.index.get(fn_id)
+            version = entry.version if entry is not None else 0
+            if expected_version is not None and version != expected_version:
+                return None
+            if kind == _DELTA and entry is None:
+                return None
+            body = struct.pack("<IIQB", len(key), len(value), version + 1, kind) + key + value
+            record = struct.pack("<I", zlib.crc32(body)) + body
+            if self._sizes[self._active] and self._sizes[self._active] + len(record) > self.segment_size:
+                self._roll()
+            offset = self._sizes[self._active]
+            view = memoryview(record)
+            while view:
+                view = view[os.write(self._fds[self._active], view):]
+            self._sizes[self._active] += len(record)
+            self._appended += len(record)
+            position = self._appended
+            self._index(fn_id, version + 1, kind, (self._active, offset, len(record)))
+        if self.sync == "always":
+            self._sync_to(position)
+        return version + 1
+
+    def _roll(self) -> None:
+        """Seal the active segment and start a new one; needs the lock."""
+        os.fsync(self._fds[self._active])
+        with self._sync_cond:
+            self._synced = max(self._synced, self._appended)
+            self._sync_cond.notify_all()
+        self._active += 1
+        self._fds[self._active] = os.open(_segment_file(self.path, self._active),
+                                          os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self._sizes[self._active] = 0
+        self._live[self._active] = 0
+        _fsync_directory(self.path)
+        self._wakeup.set()
+
+    def _sync_to(self, position: int) -> None:
+        """
+        Wait until the first ``position`` appended bytes are on disk.
+
+        Concurrent writers share fsyncs: one of them syncs everything appended
+        so far while the others wait for it.
+        """
+        while True:
+            with self._sync_cond:
+                while self._syncing and self._synced < position:
+                    self._sync_cond.wait()
+                if self._synced >= position:
+                    return
+                self._syncing = True
+            synced = self._sync_active()
+            with self._sync_cond:
+                self._syncing = False
+                self._synced = max(self._synced, synced)
+                self._sync_cond.notify_all()
+
+    def _sync_active(self) -> int:
+        """Fsync the active segment; return the number of appended bytes now on disk."""
+        with self._lock:
+            target = self._appended
+            fd = self._fds[self._active]
+        try:
+            os.fsync(fd)
+        except OSError as e:
+            logger.error(f"Error syncing log {self.path}: {e}")
+            return 0
+        return target
+
+    def _sync_loop(self, interval: float) -> None:
+        """Background fsync of the active segment."""
+        while not self._stopped.wait(interval):
+            with self._sync_cond:
+                if self._syncing or self._synced >= self._appended:
+                    continue
+                self._syncing = True
+            synced = self._sync_active()
+            with self._sync_cond:
+                self._syncing = False
+                self._synced = max(self._synced, synced)
+                self._sync_cond.notify_all()
+
+    # Compaction
+
+    def garbage_ratio(self) -> float:
+        """Fraction of the bytes of sealed segments that belong to superseded records."""
+        with self._lock:
+            sealed = [segment for segment in self._sizes if segment != self._active]
+            total = sum(self._sizes[segment] for segment in sealed)
+            live = sum(self._live.get(segment, 0) for segment in sealed)
+        return (total - live) / total if total else 0.0
+
+    def _compact_loop(self, interval: float) -> None:
+        """Background compaction of sealed segments."""
+        while not self._stopped.is_set():
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            if self.garbage_ratio() >= self.compact_ratio:
+                self.compact()
+
+    def compact(self) -> bool:
+        """
+        Merge all sealed segments into one that holds only their live records.
+
+        Live records are copied verbatim in their original order into a
+        temporary file, which then replaces the newest sealed segment; the
+        older sealed segments are deleted. A crash at any point leaves a log
+        that replays to the same state.
+
+        Returns:
+            True if the sealed segments were compacted or there were none
+        """
+        with self._compact_lock:
+            with self._lock:
+                sealed = sorted(segment for segment in self._sizes if segment != self._active)
+                if not sealed:
+                    return True
+                sealed_set = set(sealed)
+                moves = sorted(location for entry in self.index.values()
+                               for location in entry.chain if location[0] in sealed_set)
+                fds = {segment: self._fds[segment] for segment in sealed}
+
+            target = sealed[-1]
+            tmp_path = os.path.join(self.path, f"{target:08d}.compact")
+            mapping: Dict[_Location, _Location] = {}
+            try:
+                # Sealed segments are immutable, so they are read without the lock
+                fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                try:
+                    offset = 0
+                    for location in moves:
+                        segment, old_offset, length = location
+                        data = os.pread(fds[segment], length, old_offset)
+                        view = memoryview(data)
+                        while view:
+                            view = view[os.write(fd, view):]
+                        mapping[location] = (target, offset, length)
+                        offset += length
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                logger.error(f"Error compacting log {self.path}: {e}")
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                return False
+
+            with self._lock:
+                os.replace(tmp_path, _segment_file(self.path, target))
+                for entry in self.index.values():
+                    entry.chain = [mapping.get(location, location) for location in entry.chain]
+                for segment in sealed:
+                    del self._fds[segment], self._sizes[segment], self._live[segment]
+                if offset:
+                    self._fds[target] = os.open(_segment_file(self.path, target), os.O_RDONLY)
+                    self._sizes[target] = offset
+                    self._live[target] = offset
+            _fsync_directory(self.path)
+            # Without live records the merged segment is empty and removed as well
+            for segment in sealed if not offset else sealed[:-1]:
+                os.unlink(_segment_file(self.path, segment))
+
+            # A syncer may still be using a descriptor it read before the segment was sealed
+            with self._sync_cond:
+                while self._syncing:
+                    self._sync_cond.wait()
+                for fd in fds.values():
+                    os.close(fd)
+            logger.debug(f"Compacted {len(sealed)} segments of log {self.path} into {offset} bytes")
+            return True
+
+    def close(self) -> None:
+        """Stop the background threads, sync the active segment and release the log."""
+        self._stopped.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
+        with self._lock:
+            try:
+                os.fsync(self._fds[self._active])
+            except OSError as e:
+                logger.error(f"Error syncing log {self.path}: {e}")
+            self._close_files()
+        self._dir_lock.release()
+
+    def _close_files(self) -> None:
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+
+
+_logs: Dict[str, _Log] = {}
+_logs_lock = threading.Lock()
+
+
+def _get_log(path: str, *settings: Any) -> _Log:
+    """Return the open log of a directory, opening it on first use."""
+    path = os.path.abspath(path)
+    with _logs_lock:
+        log = _logs.get(path)
+        if log is None:
+            log = _logs[path] = _Log(path, *settings)
+        elif log.settings != settings:
+            raise ValueError(f"Log {path} is already open with different settings")
+        log.users += 1
+        return log
+
+
+def _release_log(log: _Log) -> None:
+    """Stop using a log; it is closed once no backend uses it."""
+    with _logs_lock:
+        log.users -= 1
+        if log.users > 0:
+            return
+        if _logs.get(log.path) is log:
+            del _logs[log.path]
+    log.close()
+
+
+class LogBackend(StateBackend):
+    """Backend that appends states to a log of segment files."""
+
+    def __init__(self, path: str = "statefulpy-log", serializer: str = "pickle",
+                 segment_size: int = 64 * 1024 * 1024, sync: Optional[str] = None,
+                 sync_interval: float = 1.0, compact_ratio: float = 0.5,
+                 compact_interval: Optional[float] = 30.0, max_deltas: int = 16,
+                 durability: Optional[str] = None):
+        """
+        Initialize the log backend.
+
+        Args:
+            path: Directory holding the segment files
+            serializer: Serializer to use ('pickle' or 'json'; e.g. 'json+zlib' to
+                compress large states)
+            segment_size: Bytes after which a segment is sealed and a new one started
+            sync: When appends are fsynced. With 'always' a save returns once
+                it is on disk; concurrent saves share fsyncs. With 'interval' a
+                background thread fsyncs every ``sync_interval`` seconds, so a
+                crash of the host can lose that much. With 'none' the OS decides.
+                Default: from ``durability``, otherwise 'interval'.
+            sync_interval: Seconds between fsyncs in 'interval' mode
+            compact_ratio: Compact once this fraction of the sealed segments'
+                bytes belongs to superseded records
+            compact_interval: Seconds between compaction checks (None to only
+                compact when :meth:`compact` is called)
+            max_deltas: Number of delta records after which the next save of a
+                state writes it in full, bounding the records read per load
+            durability: 'strict', 'normal' or 'relaxed'; selects the sync mode
+                ('always', 'interval' or 'none') unless ``sync`` is given
+
+        Raises:
+            ValueError: If an option is invalid or another process has the
+                log open
+        """
+        self.durability = check_durability(durability)
+        if sync is None:
+            sync = _DURABILITY_SYNC[durability] if durability is not None else "interval"
+        if sync not in _SYNC_MODES:
+            raise ValueError(f"Unknown sync mode: {sync}. Valid modes are: {', '.join(_SYNC_MODES)}")
+        if segment_size < 1:
+            raise ValueError("segment_size must be positive")
+        if sync_interval <= 0:
+            raise ValueError("sync_interval must be positive")
+        if not 0 < compact_ratio <= 1:
+            raise ValueError("compact_ratio must be greater than 0 and at most 1")
+        if compact_interval is not None and compact_interval <= 0:
+            raise ValueError("compact_interval must be positive or None")
+        if max_deltas < 0:
+            raise ValueError("max_deltas must not be negative")
+        self.path = path
+        self.serializer = get_serializer(serializer)
+        self.max_deltas = max_deltas
+        self._log = _get_log(path, segment_size, sync, sync_interval, compact_ratio, compact_interval)
+        self._closed = False
+
+    def load_state(self, fn_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Load state for a function from the log.
+
+        Args:
+            fn_id: Function identifier
+
+        Returns:
+            The state dictionary or None if it doesn't exist
+        """
+        state, _ = self.load_state_versioned(fn_id)
+        return state
+
+    def load_state_versioned(self, fn_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+        """
+        Load state for a function together with its version.
+
+        Args:
+            fn_id: Function identifier
+
+        Returns:
+            A tuple of (state dictionary or None, version). The version is 0 if
+            no state is stored and None if it could not be read.
+        """
+        try:
+            version, records = self._log.read(fn_id)
+            if not records:
+                return None, version
+            start = time.perf_counter()
+            state = cast(Dict[str, Any], self.serializer.deserialize(records[0][1]))
+            for _, value in records[1:]:
+                delta = self.serializer.deserialize(value)
+                state.update(delta["set"])
+                for name in delta["del"]:
+                    state.pop(name, None)
+            metrics.record_serialization(fn_id, "deserialize", time.perf_counter() - start,
+                                         sum(len(value) for _, value in records))
+            return state, version
+        except (OSError, KeyError, ValueError) as e:
+            logger.error(f"Error loading state for {fn_id}: {e}")
+            return None, None
+
+    def get_version(self, fn_id: str) -> Optional[int]:
+        """
+        Get the version of a function's stored state.
+
+        Args:
+            fn_id: Function identifier
+
+        Returns:
+            The version, or 0 if no state is stored
+        """
+        return self._log.version(fn_id)
+
+    def save_state(self, fn_id: str, state: Dict[str, Any]) -> bool:
+        """
+        Save state for a function to the log.
+
+        Args:
+            fn_id: Function identifier
+            state: The state dictionary to save
+
+        Returns:
+            True if successful, False otherwise
+        """
+        saved, _ = self.save_state_versioned(fn_id, state)
+        return saved
+
+    def save_state_versioned(self, fn_id: str, state: Dict[str, Any],
+                             changed: Optional[Set[str]] = None) -> Tuple[bool, Optional[int]]:
+        """
+        Append a state for a function and bump its version.
+
+        Args:
+            fn_id: Function identifier
+            state: The state dictionary to save
+            changed: Top-level keys that changed; only these are appended, as a
+                delta (default: append the full state)
+
+        Returns:
+            A tuple of (success, new version)
+        """
+        return self._append(fn_id, state, None, changed)
+
+    def compare_and_swap(self, fn_id: str, state: Dict[str, Any],
+                         expected_version: Optional[int],
+                         changed: Optional[Set[str]] = None) -> Tuple[bool, Optional[int]]:
+        """
+        Append a state only if its version still equals the expected version.
+
+        Args:
+            fn_id: Function identifier
+            state: The state dictionary to save
+            expected_version: Version the state was loaded at (0 if it did not exist)
+            changed: Top-level keys that changed (see save_state_versioned)
+
+        Returns:
+            A tuple of (saved, new version); saved is False on a version conflict
+        """
+        if expected_version is None:
+            return False, None
+        return self._append(fn_id, state, expected_version, changed)
+
+    def _append(self, fn_id: str, state: Dict[str, Any], expected_version: Optional[int],
+                changed: Optional[Set[str]]) -> Tuple[bool, Optional[int]]:
+        """Serialize a state or delta and append it, optionally only at the expected version."""
+        delta = changed is not None and 0 < self._log.chain_length(fn_id) <= self.max_deltas
+        try:
+            start = time.perf_counter()
+            if delta:
+                names = cast(Set[str], changed)
+                value = self.serializer.serialize({
+                    "set": {name: state[name] for name in names if name in state},
+                    "del": [name for name in names if name not in state],
+                })
+            else:
+                value = self.serializer.serialize(state)
+            metrics.record_serialization(fn_id, "serialize", time.perf_counter() - start, len(value))
+            version = self._log.append(fn_id, _DELTA if delta else _FULL, value, expected_version)
+            if version is None and delta and (expected_version is None or
+                                              self._log.version(fn_id) == expected_version):
+                # The state has no full record to apply the delta to
+                return self._append(fn_id, state, expected_version, None)
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Error saving state for {fn_id}: {e}")
+            return False, None
+        return version is not None, version
+
+    def acquire_lock(self, fn_id: str, timeout: float = 10.0) -> bool:
+        """
+        Acquire a lock for a function.
+
+        The log belongs to one process, so locks are reentrant in-process locks,
+        shared by all backends using the same log directory.
+
+        Args:
+            fn_id: Function identifier
+            timeout: Timeout for acquiring the lock
+
+        Returns:
+            True if the lock was acquired, False otherwise
+        """
+        if self._log.lock_for(fn_id).acquire(timeout=max(timeout, 0)):
+            return True
+        logger.error(f"Timeout acquiring lock for {fn_id}")
+        return False
+
+    def release_lock(self, fn_id: str) -> bool:
+        """
+        Release a lock for a function.
+
+        Args:
+            fn_id: Function identifier
+
+        Returns:
+            True if the lock was released, False if this thread did not hold it
+        """
+        lock = self._log.locks.get(fn_id)
+        if lock is None:
+            return False
+        try:
+            lock.release()
+            return True
+        except RuntimeError:
+            return False
+
+    def compact(self) -> bool:
+        """
+        Compact the sealed segments now.
+
+        Returns:
+            True if successful, False otherwise
+        """
+        return self._log.compact()
+
+    def close(self) -> None:
+        """Close the backend; the log is synced and closed once no backend uses it."""
+        if not self._closed:
+            self._closed = True
+            _release_log(self._log)
@@ -0,0 +1,503 @@
+"""
+In-memory backend for statefulpy.
+
+States are kept in process memory, so loads and saves do no I/O. Backends with
+the same store name share their states and locks, like SQLite backends on the
+same database file. A store can be snapshotted to a file periodically and when
+the interpreter exits, and is restored from that file when it is first opened.
+"""
+import atexit
+import base64
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Set, Tuple, Union, cast
+
+from statefulpy import metrics
+from statefulpy.backends.base import StateBackend, check_durability
+from statefulpy.serializers import get_serializer
+
+logger = logging.getLogger(__name__)
+
+# Version of the snapshot file format
+_SNAPSHOT_FORMAT = 1
+
+# A stored state: a serialized blob, or {field: serialized value} for the 'fields' layout
+_StoredData = Union[bytes, Dict[str, bytes]]
+
+
+class _MemoryStore:
+    """States, versions and locks shared by the memory backends of one name."""
+
+    def __init__(self, name: str, snapshot_path: Optional[str],
+                 snapshot_interval: Optional[float], snapshot_on_exit: bool):
+        self.name = name
+        self.snapshot_path = snapshot_path
+        self.settings = (snapshot_path, snapshot_interval, snapshot_on_exit)
+        # fn_id -> (version, stored data); stored data is never mutated in place
+        self.states: Dict[str, Tuple[int, _StoredData]] = {}
+        self.mutex = threading.Lock()
+        self.locks: Dict[str, threading.RLock] = {}
+        # Number of open backends using the store
+        self.users = 0
+        self._snapshot_lock = threading.Lock()
+        self._dirty = False
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        if snapshot_path is not None:
+            self.restore()
+            if snapshot_interval is not None:
+                self._thread = threading.Thread(
+                    target=self._run, args=(snapshot_interval,),
+                    name=f"statefulpy-memory-snapshot-{name}", daemon=True
+                )
+                self._thread.start()
+            if snapshot_on_exit:
+                atexit.register(self.snapshot)
+
+    def get(self, fn_id: str) -> Optional[Tuple[int, _StoredData]]:
+        """Return the version and stored data of a state, or None if it does not exist."""
+        with self.mutex:
+            return self.states.get(fn_id)
+
+    def put(self, fn_id: str, data: _StoredData, expected_version: Optional[int] = None,
+            changed: Optional[Set[str]] = None) -> Optional[int]:
+        """
+        Store a state and bump its version.
+
+        Args:
+            fn_id: Function identifier
+            data: Serialized state; for the 'fields' layout with ``changed``
+                only the changed fields that still exist
+            expected_version: Only store if the current version equals this
+            changed: Fields that changed; other fields keep their stored value
+
+        Returns:
+            The new version, or None if the version did not match
+        """
+        with self.mutex:
+            version, current = self.states.get(fn_id, (0, None))
+            if expected_version is not None and version != expected_version:
+                return None
+            if changed is not None and isinstance(current, dict) and isinstance(data, dict):
+                fields = {name: value for name, value in current.items() if name not in changed}
+                fields.update(data)
+                data = fields
+            self.states[fn_id] = (version + 1, data)
+            self._dirty = True
+            return version + 1
+
+    def clear(self) -> None:
+        """Remove all states."""
+        with self.mutex:
+            self.states.clear()
+            self._dirty = True
+
+    def lock_for(self, fn_id: str) -> threading.RLock:
+        """Return the lock of a function, creating it on first use."""
+        with self.mutex:
+            lock = self.locks.get(fn_id)
+            if lock is None:
+                lock = self.locks[fn_id] = threading.RLock()
+            return lock
+
+    def snapshot(self) -> bool:
+        """
+        Write all states to the snapshot file if they changed since the last snapshot.
+
+        The file is replaced atomically, so a crash during a snapshot leaves
+        the previous one intact.
+
+        Returns:
+            True if the snapshot is up to date, False if writing it failed
+        """
+        if self.snapshot_path is None:
+            return False
+        with self._snapshot_lock:
+            with self.mutex:
+                if not self._dirty:
+                    return True
+                states = dict(self.states)
+                self._dirty = False
+            try:
+                self._write_snapshot(states)
+                return True
+            except (OSError, TypeError, ValueError) as e:
+                logger.error(f"Error writing snapshot of memory store {self.name}: {e}")
+                with self.mutex:
+                    self._dirty = True
+                return False
+
+    def _write_snapshot(self, states: Dict[str, Tuple[int, _StoredData]]) -> None:
+        """Encode states as JSON and atomically replace the snapshot file."""
+        path = cast(str, self.snapshot_path)
+        encoded = {}
+        for fn_id, (version, data) in states.items():
+            if isinstance(data, dict):
+                encoded[fn_id] = {"version": version, "fields": {
+                    name: base64.b64encode(value).decode("ascii") for name, value in data.items()
+                }}
+            else:
+                encoded[fn_id] = {"version": version,
+                                  "state": base64.b64encode(data).decode("ascii")}
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".statefulpy-snapshot-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"format": _SNAPSHOT_FORMAT, "states": encoded}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def restore(self) -> None:
+        """
+        Load the states of the snapshot file, if it exists.
+
+        Raises:
+            ValueError: If the snapshot file cannot be read
+        """
+        path = cast(str, self.snapshot_path)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+            if snapshot.get("format") != _SNAPSHOT_FORMAT:
+                raise ValueError(f"unsupported format {snapshot.get('format')!r}")
+            states: Dict[str, Tuple[int, _StoredData]] = {}
+            for fn_id, entry in snapshot["states"].items():
+                if "fields" in entry:
+                    states[fn_id] = (entry["version"], {
+                        name: base64.b64decode(value) for name, value in entry["fields"].items()
+                    })
+                else:
+                    states[fn_id] = (entry["version"], base64.b64decode(entry["state"]))
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            # Starting empty would overwrite the snapshot with the next one
+            logger.error(f"Error restoring memory store {self.name} from {path}: {e}")
+            raise ValueError(f"Cannot restore memory store {self.name} from {path}: {e}")
+        with self.mutex:
+            self.states.update(states)
+
+    def _run(self, interval: float) -> None:
+        """Background snapshot loop."""
+        while not self._stopped.wait(interval):
+            self.snapshot()
+
+    def stop(self) -> None:
+        """Stop periodic snapshots and take a final one."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        atexit.unregister(self.snapshot)
+        self.snapshot()
+
+
+_stores: Dict[str, _MemoryStore] = {}
+_stores_lock = threading.Lock()
+
+
+def _get_store(name: str, snapshot_path: Optional[str], snapshot_interval: Optional[float],
+               snapshot_on_exit: bool) -> _MemoryStore:
+    """Return the store of a name, opening it with the given snapshot settings on first use."""
+    if snapshot_path is not None:
+        snapshot_path = os.path.abspath(snapshot_path)
+    settings = (snapshot_path, snapshot_interval, snapshot_on_exit)
+    with _stores_lock:
+        store = _stores.get(name)
+        if store is None:
+            store = _stores[name] = _MemoryStore(name, *settings)
+        elif store.settings != settings:
+            raise ValueError(f"Memory store {name} is already open with different snapshot settings")
+        store.users += 1
+        return store
+
+
+def _release_store(store: _MemoryStore) -> None:
+    """
+    Stop using a store.
+
+    A store with a snapshot file is snapshotted and closed once no backend
+    uses it; opening it again restores it from the file. Other stores keep
+    their states for the lifetime of the process.
+    """
+    with _stores_lock:
+        store.users -= 1
+        if store.users > 0 or store.snapshot_path is None:
+            return
+        if _stores.get(store.name) is store:
+            del _stores[store.name]
+    store.stop()
+
+
+class MemoryBackend(StateBackend):
+    """In-process backend that keeps state in memory."""
+
+    def __init__(self, serializer: str = "pickle", layout: str = "blob", name: str = "default",
+                 snapshot_path: Optional[str] = None, snapshot_interval: Optional[float] = None,
+                 snapshot_on_exit: bool = True, durability: Optional[str] = None):
+        """
+        Initialize the memory backend.
+
+        States are stored serialized, so callers never share mutable objects
+        with the store and states that cannot be serialized fail as they would
+        with a persistent backend.
+
+        Args:
+            serializer: Serializer to use ('pickle' or 'json'; e.g. 'json+zlib' to
+                compress large states)
+            layout: 'blob' stores each state as one serialized value; 'fields'
+                serializes every top-level key separately so that only changed
+                keys are serialized again
+            name: Name of the store; backends with the same name share their
+                states and locks
+            snapshot_path: File the store is restored from when it is opened
+                and snapshotted to (default: no snapshots)
+            snapshot_interval: Seconds between snapshots (None to disable
+                periodic snapshots)
+            snapshot_on_exit: Snapshot when the interpreter exits
+            durability: Accepted for compatibility with the other backends;
+                states are only as durable as the last snapshot
+
+        Raises:
+            ValueError: If an option is invalid, the snapshot settings differ
+                from those the store was opened with, or the snapshot cannot
+                be restored
+        """
+        if layout not in ("blob", "fields"):
+            raise ValueError(f"Unknown layout: {layout}. Valid layouts are: blob, fields")
+        if snapshot_interval is not None and snapshot_interval <= 0:
+            raise ValueError("snapshot_interval must be positive or None")
+        if snapshot_interval is not None and snapshot_path is None:
+            raise ValueError("snapshot_interval requires snapshot_path")
+        self.durability = check_durability(durability)
+        self.serializer = get_serializer(serializer)
+        self.layout = layout
+        self._store = _get_store(name, snapshot_path,
+                                 snapshot_interval, snapshot_on_exit and snapshot_path is not None)
+        self._closed = False
+
+    def load_state(self, fn_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Load state for a function.
+
+        Args:
+            fn_id: Function identifier
+
+        Returns:
+            The state dictionary or None if it doesn't exist
+        """
+        state, _ = self.load_state_versioned(fn_id)
+        return state
+
+    def load_state_versioned(self, fn_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+        """
+        Load state for a function together with its version.
+
+        Args:
+            fn_id: Function identifier
+
+        Returns:
+            A tuple of (state dictionary or None, version); the version is 0
+            if no state is stored
+        """
+        entry = self._store.get(fn_id)
+        if entry is None:
+            return None, 0
+        version, data = entry
+        return self._deserialize(fn_id, data), version
+
+    def load_fields(self, fn_id: str, fields: Iterable[str]) -> Dict[str, Any]:
+        """
+        Load a subset of the top-level keys of a function's state.
+
+        With the 'fields' layout only the requested keys are deserialized.
+
+        Args:
+            fn_id: Function identifier
+            fields: Names of the keys to load
+
+        Returns:
+            A dictionary with the requested keys that exist
+        """
+        entry = self._store.get(fn_id)
+        if entry is None:
+            return {}
+        data = entry[1]
+        if not isinstance(data, dict):
+            state = self._deserialize(fn_id, data)
+            return {field: state[field] for field in fields if field in state}
+        return self._deserialize(fn_id, {field: data[field] for field in fields if field in data})
+
+    def get_version(self, fn_id: str) -> Optional[int]:
+        """
+        Get the version of a function's stored state.
+
+        Args:
+            fn_id: Function identifier
+
+        Returns:
+            The version, or 0 if no state is stored
+        """
+        entry = self._store.get(fn_id)
+        return entry[0] if entry is not None else 0
+
+    def save_state(self, fn_id: str, state: Dict[str, Any]) -> bool:
+        """
+        Save state for a function.
+
+        Args:
+            fn_id: Function identifier
+            state: The state dictionary to save
+
+        Returns:
+            True if successful, False otherwise
+        """
+        saved, _ = self.save_state_versioned(fn_id, state)
+        return saved
+
+    def save_state_versioned(self, fn_id: str, state: Dict[str, Any],
+                             changed: Optional[Set[str]] = None) -> Tuple[bool, Optional[int]]:
+        """
+        Save state for a function and bump its version.
+
+        Args:
+            fn_id: Function identifier
+            state: The state dictionary to save
+            changed: Top-level keys that changed; with the 'fields' layout only
+                these are serialized (default: all keys)
+
+        Returns:
+            A tuple of (success, new version)
+        """
+        return self._put(fn_id, state, None, changed)
+
+    def compare_and_swap(self, fn_id: str, state: Dict[str, Any],
+                         expected_version: Optional[int],
+                         changed: Optional[Set[str]] = None) -> Tuple[bool, Optional[int]]:
+        """
+        Save state only if its version still equals the expected version.
+
+        Args:
+            fn_id: Function identifier
+            state: The state dictionary to save
+            expected_version: Version the state was loaded at (0 if it did not exist)
+            changed: Top-level keys that changed (see save_state_versioned)
+
+        Returns:
+            A tuple of (saved, new version); saved is False on a version conflict
+        """
+        if expected_version is None:
+            return False, None
+        return self._put(fn_id, state, expected_version, changed)
+
+    def _put(self, fn_id: str, state: Dict[str, Any], expected_version: Optional[int],
+             changed: Optional[Set[str]]) -> Tuple[bool, Optional[int]]:
+        """Serialize a state and store it, optionally only at the expected version."""
+        if self.layout == "fields" and changed is not None:
+            current = self._store.get(fn_id)
+            if current is None or not isinstance(current[1], dict):
+                changed = None
+        try:
+            data = self._serialize(fn_id, state, changed)
+        except Exception as e:
+            logger.error(f"Error saving state for {fn_id}: {e}")
+            return False, None
+        version = self._store.put(fn_id, data, expected_version, changed)
+        return version is not None, version
+
+    def _serialize(self, fn_id: str, state: Dict[str, Any],
+                   changed: Optional[Set[str]]) -> _StoredData:
+        """Serialize a state, recording the time taken and the payload size."""
+        start = time.perf_counter()
+        data: _StoredData
+        if self.layout == "fields":
+            names = state.keys() if changed is None else [name for name in changed if name in state]
+            data = {name: self.serializer.serialize({name: state[name]}) for name in names}
+            size = sum(len(value) for value in data.values())
+        else:
+            data = self.serializer.serialize(state)
+            size = len(data)
+        metrics.record_serialization(fn_id, "serialize", time.perf_counter() - start, size)
+        return data
+
+    def _deserialize(self, fn_id: str, data: _StoredData) -> Dict[str, Any]:
+        """Deserialize a stored state, recording the time taken and the payload size."""
+        start = time.perf_counter()
+        if isinstance(data, dict):
+            state = {name: self.serializer.deserialize(value)[name] for name, value in data.items()}
+            size = sum(len(value) for value in data.values())
+        else:
+            state = self.serializer.deserialize(data)
+            size = len(data)
+        metrics.record_serialization(fn_id, "deserialize", time.perf_counter() - start, size)
+        return state
+
+    def acquire_lock(self, fn_id: str, timeout: float = 10.0) -> bool:
+        """
+        Acquire a lock for a function.
+
+        Locks are reentrant and held by the acquiring thread.
+
+        Args:
+            fn_id: Function identifier
+            timeout: Timeout for acquiring the lock
+
+        Returns:
+            True if the lock was acquired, False otherwise
+        """
+        if self._store.lock_for(fn_id).acquire(timeout=max(timeout, 0)):
+            return True
+        logger.error(f"Timeout acquiring lock for {fn_id}")
+        return False
+
+    def release_lock(self, fn_id: str) -> bool:
+        """
+        Release a lock for a function.
+
+        Args:
+            fn_id: Function identifier
+
+        Returns:
+            True if the lock was released, False if this thread did not hold it
+        """
+        try:
+            self._store.lock_for(fn_id).release()
+            return True
+        except RuntimeError:
+            return False
+
+    def snapshot(self) -> bool:
+        """
+        Write the store to its snapshot file now.
+
+        Returns:
+            True if the snapshot file is up to date, False if the store has no
+            snapshot file or writing it failed
+        """
+        return self._store.snapshot()
+
+    def clear(self) -> None:
+        """Remove all states of the store, e.g. between tests."""
+        self._store.clear()
+
+    def close(self) -> None:
+        """
+        Close the backend.
+
+        When the last backend of a store with a snapshot file is closed, the
+        store is snapshotted and closed. Otherwise the states stay in memory.
+        """
+        if not self._closed:
+            self._closed = True
+            _release_store(self._store)
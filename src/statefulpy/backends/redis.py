@@ -1,46 +1,800 @@
 """
 Redis backend implementation for distributed state storage and locking.
 """
-import json
-import pickle
+import asyncio
 import time
 import logging
 import threading
-from typing import Optional, Dict, Any, cast
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, cast
 
 import redis
+import redis.asyncio as redis_asyncio
 
-from statefulpy.backends.base import StateBackend
+from statefulpy import metrics
+from statefulpy.backends.base import StateBackend, AsyncStateBackend, check_durability
+from statefulpy.serializers import get_serializer
 
 logger = logging.getLogger(__name__)
 
+# Backends with a near cache keep the "<prefix>invalidate" key alive for this
+# many seconds, renewing it every third of that. While it exists, every write
+# publishes the version key of the state it changed on the channel of the same
+# name, and near caches drop their copy when they receive it.
+_NEAR_ANNOUNCE_TTL = 30.0
 
-class RedisBackend(StateBackend):
-    """Redis backend for distributed state persistence."""
+# Write for the 'blob' layout: KEYS = (state, version, invalidation channel),
+# ARGV = (data, expected version or '' for an unconditional write).
+# Returns the new version, or -1 if the stored version changed.
+_CAS_SCRIPT = """
+if ARGV[2] ~= '' then
+    local current = tonumber(redis.call('get', KEYS[2]) or '0')
+    if current ~= tonumber(ARGV[2]) then
+        return -1
+    end
+end
+redis.call('set', KEYS[1], ARGV[1])
+local version = redis.call('incr', KEYS[2])
+if redis.call('exists', KEYS[3]) == 1 then
+    redis.call('publish', KEYS[3], KEYS[2])
+end
+return version
+"""
+
+
+# Write for the 'fields' layout: KEYS = (fields hash, version, state blob,
+# invalidation channel), ARGV = (expected version or '' for an unconditional write, replace flag,
+#         number of fields to set, field, value, ..., fields to delete...).
+# Returns the new version, -1 if the stored version changed, or -2 if a partial
+# write was attempted while the state is still stored as a blob.
+_WRITE_FIELDS_SCRIPT = """
+if ARGV[1] ~= '' then
+    local current = tonumber(redis.call('get', KEYS[2]) or '0')
+    if current ~= tonumber(ARGV[1]) then
+        return -1
+    end
+end
+if ARGV[2] == '1' then
+    redis.call('del', KEYS[1], KEYS[3])
+elseif redis.call('exists', KEYS[3]) == 1 then
+    return -2
+end
+local index = 4
+for _ = 1, tonumber(ARGV[3]) do
+    redis.call('hset', KEYS[1], ARGV[index], ARGV[index + 1])
+    index = index + 2
+end
+for i = index, #ARGV do
+    redis.call('hdel', KEYS[1], ARGV[i])
+end
+local version = redis.call('incr', KEYS[2])
+if redis.call('exists', KEYS[4]) == 1 then
+    redis.call('publish', KEYS[4], KEYS[2])
+end
+return version
+"""
+
+
+def _handoff(lock: str, queue: str, timeout: str, wake_prefix: str) -> str:
+    """
+    Lua that passes a lock on to the first waiter in its queue, or deletes it.
+    
+    The waiter becomes the owner right away and is woken by a push to its
+    wake list, so the lock goes to waiters in the order they queued.
+    """
+    return (
+        f"local waiter = redis.call('lpop', {queue})\n"
+        f"if waiter then\n"
+        f"    local wake = {wake_prefix} .. waiter\n"
+        f"    redis.call('set', {lock}, waiter, 'PX', {timeout})\n"
+        f"    redis.call('rpush', wake, 1)\n"
+        f"    redis.call('pexpire', wake, {timeout})\n"
+        f"else\n"
+        f"    redis.call('del', {lock})\n"
+        f"end\n"
+    )
+
+
+# Lock release: KEYS = (lock, wait queue), ARGV = (lock id, lock timeout in ms,
+# wake key prefix). Only the owner may release the lock.
+_RELEASE_SCRIPT = (
+    "if redis.call('get', KEYS[1]) ~= ARGV[1] then\n"
+    "    return 0\n"
+    "end\n"
+    + _handoff("KEYS[1]", "KEYS[2]", "ARGV[2]", "ARGV[3]")
+    + "return 1\n"
+)
+
+# Lock acquisition that also reads the state:
+# KEYS = (lock, state, version, wait queue, wake list, fencing counter[, fields hash]),
+# ARGV = (lock id, lock timeout in ms, version the caller already has or -1,
+#         1 to queue up if the lock is taken, 0 to leave the queue).
+# If the lock is taken, returns its remaining time to live in milliseconds.
+# Otherwise the caller now holds the lock (or was handed it while queued), and
+# the reply is {fencing token, version} if the caller has that version, else
+# {token, version, blob} or, without a blob, {token, version, false, field/value pairs}.
+_LOCK_AND_LOAD_SCRIPT = """
+local owner = redis.call('get', KEYS[1])
+if owner == ARGV[1] then
+    redis.call('pexpire', KEYS[1], ARGV[2])
+elseif owner then
+    if ARGV[4] == '1' then
+        if not redis.call('lpos', KEYS[4], ARGV[1]) then
+            redis.call('rpush', KEYS[4], ARGV[1])
+        end
+    else
+        redis.call('lrem', KEYS[4], 0, ARGV[1])
+        redis.call('del', KEYS[5])
+    end
+    return redis.call('pttl', KEYS[1])
+else
+    redis.call('set', KEYS[1], ARGV[1], 'PX', ARGV[2])
+end
+redis.call('lrem', KEYS[4], 0, ARGV[1])
+redis.call('del', KEYS[5])
+local token = redis.call('incr', KEYS[6])
+local version = tonumber(redis.call('get', KEYS[3]) or '0')
+if version == tonumber(ARGV[3]) then
+    return {token, version}
+end
+local state = redis.call('get', KEYS[2])
+if state or not KEYS[7] then
+    return {token, version, state}
+end
+return {token, version, false, redis.call('hgetall', KEYS[7])}
+"""
+
+# Lease renewal: KEYS = (lock,), ARGV = (lock id, lock timeout in ms).
+# Returns 1, or 0 if the lock is no longer held by that id.
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def _write_and_release(source: str) -> str:
+    """
+    Turn a write script into one that also releases the lock.
+    
+    The lock and queue keys are appended to KEYS and the arguments of
+    _RELEASE_SCRIPT to ARGV. Nothing is written and -3 is returned if the
+    lock is no longer held by that id.
+    """
+    body = source.replace("#ARGV", "#ARGV - 3").replace(
+        "return version",
+        _handoff("KEYS[#KEYS - 1]", "KEYS[#KEYS]", "ARGV[#ARGV - 1]", "ARGV[#ARGV]") + "return version",
+    )
+    return (
+        "if redis.call('get', KEYS[#KEYS - 1]) ~= ARGV[#ARGV - 2] then\n"
+        "    return -3\n"
+        "end" + body
+    )
+
+
+_WRITE_AND_RELEASE_SCRIPTS = {
+    source: _write_and_release(source) for source in (_CAS_SCRIPT, _WRITE_FIELDS_SCRIPT)
+}
+
+
+def _fenced(source: str) -> str:
+    """
+    Turn a write script into one that only writes for the latest lock holder.
+    
+    The fencing counter key is appended to KEYS and the writer's fencing
+    token to ARGV. Nothing is written and -3 is returned if the lock was
+    acquired again since the token was issued.
+    """
+    return (
+        "if redis.call('get', KEYS[#KEYS]) ~= ARGV[#ARGV] then\n"
+        "    return -3\n"
+        "end" + source.replace("#ARGV", "#ARGV - 1")
+    )
+
+
+_FENCED_SCRIPTS = {source: _fenced(source) for source in (_CAS_SCRIPT, _WRITE_FIELDS_SCRIPT)}
+
+
+class _NearEntry:
+    """What the near cache holds of a state: its version and raw replies of reads."""
+    
+    __slots__ = ("version", "results", "fields")
+    
+    def __init__(self) -> None:
+        self.version: Optional[int] = None
+        # Replies of a full load (see _queue_load), or single fields read by load_fields
+        self.results: Optional[List[Any]] = None
+        self.fields: Dict[str, Optional[bytes]] = {}
+
+
+class _RedisKeyspace(ABC):
+    """Key layout and serialization shared by the blocking and asyncio Redis backends."""
     
     def __init__(self, 
                  redis_url: str = "redis://localhost:6379/0", 
                  serializer: str = "pickle",
                  prefix: str = "statefulpy:",
-                 lock_timeout: int = 30000):  # 30 seconds in milliseconds
+                 lock_timeout: int = 2000,  # 2 seconds in milliseconds
+                 renew_locks: bool = True,
+                 layout: str = "blob",
+                 durability: Optional[str] = None,
+                 wait_replicas: Optional[int] = None,
+                 wait_timeout: int = 1000,
+                 wait_aof: bool = False,
+                 near_cache: bool = False):
         """
         Initialize Redis backend.
         
         Args:
             redis_url: Redis connection URL
-            serializer: Serialization format ('pickle' or 'json')
+            serializer: Serialization format ('pickle' or 'json'; e.g. 'json+zlib' to
+                compress large states)
             prefix: Key prefix for Redis
-            lock_timeout: Lock timeout in milliseconds
+            lock_timeout: Lock timeout in milliseconds; a lock held by a
+                crashed process is free again after this long
+            renew_locks: Extend the locks this backend holds in the background
+                every third of ``lock_timeout``, so calls may take longer than
+                the timeout
+            layout: 'blob' stores each state as one serialized string; 'fields'
+                stores every top-level key as a field of a hash so that only
+                changed keys are rewritten
+            durability: 'strict' waits after every write until replicas (and
+                with ``wait_aof`` the AOF) acknowledged it; 'relaxed' sends
+                saves made under the lock together with the lock release
+                without waiting for them; 'normal' or None waits for the
+                primary's reply only
+            wait_replicas: Replicas that must acknowledge a write with 'strict'
+                durability (default: those connected when first needed)
+            wait_timeout: Milliseconds to wait for acknowledgements
+            wait_aof: With 'strict' durability also wait until the write was
+                fsynced to the AOF, using WAITAOF (Redis 7.2+, appendonly on)
+            near_cache: Keep states read without holding the lock in process
+                memory until a write invalidates them, announced on the
+                '<prefix>invalidate' pub/sub channel
         """
+        if layout not in ("blob", "fields"):
+            raise ValueError(f"Unknown layout: {layout}. Valid layouts are: blob, fields")
+        if wait_replicas is not None and wait_replicas < 0:
+            raise ValueError("wait_replicas must not be negative")
+        if lock_timeout <= 0:
+            raise ValueError("lock_timeout must be positive")
+        self.layout = layout
+        self.durability = check_durability(durability)
+        self.wait_replicas = wait_replicas
+        self.wait_timeout = wait_timeout
+        self.wait_aof = wait_aof
         self.redis_url = redis_url
         self.serializer = serializer
+        self._serializer = get_serializer(serializer)
         self.prefix = prefix
         self.lock_timeout = lock_timeout
-        self._client = None
+        self.renew_locks = renew_locks
+        self.near_cache = near_cache
+        self._client: Any = None
         # Add type annotations for lock bookkeeping
         self._locks: Dict[str, str] = {}
-        self._lock_owners: Dict[str, int] = {}
+        self._lock_owners: Dict[str, Any] = {}
         self._lock_counter: Dict[str, int] = {}
+        # Fencing token of each held lock; writes by the holder carry it
+        self._tokens: Dict[str, int] = {}
+        # Thread (or asyncio task) renewing the leases of held locks
+        self._renewer: Any = None
+        self._renewer_lock = threading.Lock()
+        self._renewal_stopped = threading.Event()
+        self._scripts: Dict[str, Any] = {}
+        # 'relaxed' durability: writes waiting for the lock release, and the
+        # state version the lock holder last saw or wrote
+        self._pending: Dict[str, List[Tuple[Tuple[str, List[str], List[Any]], Dict[str, Any], int]]] = {}
+        self._held_versions: Dict[str, int] = {}
+        # The version (and state, until it is read) returned with the lock,
+        # and the last version of each state this backend loaded or wrote
+        self._prefetched: Dict[str, Tuple[int, Optional[List[Any]]]] = {}
+        self._known_versions: Dict[str, int] = {}
+        self._connected_replicas: Optional[int] = None
+        # Near cache: entries are only stored and served while subscribed to
+        # invalidations. A read stores its reply only if no invalidation of
+        # the state (epoch) and no resubscription (generation) happened since
+        # it was sent.
+        self._near: Dict[str, _NearEntry] = {}
+        self._near_lock = threading.Lock()
+        self._near_ready = False
+        # Monotonic time until which writes are known to publish invalidations
+        self._near_valid_until = 0.0
+        self._near_generation = 0
+        self._near_epochs: Dict[str, int] = {}
+        self._listener: Any = None
+        self._listener_stopped = threading.Event()
+    
+    def _get_state_key(self, fn_id: str) -> str:
+        """Get the Redis key for a function's state."""
+        return f"{self.prefix}state:{fn_id}"
+    
+    def _get_lock_key(self, fn_id: str) -> str:
+        """Get the Redis key for a function's lock."""
+        return f"{self.prefix}lock:{fn_id}"
+    
+    def _get_queue_key(self, fn_id: str) -> str:
+        """Get the Redis list of lock ids waiting for a function's lock."""
+        return f"{self.prefix}queue:{fn_id}"
+    
+    def _get_wake_key(self, fn_id: str, lock_id: str = "") -> str:
+        """Get the Redis list a waiter blocks on until it is handed the lock."""
+        return f"{self.prefix}wake:{fn_id}:{lock_id}"
+    
+    def _get_fence_key(self, fn_id: str) -> str:
+        """Get the Redis counter issuing fencing tokens for a function's lock."""
+        return f"{self.prefix}fence:{fn_id}"
+    
+    def _get_version_key(self, fn_id: str) -> str:
+        """Get the Redis key holding the version of a function's state."""
+        return f"{self.prefix}version:{fn_id}"
+    
+    def _get_fields_key(self, fn_id: str) -> str:
+        """Get the Redis hash holding a function's state in the 'fields' layout."""
+        return f"{self.prefix}fields:{fn_id}"
+    
+    def _get_invalidation_key(self) -> str:
+        """Get the key announcing near caches, which is also the channel of their invalidations."""
+        return f"{self.prefix}invalidate"
+    
+    def _queue_load(self, pipe: Any, fn_id: str) -> None:
+        """Queue the commands that read a state and its version."""
+        pipe.get(self._get_state_key(fn_id))
+        pipe.get(self._get_version_key(fn_id))
+        if self.layout == "fields":
+            pipe.hgetall(self._get_fields_key(fn_id))
+    
+    def _parse_load(self, fn_id: str, results: List[Any]) -> Tuple[Optional[Dict[str, Any]], int]:
+        """Turn the replies of the commands queued by _queue_load into (state, version)."""
+        data, version = results[0], results[1]
+        version = int(version) if version is not None else 0
+        # A blob takes precedence: it is written by the 'blob' layout and
+        # converted to fields by the next save with the 'fields' layout
+        if data is not None:
+            start = time.perf_counter()
+            state = self._deserialize(data)
+            metrics.record_serialization(fn_id, "deserialize", time.perf_counter() - start, len(data))
+            return state, version
+        fields = results[2] if self.layout == "fields" else None
+        if not fields:
+            return None, version
+        return self._deserialize_fields(
+            fn_id, ((field.decode('utf-8'), value) for field, value in fields.items())
+        ), version
+    
+    def _deserialize_fields(self, fn_id: str, fields: Iterable[Tuple[str, bytes]]) -> Dict[str, Any]:
+        """Deserialize (field, value) pairs of the 'fields' layout into a state."""
+        start = time.perf_counter()
+        size = 0
+        state = {}
+        for field, value in fields:
+            state[field] = self._deserialize_field(field, value)
+            size += len(value)
+        metrics.record_serialization(fn_id, "deserialize", time.perf_counter() - start, size)
+        return state
+    
+    def _write_call(self, fn_id: str, data: Dict[str, Any], expected_version: Optional[int],
+                    changed: Optional[Set[str]]) -> Tuple[str, List[str], List[Any]]:
+        """
+        Build the (script, keys, args) of a write.
+        
+        Args:
+            fn_id: Function identifier
+            data: The state dictionary to save
+            expected_version: Only write if the stored version equals this
+                (None for an unconditional write)
+            changed: Top-level keys to write with the 'fields' layout
+                (None to rewrite all keys)
+        """
+        if self.layout == "blob":
+            return (
+                _CAS_SCRIPT,
+                [self._get_state_key(fn_id), self._get_version_key(fn_id), self._get_invalidation_key()],
+                [self._serialize_state(fn_id, data), "" if expected_version is None else expected_version],
+            )
+        start = time.perf_counter()
+        replace = changed is None
+        fields = set(data) if changed is None else changed
+        updates = [field for field in fields if field in data]
+        args: List[Any] = [
+            "" if expected_version is None else expected_version,
+            1 if replace else 0,
+            len(updates),
+        ]
+        size = 0
+        for field in updates:
+            value = self._serialize_field(field, data[field])
+            args.extend((field, value))
+            size += len(value)
+        args.extend(field for field in fields if field not in data)
+        metrics.record_serialization(fn_id, "serialize", time.perf_counter() - start, size)
+        return (
+            _WRITE_FIELDS_SCRIPT,
+            [
+                self._get_fields_key(fn_id),
+                self._get_version_key(fn_id),
+                self._get_state_key(fn_id),
+                self._get_invalidation_key(),
+            ],
+            args,
+        )
+    
+    def _release_call(self, fn_id: str, lock_id: str, data: Dict[str, Any],
+                      changed: Optional[Set[str]]) -> Tuple[str, List[str], List[Any]]:
+        """Build the (script, keys, args) of an unconditional write that also releases the lock."""
+        source, keys, args = self._write_call(fn_id, data, None, changed)
+        release_keys, release_args = self._unlock_call(fn_id, lock_id)
+        return _WRITE_AND_RELEASE_SCRIPTS[source], keys + release_keys, args + release_args
+    
+    def _unlock_call(self, fn_id: str, lock_id: str) -> Tuple[List[str], List[Any]]:
+        """Build the keys and args of the release script."""
+        return (
+            [self._get_lock_key(fn_id), self._get_queue_key(fn_id)],
+            [lock_id, self.lock_timeout, self._get_wake_key(fn_id)],
+        )
+    
+    def _lock_call(self, fn_id: str, lock_id: str) -> Tuple[List[str], List[Any]]:
+        """Build the keys and args of the lock-and-load script."""
+        keys = [
+            self._get_lock_key(fn_id),
+            self._get_state_key(fn_id),
+            self._get_version_key(fn_id),
+            self._get_queue_key(fn_id),
+            self._get_wake_key(fn_id, lock_id),
+            self._get_fence_key(fn_id),
+        ]
+        if self.layout == "fields":
+            keys.append(self._get_fields_key(fn_id))
+        return keys, [lock_id, self.lock_timeout, self._known_versions.get(fn_id, -1), 1]
+    
+    @staticmethod
+    def _wait_time(ttl: int, remaining: float) -> float:
+        """
+        Seconds to block for a lock handoff: until the holder's lease runs out,
+        in case it dies without releasing, and at most until the timeout.
+        """
+        if ttl >= 0:
+            remaining = min(remaining, ttl / 1000)
+        # BLPOP treats 0 as no timeout
+        return max(remaining, 0.01)
+    
+    def _note_lock_reply(self, fn_id: str, reply: List[Any]) -> None:
+        """Keep the fencing token, and the version and state for the holder's first reads."""
+        self._tokens[fn_id] = int(reply[0])
+        version = int(reply[1])
+        results = None
+        if len(reply) > 2:
+            pairs = reply[3] if len(reply) > 3 else []
+            results = [reply[2], version, dict(zip(pairs[::2], pairs[1::2]))]
+        self._prefetched[fn_id] = (version, results)
+        self._note_version(fn_id, version)
+    
+    def _fence(self, fn_id: str, call: Tuple[str, List[str], List[Any]]) -> Tuple[str, List[str], List[Any]]:
+        """Make a write by the lock holder conditional on its fencing token."""
+        token = self._tokens.get(fn_id)
+        if token is None or not self._owns_lock(fn_id):
+            return call
+        source, keys, args = call
+        return _FENCED_SCRIPTS[source], keys + [self._get_fence_key(fn_id)], args + [token]
+    
+    def fencing_token(self, fn_id: str) -> Optional[int]:
+        """
+        Return the fencing token of the lock the caller holds for ``fn_id``.
+        
+        Tokens increase with every acquisition of a lock. Saves by the holder
+        are rejected once a later token was issued, e.g. after the lock
+        expired while the holder was stalled; other systems written to under
+        the lock can compare tokens in the same way.
+        
+        Returns:
+            The token, or None if the caller does not hold the lock
+        """
+        return self._tokens.get(fn_id) if self._owns_lock(fn_id) else None
+    
+    def _take_prefetched(self, fn_id: str) -> Optional[Tuple[Optional[Dict[str, Any]], int]]:
+        """Return the state received with the lock, once, if the caller holds the lock."""
+        entry = self._prefetched.get(fn_id)
+        if entry is None or fn_id in self._pending or not self._owns_lock(fn_id):
+            return None
+        results = entry[1]
+        if results is None:
+            return None
+        self._prefetched[fn_id] = (entry[0], None)
+        return self._parse_load(fn_id, results)
+    
+    def _prefetched_version(self, fn_id: str) -> Optional[int]:
+        """Return the version received with the lock if the caller holds the lock."""
+        entry = self._prefetched.get(fn_id)
+        if entry is None or fn_id in self._pending or not self._owns_lock(fn_id):
+            return None
+        return entry[0]
+    
+    def _note_known(self, fn_id: str, version: int) -> None:
+        """Remember the version of a state this backend has read or written."""
+        self._known_versions[fn_id] = version
+        if fn_id in self._prefetched:
+            self._prefetched[fn_id] = (version, None)
+    
+    def _forget_lock(self, fn_id: str) -> str:
+        """
+        Drop the bookkeeping of a lock about to be released.
+        
+        This must happen before the release is sent: the release may hand the
+        lock to a waiter of this backend, which records its own bookkeeping.
+        
+        Returns:
+            The id of the lock, to release it with
+        """
+        lock_id = self._locks.pop(fn_id)
+        del self._lock_owners[fn_id]
+        del self._lock_counter[fn_id]
+        self._tokens.pop(fn_id, None)
+        self._held_versions.pop(fn_id, None)
+        self._prefetched.pop(fn_id, None)
+        return lock_id
+    
+    @abstractmethod
+    def _owns_lock(self, fn_id: str) -> bool:
+        """Return True if the caller (thread or task) holds the lock for ``fn_id``."""
+        pass
+    
+    @property
+    @abstractmethod
+    def client(self) -> Any:
+        """Blocking or asyncio Redis client."""
+        pass
+    
+    @abstractmethod
+    def _start_listener(self) -> None:
+        """Subscribe to invalidations in the background, if not done yet."""
+        pass
+    
+    def _near_begin(self, fn_id: str) -> Optional[Tuple[int, int]]:
+        """
+        Prepare a read that may use the near cache.
+        
+        Lock holders always read from Redis.
+        
+        Returns:
+            A snapshot to pass to _near_store, or None if the cache is not used
+        """
+        if not self.near_cache or fn_id in self._pending or self._owns_lock(fn_id):
+            return None
+        self._start_listener()
+        with self._near_lock:
+            if not self._near_ready or time.monotonic() >= self._near_valid_until:
+                return None
+            return self._near_generation, self._near_epochs.get(fn_id, 0)
+    
+    def _near_store(self, fn_id: str, snapshot: Optional[Tuple[int, int]],
+                    results: Optional[List[Any]] = None, version: Optional[int] = None,
+                    fields: Optional[Dict[str, Optional[bytes]]] = None) -> None:
+        """Cache replies of a read unless the state was invalidated while it ran."""
+        if snapshot is None:
+            return
+        with self._near_lock:
+            if not self._near_ready or snapshot != (self._near_generation, self._near_epochs.get(fn_id, 0)):
+                return
+            entry = self._near.setdefault(fn_id, _NearEntry())
+            if results is not None:
+                entry.results = results
+                version = int(results[1]) if results[1] is not None else 0
+            if version is not None:
+                entry.version = version
+            if fields:
+                entry.fields.update(fields)
+    
+    def _near_results(self, fn_id: str, snapshot: Optional[Tuple[int, int]]) -> Optional[List[Any]]:
+        """Return the cached replies of a full load, if any."""
+        entry = self._near.get(fn_id) if snapshot is not None else None
+        return entry.results if entry is not None else None
+    
+    def _near_version(self, fn_id: str, snapshot: Optional[Tuple[int, int]]) -> Optional[int]:
+        """Return the cached version of a state, if any."""
+        entry = self._near.get(fn_id) if snapshot is not None else None
+        return entry.version if entry is not None else None
+    
+    def _near_fields(self, fn_id: str, snapshot: Optional[Tuple[int, int]],
+                     fields: List[str]) -> Tuple[bool, Dict[str, Optional[bytes]]]:
+        """Return (stored as a blob, cached values of those ``fields`` that are cached)."""
+        entry = self._near.get(fn_id) if snapshot is not None else None
+        if entry is None:
+            return False, {}
+        if entry.results is not None:
+            if entry.results[0] is not None:
+                return True, {}
+            stored = entry.results[2]
+            return False, {field: stored.get(field.encode("utf-8")) for field in fields}
+        return False, {field: entry.fields[field] for field in fields if field in entry.fields}
+    
+    def _near_invalidate(self, fn_id: str) -> None:
+        """Drop the cached copy of a state, e.g. after this backend wrote it."""
+        if not self.near_cache:
+            return
+        with self._near_lock:
+            self._near.pop(fn_id, None)
+            self._near_epochs[fn_id] = self._near_epochs.get(fn_id, 0) + 1
+    
+    def _near_due(self) -> bool:
+        """Return True if the near cache should renew its announcement."""
+        return time.monotonic() >= self._near_valid_until - _NEAR_ANNOUNCE_TTL * 2 / 3
+    
+    def _near_announced(self, sent: float) -> None:
+        """
+        Serve the near cache until the announcement sent at ``sent`` expires.
+        
+        Writes made while no announcement was alive published nothing, so
+        the cache starts over empty if the previous one had expired.
+        """
+        with self._near_lock:
+            if not self._near_ready or sent >= self._near_valid_until:
+                self._near.clear()
+                self._near_generation += 1
+                self._near_ready = True
+            self._near_valid_until = sent + _NEAR_ANNOUNCE_TTL
+    
+    def _near_message(self, message: Dict[str, Any]) -> None:
+        """Handle a message of the invalidation subscription."""
+        if message["type"] == "message":
+            key = message["data"].decode("utf-8")
+            version_prefix = self._get_version_key("")
+            if key.startswith(version_prefix):
+                self._near_invalidate(key[len(version_prefix):])
+    
+    def _near_reset(self) -> None:
+        """Stop serving and empty the near cache while invalidations may be missed."""
+        with self._near_lock:
+            self._near_ready = False
+            self._near_valid_until = 0.0
+            self._near.clear()
+            self._near_generation += 1
+    
+    def _note_version(self, fn_id: str, version: Optional[int]) -> None:
+        """Remember a version seen by the lock holder; deferred writes are based on it."""
+        if self.durability == "relaxed" and version is not None and self._owns_lock(fn_id):
+            self._held_versions[fn_id] = version
+    
+    def _defer_write(self, fn_id: str, data: Dict[str, Any],
+                     changed: Optional[Set[str]]) -> Optional[int]:
+        """
+        Queue a save until the lock is released ('relaxed' durability).
+        
+        The write is conditional on the version the lock holder last saw, so
+        the new version is known without a round trip.
+        
+        Returns:
+            The version the state will have, or None if the save must be sent now
+        """
+        if self.durability != "relaxed" or fn_id not in self._held_versions or not self._owns_lock(fn_id):
+            return None
+        expected = self._held_versions[fn_id]
+        self._pending.setdefault(fn_id, []).append(
+            (self._fence(fn_id, self._write_call(fn_id, data, expected, changed)), data, expected)
+        )
+        self._held_versions[fn_id] = expected + 1
+        return expected + 1
+    
+    def _queue_pending(self, pipe: Any, fn_id: str) -> List[Tuple[Dict[str, Any], int]]:
+        """Queue the deferred writes of a function on a pipeline; returns their (data, expected version)."""
+        pending = self._pending.pop(fn_id, [])
+        for (source, keys, args), _, _ in pending:
+            self._queue_script(pipe, source, keys, args)
+        return [(data, expected) for _, data, expected in pending]
+    
+    def _check_pending(self, fn_id: str, writes: List[Tuple[Dict[str, Any], int]],
+                       results: List[Any]) -> List[Tuple[Dict[str, Any], int]]:
+        """
+        Log deferred writes that failed.
+        
+        Returns:
+            The writes that hit a state still stored as a blob and must be
+            rewritten in full
+        """
+        rewrite = []
+        for (data, expected), result in zip(writes, results):
+            if isinstance(result, Exception):
+                logger.error(f"Deferred save of {fn_id} failed: {result}")
+            elif int(result) == -1:
+                logger.error(f"Deferred save of {fn_id} was dropped: version {expected} changed")
+            elif int(result) == -3:
+                logger.error(f"Deferred save of {fn_id} was dropped: its lock was acquired by another caller")
+            elif int(result) == -2:
+                rewrite.append((data, expected))
+        return rewrite
+    
+    def _replicas_from_info(self, info: Dict[str, Any]) -> int:
+        """Remember the number of connected replicas reported by INFO replication."""
+        self._connected_replicas = int(info.get("connected_slaves", 0))
+        return self._connected_replicas
+    
+    def _renew_interval(self) -> float:
+        """Seconds between lease renewals: a third of the lock timeout."""
+        return self.lock_timeout / 3000
+    
+    def _queue_renewals(self, pipe: Any, locks: Dict[str, str]) -> None:
+        """Queue lease renewals of the given (fn_id: lock id) locks on a pipeline."""
+        for fn_id, lock_id in locks.items():
+            self._queue_script(pipe, _RENEW_SCRIPT, [self._get_lock_key(fn_id)], [lock_id, self.lock_timeout])
+    
+    def _check_renewals(self, locks: Dict[str, str], results: List[Any]) -> None:
+        """Log leases that could not be renewed."""
+        for (fn_id, lock_id), result in zip(locks.items(), results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to renew the lock for {fn_id}: {result}")
+            elif not result and self._locks.get(fn_id) == lock_id:
+                logger.warning(f"Lock for {fn_id} expired before it was renewed; "
+                               f"saves under it will be rejected")
+    
+    def _wait_command(self, replicas: int) -> Optional[Tuple[Any, ...]]:
+        """Return the command that waits for a write to become durable, if any."""
+        if self.wait_aof:
+            return ("WAITAOF", 1, replicas, self.wait_timeout)
+        if replicas > 0:
+            return ("WAIT", replicas, self.wait_timeout)
+        return None
+    
+    def _check_acks(self, fn_id: str, command: Tuple[Any, ...], reply: Any) -> None:
+        """Warn if fewer copies than requested acknowledged a write in time."""
+        if command[0] == "WAITAOF":
+            local, replicas = (int(value) for value in reply)
+            if local < 1 or replicas < command[2]:
+                logger.warning(f"Save of {fn_id} reached the AOF on {local} local and "
+                               f"{replicas}/{command[2]} replica servers in time")
+        elif int(reply) < command[1]:
+            logger.warning(f"Save of {fn_id} was acknowledged by {int(reply)}/{command[1]} replicas in time")
+    
+    def _durable_reply(self, fn_id: str, command: Tuple[Any, ...], results: List[Any]) -> Any:
+        """Return the reply of a write script pipelined with WAIT/WAITAOF, checking its acknowledgements."""
+        reply, acks = results
+        if isinstance(reply, Exception):
+            raise reply
+        if isinstance(acks, Exception):
+            logger.error(f"Failed to wait for the save of {fn_id} to become durable: {acks}")
+        elif int(reply) >= 0:
+            self._check_acks(fn_id, command, acks)
+        return reply
+    
+    def _script(self, source: str) -> Any:
+        """Return a registered script, loaded once and then invoked with EVALSHA."""
+        script = self._scripts.get(source)
+        if script is None:
+            script = self._scripts[source] = self.client.register_script(source)
+        return script
+    
+    def _queue_script(self, pipe: Any, source: str, keys: List[str], args: List[Any]) -> None:
+        """Queue a registered script on a blocking or asyncio pipeline, which loads it if needed."""
+        script = self._script(source)
+        pipe.scripts.add(script)
+        pipe.evalsha(script.sha, len(keys), *keys, *args)
+    
+    def _serialize_state(self, fn_id: str, data: Dict[str, Any]) -> bytes:
+        """Serialize a whole state, recording the time taken and the payload size."""
+        start = time.perf_counter()
+        payload = self._serialize(data)
+        metrics.record_serialization(fn_id, "serialize", time.perf_counter() - start, len(payload))
+        return payload
+    
+    def _serialize_field(self, field: str, value: Any) -> bytes:
+        """Serialize the value of a single top-level key."""
+        return self._serialize({field: value})
+    
+    def _deserialize_field(self, field: str, data: bytes) -> Any:
+        """Deserialize the value of a single top-level key."""
+        return cast(Dict[str, Any], self._deserialize(data))[field]
+    
+    def _deserialize(self, data: bytes) -> Optional[Dict[str, Any]]:
+        """Deserialize a stored state blob."""
+        return cast(Optional[Dict[str, Any]], self._serializer.deserialize(data))
+    
+    def _serialize(self, data: Dict[str, Any]) -> bytes:
+        """Serialize a state dictionary for storage."""
+        return self._serializer.serialize(data)
+
+
+class RedisBackend(_RedisKeyspace, StateBackend):
+    """Redis backend for distributed state persistence."""
     
     @property
     def client(self):
@@ -49,57 +803,324 @@ class RedisBackend(StateBackend):
             self._client = redis.from_url(self.redis_url)
         return self._client
     
-    def _get_state_key(self, fn_id: str) -> str:
-        """Get the Redis key for a function's state."""
-        return f"{self.prefix}state:{fn_id}"
+    def _owns_lock(self, fn_id: str) -> bool:
+        """Return True if the calling thread holds the lock for ``fn_id``."""
+        return bool(self._lock_owners.get(fn_id) == threading.get_ident())
     
-    def _get_lock_key(self, fn_id: str) -> str:
-        """Get the Redis key for a function's lock."""
-        return f"{self.prefix}lock:{fn_id}"
+    def _start_listener(self) -> None:
+        """Start this backend's thread receiving near cache invalidations, unless it is running."""
+        with self._renewer_lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener_stopped = threading.Event()
+            self._listener = threading.Thread(target=self._listen, args=(self._listener_stopped,),
+                                              name="statefulpy-redis-invalidate", daemon=True)
+            self._listener.start()
+    
+    def _listen(self, stopped: threading.Event) -> None:
+        """
+        Apply invalidations until stopped; resubscribe after connection errors.
+        
+        Once subscribed, the near cache is announced so that writes publish
+        invalidations, and the announcement is renewed while listening.
+        """
+        channel = self._get_invalidation_key()
+        while not stopped.is_set():
+            pubsub = self.client.pubsub()
+            try:
+                pubsub.subscribe(channel)
+                subscribed = False
+                while not stopped.is_set():
+                    message = pubsub.get_message(timeout=0.2)
+                    if message is not None:
+                        subscribed = subscribed or message["type"] == "subscribe"
+                        self._near_message(message)
+                    if subscribed and self._near_due():
+                        sent = time.monotonic()
+                        self.client.set(channel, 1, px=int(_NEAR_ANNOUNCE_TTL * 1000))
+                        self._near_announced(sent)
+            except Exception as e:
+                logger.warning(f"Near cache invalidations interrupted: {e}")
+            finally:
+                self._near_reset()
+                pubsub.close()
+            stopped.wait(1.0)
+    
+    def _start_renewal(self) -> None:
+        """Start this backend's thread renewing the leases of held locks, unless it is running."""
+        if not self.renew_locks:
+            return
+        with self._renewer_lock:
+            if self._renewer is not None and self._renewer.is_alive():
+                return
+            self._renewal_stopped = threading.Event()
+            self._renewer = threading.Thread(target=self._renew_loop, args=(self._renewal_stopped,),
+                                             name="statefulpy-redis-renew", daemon=True)
+            self._renewer.start()
+    
+    def _renew_loop(self, stopped: threading.Event) -> None:
+        """Extend all held locks every third of the lock timeout, in one round trip."""
+        while not stopped.wait(self._renew_interval()):
+            locks = dict(self._locks)
+            if not locks:
+                continue
+            try:
+                pipe = self.client.pipeline(transaction=False)
+                self._queue_renewals(pipe, locks)
+                self._check_renewals(locks, pipe.execute(raise_on_error=False))
+            except Exception as e:
+                logger.error(f"Failed to renew locks: {e}")
+    
+    def _send_pending(self, fn_id: str, lock_id: Optional[str] = None) -> Any:
+        """
+        Send the deferred writes of a function, followed by the lock release
+        if ``lock_id`` is given, in one round trip.
+        
+        Returns:
+            The reply of the lock release
+        """
+        pipe = self.client.pipeline(transaction=False)
+        writes = self._queue_pending(pipe, fn_id)
+        if lock_id is not None:
+            keys, args = self._unlock_call(fn_id, lock_id)
+            self._queue_script(pipe, _RELEASE_SCRIPT, keys, args)
+        results = pipe.execute(raise_on_error=False)
+        self._near_invalidate(fn_id)
+        for data, expected in self._check_pending(fn_id, writes, results):
+            self._write(fn_id, data, expected, None)
+        return results[-1] if lock_id is not None else None
+    
+    def _sync_pending(self, fn_id: str) -> None:
+        """Send deferred writes before the lock holder reads or writes the state directly."""
+        if fn_id in self._pending and self._owns_lock(fn_id):
+            self._send_pending(fn_id)
+    
+    def _durable_command(self) -> Optional[Tuple[Any, ...]]:
+        """With 'strict' durability, return the command that waits for a write to become durable."""
+        if self.durability != "strict":
+            return None
+        replicas = self.wait_replicas
+        if replicas is None:
+            replicas = self._connected_replicas
+            if replicas is None:
+                try:
+                    replicas = self._replicas_from_info(self.client.info("replication"))
+                except Exception as e:
+                    logger.error(f"Failed to count the replicas to wait for: {e}")
+                    return None
+        return self._wait_command(replicas)
+    
+    def _eval(self, fn_id: str, source: str, keys: List[str], args: List[Any]) -> Any:
+        """
+        Run a write script. With 'strict' durability, WAIT/WAITAOF is pipelined
+        after it: WAIT only counts acknowledgements of the writes made on its own
+        connection, which a separate call could get from the pool.
+        
+        Returns:
+            The reply of the script
+        """
+        command = self._durable_command()
+        if command is None:
+            return self._script(source)(keys=keys, args=args)
+        pipe = self.client.pipeline(transaction=False)
+        self._queue_script(pipe, source, keys, args)
+        pipe.execute_command(*command)
+        return self._durable_reply(fn_id, command, pipe.execute(raise_on_error=False))
     
     def load_state(self, fn_id: str) -> Optional[Dict[str, Any]]:
         """Load state for the given function ID."""
+        state, _ = self.load_state_versioned(fn_id)
+        return state
+    
+    def load_state_versioned(self, fn_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+        """Load state and its version for the given function ID in one round trip."""
         try:
-            key = self._get_state_key(fn_id)
-            data = self.client.get(key)
-            
-            if data is None:
-                return None
-            
-            if self.serializer == "pickle":
-                result = pickle.loads(data)
-            elif self.serializer == "json":
-                result = json.loads(data.decode('utf-8'))
+            prefetched = self._take_prefetched(fn_id)
+            if prefetched is not None:
+                state, version = prefetched
             else:
-                raise ValueError(f"Unsupported serializer: {self.serializer}")
-            return cast(Optional[Dict[str, Any]], result)
+                snapshot = self._near_begin(fn_id)
+                results = self._near_results(fn_id, snapshot)
+                if results is None:
+                    self._sync_pending(fn_id)
+                    pipe = self.client.pipeline(transaction=True)
+                    self._queue_load(pipe, fn_id)
+                    results = pipe.execute()
+                    self._near_store(fn_id, snapshot, results=results)
+                state, version = self._parse_load(fn_id, results)
+                self._note_version(fn_id, version)
+            self._note_known(fn_id, version)
+            return state, version
         except Exception as e:
             logger.error(f"Failed to load state for {fn_id}: {e}")
+            return None, None
+    
+    def load_fields(self, fn_id: str, fields: Iterable[str]) -> Dict[str, Any]:
+        """Load a subset of the top-level keys; a single HMGET with the 'fields' layout."""
+        fields = list(fields)
+        if self.layout != "fields" or not fields:
+            return super().load_fields(fn_id, fields)
+        try:
+            snapshot = self._near_begin(fn_id)
+            is_blob, values = self._near_fields(fn_id, snapshot, fields)
+            missing = [field for field in fields if field not in values]
+            if missing and not is_blob:
+                self._sync_pending(fn_id)
+                pipe = self.client.pipeline(transaction=True)
+                pipe.exists(self._get_state_key(fn_id))
+                pipe.hmget(self._get_fields_key(fn_id), missing)
+                is_blob, fetched = pipe.execute()
+                if not is_blob:
+                    values.update(zip(missing, fetched))
+                    self._near_store(fn_id, snapshot, fields=dict(zip(missing, fetched)))
+            if is_blob:
+                return super().load_fields(fn_id, fields)
+            return self._deserialize_fields(
+                fn_id, ((field, value) for field in fields if (value := values[field]) is not None)
+            )
+        except Exception as e:
+            logger.error(f"Failed to load fields for {fn_id}: {e}")
+            return {}
+    
+    def get_version(self, fn_id: str) -> Optional[int]:
+        """Get the version of the stored state (0 if there is none)."""
+        try:
+            prefetched = self._prefetched_version(fn_id)
+            if prefetched is not None:
+                return prefetched
+            snapshot = self._near_begin(fn_id)
+            version = self._near_version(fn_id, snapshot)
+            if version is None:
+                self._sync_pending(fn_id)
+                version = self.client.get(self._get_version_key(fn_id))
+                version = int(version) if version is not None else 0
+                self._near_store(fn_id, snapshot, version=version)
+            self._note_version(fn_id, version)
+            return version
+        except Exception as e:
+            logger.error(f"Failed to read state version for {fn_id}: {e}")
             return None
     
     def save_state(self, fn_id: str, data: Dict[str, Any]) -> bool:
         """Save state for the given function ID."""
+        saved, _ = self.save_state_versioned(fn_id, data)
+        return saved
+    
+    def _write(self, fn_id: str, data: Dict[str, Any], expected_version: Optional[int],
+               changed: Optional[Set[str]]) -> int:
+        """
+        Run a write script, fenced while the caller holds the lock.
+        
+        Returns:
+            The new version, -1 on a version conflict or -3 if the lock was
+            acquired by another caller
+        """
+        source, keys, args = self._fence(fn_id, self._write_call(fn_id, data, expected_version, changed))
+        version = int(self._eval(fn_id, source, keys, args))
+        if version == -2:
+            # Still stored as a blob: rewrite every key as a field
+            source, keys, args = self._fence(fn_id, self._write_call(fn_id, data, expected_version, None))
+            version = int(self._eval(fn_id, source, keys, args))
+        if version == -3:
+            logger.error(f"Save of {fn_id} was rejected: its lock was acquired by another caller")
+        return version
+    
+    def save_state_versioned(self, fn_id: str, data: Dict[str, Any],
+                             changed: Optional[Set[str]] = None) -> Tuple[bool, Optional[int]]:
+        """
+        Save state for the given function ID and bump its version atomically.
+        
+        With the 'fields' layout only the ``changed`` keys are written. With
+        'relaxed' durability a save by the lock holder is sent with the lock
+        release. A save by the lock holder is rejected if its fencing token
+        is no longer the latest.
+        """
         try:
-            key = self._get_state_key(fn_id)
-            
-            if self.serializer == "pickle":
-                serialized_data = pickle.dumps(data)
-            elif self.serializer == "json":
-                serialized_data = json.dumps(data).encode('utf-8')
-            else:
-                raise ValueError(f"Unsupported serializer: {self.serializer}")
-            
-            self.client.set(key, serialized_data)
-            return True
+            version = self._defer_write(fn_id, data, changed)
+            if version is not None:
+                return True, version
+            self._sync_pending(fn_id)
+            version = self._write(fn_id, data, None, changed)
+            self._near_invalidate(fn_id)
+            if version < 0:
+                return False, None
+            self._note_version(fn_id, version)
+            self._note_known(fn_id, version)
+            return True, version
         except Exception as e:
             logger.error(f"Failed to save state for {fn_id}: {e}")
-            return False
+            return False, None
+    
+    def compare_and_swap(self, fn_id: str, data: Dict[str, Any],
+                         expected_version: Optional[int],
+                         changed: Optional[Set[str]] = None) -> Tuple[bool, Optional[int]]:
+        """
+        Save state only if its version still equals the expected version.
+        
+        The check and the write run atomically in a single Lua script.
+        """
+        if expected_version is None:
+            return False, None
+        try:
+            self._sync_pending(fn_id)
+            version = self._write(fn_id, data, expected_version, changed)
+            self._near_invalidate(fn_id)
+            if version < 0:
+                return False, None
+            self._note_version(fn_id, version)
+            self._note_known(fn_id, version)
+            return True, version
+        except Exception as e:
+            logger.error(f"Failed to save state for {fn_id}: {e}")
+            return False, None
+    
+    def save_and_release(self, fn_id: str, data: Dict[str, Any],
+                         changed: Optional[Set[str]] = None) -> Tuple[bool, Optional[int]]:
+        """
+        Save state and release the lock in one round trip.
+        
+        One script writes the state, bumps its version and deletes the lock,
+        and writes nothing if this thread no longer holds the lock. Nested
+        acquisitions save and release separately.
+        """
+        if not self._owns_lock(fn_id) or self._lock_counter[fn_id] > 1:
+            return super().save_and_release(fn_id, data, changed)
+        try:
+            self._sync_pending(fn_id)
+            source, keys, args = self._release_call(fn_id, self._locks[fn_id], data, changed)
+        except Exception as e:
+            logger.error(f"Failed to save state for {fn_id}: {e}")
+            self.release_lock(fn_id)
+            return False, None
+        lock_id = self._forget_lock(fn_id)
+        try:
+            version = int(self._eval(fn_id, source, keys, args))
+            if version == -2:
+                # Still stored as a blob: rewrite every key as a field
+                source, keys, args = self._release_call(fn_id, lock_id, data, None)
+                version = int(self._eval(fn_id, source, keys, args))
+        except Exception as e:
+            logger.error(f"Failed to save state for {fn_id}: {e}")
+            self._release(fn_id, lock_id)
+            return False, None
+        self._near_invalidate(fn_id)
+        if version == -3:
+            logger.error(f"Lock for {fn_id} expired before its state was saved")
+            return False, None
+        self._note_known(fn_id, version)
+        return True, version
     
     def acquire_lock(self, fn_id: str, timeout: float = 10.0) -> bool:
         """
         Acquire a distributed lock for the given function ID.
         
-        Uses Redis SET NX PX pattern for atomic locks.
+        Uses Redis SET NX PX pattern for atomic locks. The same script
+        returns the state's version, and the state unless this backend
+        already has that version, so the holder's first reads need no
+        further round trip.
+        If the lock is taken, the caller joins a queue and blocks in BLPOP
+        until the holder hands the lock over on release (first come, first
+        served), its lease expires or ``timeout`` passes.
         This implementation is reentrant - the same thread can acquire
         the lock multiple times without deadlocking.
         """
@@ -110,32 +1131,33 @@ class RedisBackend(StateBackend):
             self._lock_counter[fn_id] += 1
             return True
             
-        lock_key = self._get_lock_key(fn_id)
-        lock_id = f"{time.time()}"
+        lock_id = uuid.uuid4().hex
+        keys, args = self._lock_call(fn_id, lock_id)
+        lock_and_load = self._script(_LOCK_AND_LOAD_SCRIPT)
+        wake_key = self._get_wake_key(fn_id, lock_id)
         
         # Try to acquire the lock with timeout
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            # SET key value NX PX milliseconds
-            # NX - only set if key doesn't exist
-            # PX - expire after milliseconds
-            acquired = self.client.set(
-                lock_key, 
-                lock_id, 
-                nx=True, 
-                px=self.lock_timeout
-            )
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # Last attempt: leave the queue if the lock is still taken
+                args[3] = 0
+            # SET key value PX milliseconds if free, then read the state
+            reply = lock_and_load(keys=keys, args=args)
             
-            if acquired:
+            if isinstance(reply, list):
                 self._locks[fn_id] = lock_id
                 self._lock_owners[fn_id] = current_thread
                 self._lock_counter[fn_id] = 1
+                self._note_lock_reply(fn_id, reply)
+                self._start_renewal()
                 return True
+            if remaining <= 0:
+                return False
             
-            # Wait a bit before retrying
-            time.sleep(0.1)
-        
-        return False
+            # Queued: block until the holder hands the lock over
+            self.client.blpop([wake_key], timeout=self._wait_time(int(reply), remaining))
     
     def release_lock(self, fn_id: str) -> bool:
         """
@@ -150,34 +1172,414 @@ class RedisBackend(StateBackend):
             if self._lock_counter[fn_id] > 0:
                 return True
             
-            lock_key = self._get_lock_key(fn_id)
-            lock_id = self._locks.get(fn_id)
-            lua_script = """
-            if redis.call('get', KEYS[1]) == ARGV[1] then
-                return redis.call('del', KEYS[1])
-            else
-                return 0
-            end
-            """
-            try:
-                result = self.client.eval(lua_script, 1, lock_key, lock_id)
-                # Clean up internal bookkeeping when lock is fully released
-                del self._locks[fn_id]
-                del self._lock_owners[fn_id]
-                del self._lock_counter[fn_id]
-                return bool(result == 1)
-            except Exception as e:
-                logger.error(f"Failed to release lock for {fn_id}: {e}")
-                return False
+            return self._release(fn_id, self._forget_lock(fn_id))
         return False
     
+    def _release(self, fn_id: str, lock_id: str) -> bool:
+        """Release a lock whose bookkeeping was already dropped, with any deferred writes."""
+        try:
+            if fn_id in self._pending:
+                # 'relaxed' durability: deferred saves go out with the release
+                result = self._send_pending(fn_id, lock_id)
+            else:
+                # Hands the lock to the first queued waiter, if any
+                keys, args = self._unlock_call(fn_id, lock_id)
+                result = self._script(_RELEASE_SCRIPT)(keys=keys, args=args)
+            return bool(result == 1)
+        except Exception as e:
+            logger.error(f"Failed to release lock for {fn_id}: {e}")
+            return False
+    
     def close(self) -> None:
         """Close the Redis connection and release all locks."""
         # Release all locks
         for fn_id in list(self._locks.keys()):
             self.release_lock(fn_id)
         
+        if self._renewer is not None:
+            self._renewal_stopped.set()
+            self._renewer.join()
+            self._renewer = None
+        if self._listener is not None:
+            self._listener_stopped.set()
+            self._listener.join()
+            self._listener = None
+        
         # Close the Redis connection
         if self._client is not None:
             self._client.close()
             self._client = None
+            self._scripts = {}
+
+
+class AsyncRedisBackend(_RedisKeyspace, AsyncStateBackend):
+    """
+    Non-blocking Redis backend for stateful ``async def`` functions.
+    
+    Uses ``redis.asyncio`` with the same key layout as :class:`RedisBackend`,
+    so blocking and asyncio functions can share state. Locks are reentrant per
+    asyncio task.
+    """
+    
+    @property
+    def client(self):
+        """Lazy-loaded asyncio Redis client."""
+        if self._client is None:
+            self._client = redis_asyncio.from_url(self.redis_url)
+        return self._client
+    
+    def _owns_lock(self, fn_id: str) -> bool:
+        """Return True if the current task holds the lock for ``fn_id``."""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            return False
+        return task is not None and self._lock_owners.get(fn_id) is task
+    
+    def _start_listener(self) -> None:
+        """Start this backend's task receiving near cache invalidations, unless it is running."""
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+    
+    async def _listen(self) -> None:
+        """Apply invalidations until cancelled, announcing the near cache (see RedisBackend._listen)."""
+        channel = self._get_invalidation_key()
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.subscribe(channel)
+                subscribed = False
+                while True:
+                    message = await pubsub.get_message(timeout=1.0)
+                    if message is not None:
+                        subscribed = subscribed or message["type"] == "subscribe"
+                        self._near_message(message)
+                    if subscribed and self._near_due():
+                        sent = time.monotonic()
+                        await self.client.set(channel, 1, px=int(_NEAR_ANNOUNCE_TTL * 1000))
+                        self._near_announced(sent)
+            except Exception as e:
+                logger.warning(f"Near cache invalidations interrupted: {e}")
+            finally:
+                self._near_reset()
+                # redis-py < 5 names the coroutine reset(); newer versions prefer aclose()
+                await (getattr(pubsub, "aclose", None) or pubsub.reset)()
+            await asyncio.sleep(1.0)
+    
+    def _start_renewal(self) -> None:
+        """Start the task renewing the leases of held locks; it ends when no lock is held."""
+        if self.renew_locks and (self._renewer is None or self._renewer.done()):
+            self._renewer = asyncio.get_running_loop().create_task(self._renew_loop())
+    
+    async def _renew_loop(self) -> None:
+        """Extend all held locks every third of the lock timeout, in one round trip."""
+        while True:
+            await asyncio.sleep(self._renew_interval())
+            locks = dict(self._locks)
+            if not locks:
+                return
+            try:
+                pipe = self.client.pipeline(transaction=False)
+                self._queue_renewals(pipe, locks)
+                self._check_renewals(locks, await pipe.execute(raise_on_error=False))
+            except Exception as e:
+                logger.error(f"Failed to renew locks: {e}")
+    
+    async def _send_pending(self, fn_id: str, lock_id: Optional[str] = None) -> Any:
+        """Send deferred writes, and the lock release if ``lock_id`` is given, in one round trip."""
+        pipe = self.client.pipeline(transaction=False)
+        writes = self._queue_pending(pipe, fn_id)
+        if lock_id is not None:
+            keys, args = self._unlock_call(fn_id, lock_id)
+            self._queue_script(pipe, _RELEASE_SCRIPT, keys, args)
+        results = await pipe.execute(raise_on_error=False)
+        self._near_invalidate(fn_id)
+        for data, expected in self._check_pending(fn_id, writes, results):
+            await self._write(fn_id, data, expected, None)
+        return results[-1] if lock_id is not None else None
+    
+    async def _sync_pending(self, fn_id: str) -> None:
+        """Send deferred writes before the lock holder reads or writes the state directly."""
+        if fn_id in self._pending and self._owns_lock(fn_id):
+            await self._send_pending(fn_id)
+    
+    async def _durable_command(self) -> Optional[Tuple[Any, ...]]:
+        """With 'strict' durability, return the command that waits for a write to become durable."""
+        if self.durability != "strict":
+            return None
+        replicas = self.wait_replicas
+        if replicas is None:
+            replicas = self._connected_replicas
+            if replicas is None:
+                try:
+                    replicas = self._replicas_from_info(await self.client.info("replication"))
+                except Exception as e:
+                    logger.error(f"Failed to count the replicas to wait for: {e}")
+                    return None
+        return self._wait_command(replicas)
+    
+    async def _eval(self, fn_id: str, source: str, keys: List[str], args: List[Any]) -> Any:
+        """Run a write script, followed by WAIT/WAITAOF with 'strict' durability (see RedisBackend._eval)."""
+        command = await self._durable_command()
+        if command is None:
+            return await self._script(source)(keys=keys, args=args)
+        pipe = self.client.pipeline(transaction=False)
+        self._queue_script(pipe, source, keys, args)
+        pipe.execute_command(*command)
+        return self._durable_reply(fn_id, command, await pipe.execute(raise_on_error=False))
+    
+    async def load_state(self, fn_id: str) -> Optional[Dict[str, Any]]:
+        """Load state for the given function ID."""
+        state, _ = await self.load_state_versioned(fn_id)
+        return state
+    
+    async def load_state_versioned(self, fn_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+        """Load state and its version for the given function ID in one round trip."""
+        try:
+            prefetched = self._take_prefetched(fn_id)
+            if prefetched is not None:
+                state, version = prefetched
+            else:
+                snapshot = self._near_begin(fn_id)
+                results = self._near_results(fn_id, snapshot)
+                if results is None:
+                    await self._sync_pending(fn_id)
+                    pipe = self.client.pipeline(transaction=True)
+                    self._queue_load(pipe, fn_id)
+                    results = await pipe.execute()
+                    self._near_store(fn_id, snapshot, results=results)
+                state, version = self._parse_load(fn_id, results)
+                self._note_version(fn_id, version)
+            self._note_known(fn_id, version)
+            return state, version
+        except Exception as e:
+            logger.error(f"Failed to load state for {fn_id}: {e}")
+            return None, None
+    
+    async def load_fields(self, fn_id: str, fields: Iterable[str]) -> Dict[str, Any]:
+        """Load a subset of the top-level keys; a single HMGET with the 'fields' layout."""
+        fields = list(fields)
+        if self.layout != "fields" or not fields:
+            return await super().load_fields(fn_id, fields)
+        try:
+            snapshot = self._near_begin(fn_id)
+            is_blob, values = self._near_fields(fn_id, snapshot, fields)
+            missing = [field for field in fields if field not in values]
+            if missing and not is_blob:
+                await self._sync_pending(fn_id)
+                pipe = self.client.pipeline(transaction=True)
+                pipe.exists(self._get_state_key(fn_id))
+                pipe.hmget(self._get_fields_key(fn_id), missing)
+                is_blob, fetched = await pipe.execute()
+                if not is_blob:
+                    values.update(zip(missing, fetched))
+                    self._near_store(fn_id, snapshot, fields=dict(zip(missing, fetched)))
+            if is_blob:
+                return await super().load_fields(fn_id, fields)
+            return self._deserialize_fields(
+                fn_id, ((field, value) for field in fields if (value := values[field]) is not None)
+            )
+        except Exception as e:
+            logger.error(f"Failed to load fields for {fn_id}: {e}")
+            return {}
+    
+    async def get_version(self, fn_id: str) -> Optional[int]:
+        """Get the version of the stored state (0 if there is none)."""
+        try:
+            prefetched = self._prefetched_version(fn_id)
+            if prefetched is not None:
+                return prefetched
+            snapshot = self._near_begin(fn_id)
+            version = self._near_version(fn_id, snapshot)
+            if version is None:
+                await self._sync_pending(fn_id)
+                version = await self.client.get(self._get_version_key(fn_id))
+                version = int(version) if version is not None else 0
+                self._near_store(fn_id, snapshot, version=version)
+            self._note_version(fn_id, version)
+            return version
+        except Exception as e:
+            logger.error(f"Failed to read state version for {fn_id}: {e}")
+            return None
+    
+    async def save_state(self, fn_id: str, data: Dict[str, Any]) -> bool:
+        """Save state for the given function ID."""
+        saved, _ = await self.save_state_versioned(fn_id, data)
+        return saved
+    
+    async def _write(self, fn_id: str, data: Dict[str, Any], expected_version: Optional[int],
+                     changed: Optional[Set[str]]) -> int:
+        """Run a write script, fenced while the caller holds the lock (see RedisBackend._write)."""
+        source, keys, args = self._fence(fn_id, self._write_call(fn_id, data, expected_version, changed))
+        version = int(await self._eval(fn_id, source, keys, args))
+        if version == -2:
+            # Still stored as a blob: rewrite every key as a field
+            source, keys, args = self._fence(fn_id, self._write_call(fn_id, data, expected_version, None))
+            version = int(await self._eval(fn_id, source, keys, args))
+        if version == -3:
+            logger.error(f"Save of {fn_id} was rejected: its lock was acquired by another caller")
+        return version
+    
+    async def save_state_versioned(self, fn_id: str, data: Dict[str, Any],
+                                   changed: Optional[Set[str]] = None) -> Tuple[bool, Optional[int]]:
+        """
+        Save state for the given function ID and bump its version atomically.
+        
+        With the 'fields' layout only the ``changed`` keys are written. With
+        'relaxed' durability a save by the lock holder is sent with the lock
+        release. A save by the lock holder is rejected if its fencing token
+        is no longer the latest.
+        """
+        try:
+            version = self._defer_write(fn_id, data, changed)
+            if version is not None:
+                return True, version
+            await self._sync_pending(fn_id)
+            version = await self._write(fn_id, data, None, changed)
+            self._near_invalidate(fn_id)
+            if version < 0:
+                return False, None
+            self._note_version(fn_id, version)
+            self._note_known(fn_id, version)
+            return True, version
+        except Exception as e:
+            logger.error(f"Failed to save state for {fn_id}: {e}")
+            return False, None
+    
+    async def compare_and_swap(self, fn_id: str, data: Dict[str, Any],
+                               expected_version: Optional[int],
+                               changed: Optional[Set[str]] = None) -> Tuple[bool, Optional[int]]:
+        """
+        Save state only if its version still equals the expected version.
+        
+        The check and the write run atomically in a single Lua script.
+        """
+        if expected_version is None:
+            return False, None
+        try:
+            await self._sync_pending(fn_id)
+            version = await self._write(fn_id, data, expected_version, changed)
+            self._near_invalidate(fn_id)
+            if version < 0:
+                return False, None
+            self._note_version(fn_id, version)
+            self._note_known(fn_id, version)
+            return True, version
+        except Exception as e:
+            logger.error(f"Failed to save state for {fn_id}: {e}")
+            return False, None
+    
+    async def save_and_release(self, fn_id: str, data: Dict[str, Any],
+                               changed: Optional[Set[str]] = None) -> Tuple[bool, Optional[int]]:
+        """Save state and release the lock in one round trip (see :meth:`RedisBackend.save_and_release`)."""
+        if not self._owns_lock(fn_id) or self._lock_counter[fn_id] > 1:
+            return await super().save_and_release(fn_id, data, changed)
+        try:
+            await self._sync_pending(fn_id)
+            source, keys, args = self._release_call(fn_id, self._locks[fn_id], data, changed)
+        except Exception as e:
+            logger.error(f"Failed to save state for {fn_id}: {e}")
+            await self.release_lock(fn_id)
+            return False, None
+        lock_id = self._forget_lock(fn_id)
+        try:
+            version = int(await self._eval(fn_id, source, keys, args))
+            if version == -2:
+                # Still stored as a blob: rewrite every key as a field
+                source, keys, args = self._release_call(fn_id, lock_id, data, None)
+                version = int(await self._eval(fn_id, source, keys, args))
+        except Exception as e:
+            logger.error(f"Failed to save state for {fn_id}: {e}")
+            await self._release(fn_id, lock_id)
+            return False, None
+        self._near_invalidate(fn_id)
+        if version == -3:
+            logger.error(f"Lock for {fn_id} expired before its state was saved")
+            return False, None
+        self._note_known(fn_id, version)
+        return True, version
+    
+    async def acquire_lock(self, fn_id: str, timeout: float = 10.0) -> bool:
+        """
+        Acquire a distributed lock for the given function ID.
+        
+        Like :meth:`RedisBackend.acquire_lock`, the lock reply carries the
+        state and waiters queue for the lock; waiting blocks a connection of
+        the pool, not the event loop. The lock is reentrant for the asyncio
+        task that holds it.
+        """
+        current_task = asyncio.current_task()
+        
+        if fn_id in self._lock_owners and self._lock_owners[fn_id] is current_task:
+            self._lock_counter[fn_id] += 1
+            return True
+        
+        lock_id = uuid.uuid4().hex
+        keys, args = self._lock_call(fn_id, lock_id)
+        lock_and_load = self._script(_LOCK_AND_LOAD_SCRIPT)
+        wake_key = self._get_wake_key(fn_id, lock_id)
+        
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                args[3] = 0
+            reply = await lock_and_load(keys=keys, args=args)
+            
+            if isinstance(reply, list):
+                self._locks[fn_id] = lock_id
+                self._lock_owners[fn_id] = current_task
+                self._lock_counter[fn_id] = 1
+                self._note_lock_reply(fn_id, reply)
+                self._start_renewal()
+                return True
+            if remaining <= 0:
+                return False
+            
+            await self.client.blpop([wake_key], timeout=self._wait_time(int(reply), remaining))
+    
+    async def release_lock(self, fn_id: str) -> bool:
+        """Release the lock for the given function ID (reentrant, see acquire_lock)."""
+        current_task = asyncio.current_task()
+        if fn_id in self._lock_owners and self._lock_owners[fn_id] is current_task:
+            self._lock_counter[fn_id] -= 1
+            if self._lock_counter[fn_id] > 0:
+                return True
+            
+            return await self._release(fn_id, self._forget_lock(fn_id))
+        return False
+    
+    async def _release(self, fn_id: str, lock_id: str) -> bool:
+        """Release a lock whose bookkeeping was already dropped, with any deferred writes."""
+        try:
+            if fn_id in self._pending:
+                # 'relaxed' durability: deferred saves go out with the release
+                result = await self._send_pending(fn_id, lock_id)
+            else:
+                # Hands the lock to the first queued waiter, if any
+                keys, args = self._unlock_call(fn_id, lock_id)
+                result = await self._script(_RELEASE_SCRIPT)(keys=keys, args=args)
+            return bool(result == 1)
+        except Exception as e:
+            logger.error(f"Failed to release lock for {fn_id}: {e}")
+            return False
+    
+    async def close(self) -> None:
+        """Close the Redis connection, sending any deferred writes first."""
+        if self._renewer is not None:
+            self._renewer.cancel()
+            self._renewer = None
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        for fn_id in list(self._pending):
+            try:
+                await self._send_pending(fn_id)
+            except Exception as e:
+                logger.error(f"Failed to send deferred saves of {fn_id}: {e}")
+        if self._client is not None:
+            # redis-py < 5 names the coroutine close(); newer versions prefer aclose()
+            aclose = getattr(self._client, "aclose", None) or self._client.close
+            await aclose()
+            self._client = None
+            self._scripts = {}
@@ -0,0 +1,398 @@
+"""
+Client backend for the local state server (``statefulpy serve``).
+
+Each thread talks to the server over its own Unix socket connection, and
+locks belong to that connection. A pessimistic call costs one round trip:
+
+* ``acquire_lock`` takes the lock and receives the state's version, and the
+  state itself unless this backend already has that version;
+* the version check and load are answered from that response;
+* a save made under the lock is sent together with the lock release, which
+  does not wait for the server's reply. The reply is read before the next
+  request; a failed deferred save is logged.
+
+With ``durability="strict"`` the release waits for the server, which writes the
+state to its database before replying.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple, cast
+
+from statefulpy import metrics
+from statefulpy.backends.base import StateBackend, check_durability
+from statefulpy.serializers import get_serializer
+from statefulpy.server import (
+    FLAG_PERSIST,
+    OP_LOAD,
+    OP_LOCK,
+    OP_SAVE,
+    OP_UNLOCK,
+    OP_VERSION,
+    REQUEST,
+    RESPONSE,
+    STATUS_CONFLICT,
+    STATUS_OK,
+    read_exact,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _Connection:
+    """A thread's connection to the server and the locks it holds."""
+
+    def __init__(self, socket_path: str):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.rfile = self.sock.makefile("rb")
+        self.pid = os.getpid()
+        # fn_ids of lock releases sent without waiting for the reply, in order
+        self.unread: List[str] = []
+        # Lock depth per fn_id
+        self.depths: Dict[str, int] = {}
+        # Responses to lock requests: fn_id -> (version, state bytes or None)
+        self.prefetched: Dict[str, Tuple[int, Optional[bytes]]] = {}
+        # Saves to send with the lock release: fn_id -> (payload, expected version)
+        self.pending: Dict[str, Tuple[bytes, int]] = {}
+
+    def send(self, op: int, fn_id: str, number: int = -1, payload: bytes = b"",
+             timeout: float = 0.0) -> None:
+        key = fn_id.encode("utf-8")
+        self.sock.sendall(REQUEST.pack(len(payload), op, number, timeout, len(key)) + key + payload)
+
+    def receive(self) -> Tuple[int, int, bytes]:
+        length, status, number = RESPONSE.unpack(read_exact(self.rfile, RESPONSE.size))
+        return status, number, read_exact(self.rfile, length) if length else b""
+
+    def close(self) -> None:
+        self.rfile.close()
+        self.sock.close()
+
+
+class ServerBackend(StateBackend):
+    """Backend that keeps state in a local state server."""
+
+    def __init__(self, socket_path: str = "statefulpy.sock", serializer: str = "pickle",
+                 durability: Optional[str] = None):
+        """
+        Initialize the server backend.
+
+        Args:
+            socket_path: Unix socket the server listens on
+            serializer: Serializer to use ('pickle' or 'json'; e.g. 'json+zlib' to
+                compress large states)
+            durability: 'strict' waits for every save to be written to the
+                server's database; other levels leave that to the server's
+                background writes
+        """
+        self.durability = check_durability(durability)
+        self.socket_path = socket_path
+        self.serializer = get_serializer(serializer)
+        self._local = threading.local()
+        self._connections: List[_Connection] = []
+        self._connections_lock = threading.Lock()
+        # Last version this backend loaded or saved per fn_id; states at that
+        # version are not sent again
+        self._known: Dict[str, int] = {}
+
+    def _connection(self) -> _Connection:
+        """Return the calling thread's connection, connecting on first use or after a fork."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or conn.pid != os.getpid():
+            conn = self._local.conn = _Connection(self.socket_path)
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _drop(self, conn: _Connection) -> None:
+        """Discard a broken connection; the server releases its locks."""
+        self._local.conn = None
+        with self._connections_lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+    def _drain(self, conn: _Connection) -> None:
+        """Read the replies to requests sent without waiting."""
+        while conn.unread:
+            fn_id = conn.unread.pop(0)
+            status, _, message = conn.receive()
+            if status != STATUS_OK:
+                logger.error(f"Server rejected release for {fn_id}: "
+                             f"{message.decode('utf-8', 'replace') or 'version conflict'}")
+
+    def _request(self, op: int, fn_id: str, number: int = -1, payload: bytes = b"",
+                 timeout: float = 0.0) -> Tuple[int, int, bytes]:
+        """Send a request and return (status, number, payload) of its response."""
+        conn = self._connection()
+        try:
+            conn.send(op, fn_id, number, payload, timeout)
+            self._drain(conn)
+            return conn.receive()
+        except (OSError, EOFError):
+            self._drop(conn)
+            raise
+
+    def _flush_pending(self, fn_id: str) -> None:
+        """Send a save deferred until the lock release now."""
+        conn = self._connection()
+        pending = conn.pending.pop(fn_id, None)
+        if pending is not None:
+            status, version, _ = self._request(OP_SAVE, fn_id, pending[1], pending[0])
+            if status != STATUS_OK:
+                logger.error(f"Server rejected deferred save for {fn_id}")
+            else:
+                conn.prefetched[fn_id] = (version, None)
+
+    def _deserialize(self, fn_id: str, payload: bytes) -> Dict[str, Any]:
+        start = time.perf_counter()
+        state = cast(Dict[str, Any], self.serializer.deserialize(payload))
+        metrics.record_serialization(fn_id, "deserialize", time.perf_counter() - start, len(payload))
+        return state
+
+    def _serialize(self, fn_id: str, state: Dict[str, Any]) -> bytes:
+        start = time.perf_counter()
+        payload = self.serializer.serialize(state)
+        metrics.record_serialization(fn_id, "serialize", time.perf_counter() - start, len(payload))
+        return payload
+
+    def load_state(self, fn_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Load state for a function from the server.
+
+        Args:
+            fn_id: Function identifier
+
+        Returns:
+            The state dictionary or None if it doesn't exist
+        """
+        state, _ = self.load_state_versioned(fn_id)
+        return state
+
+    def load_state_versioned(self, fn_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+        """
+        Load state for a function together with its version.
+
+        Under the lock, the state received with the lock is used.
+
+        Args:
+            fn_id: Function identifier
+
+        Returns:
+            A tuple of (state dictionary or None, version). The version is 0 if
+            no state is stored and None if it could not be read.
+        """
+        try:
+            conn = self._connection()
+            if fn_id in conn.pending:
+                self._flush_pending(fn_id)
+            prefetched = conn.prefetched.get(fn_id)
+            if prefetched is not None and (prefetched[1] is not None or prefetched[0] == 0):
+                version, payload = prefetched
+                # Keep the version for the save; the state is only used once
+                conn.prefetched[fn_id] = (version, None)
+            else:
+                _, version, data = self._request(OP_LOAD, fn_id)
+                payload = data if version else None
+            self._known[fn_id] = version
+            return (self._deserialize(fn_id, payload) if payload is not None else None), version
+        except (OSError, EOFError, ValueError) as e:
+            logger.error(f"Error loading state for {fn_id}: {e}")
+            return None, None
+
+    def get_version(self, fn_id: str) -> Optional[int]:
+        """
+        Get the version of a function's stored state.
+
+        Under the lock, the version received with the lock is returned.
+
+        Args:
+            fn_id: Function identifier
+
+        Returns:
+            The version, 0 if no state is stored, or None on error
+        """
+        try:
+            conn = self._connection()
+            if fn_id in conn.pending:
+                return conn.pending[fn_id][1] + 1
+            prefetched = conn.prefetched.get(fn_id)
+            if prefetched is not None:
+                return prefetched[0]
+            return self._request(OP_VERSION, fn_id)[1]
+        except (OSError, EOFError) as e:
+            logger.error(f"Error getting version for {fn_id}: {e}")
+            return None
+
+    def save_state(self, fn_id: str, state: Dict[str, Any]) -> bool:
+        """
+        Save state for a function to the server.
+
+        Args:
+            fn_id: Function identifier
+            state: The state dictionary to save
+
+        Returns:
+            True if successful, False otherwise
+        """
+        saved, _ = self.save_state_versioned(fn_id, state)
+        return saved
+
+    def save_state_versioned(self, fn_id: str, state: Dict[str, Any],
+                             changed: Optional[Set[str]] = None) -> Tuple[bool, Optional[int]]:
+        """
+        Save state for a function and bump its version.
+
+        Under the lock, and once the version is known from the lock response or
+        a load, the save is sent with the lock release.
+
+        Args:
+            fn_id: Function identifier
+            state: The state dictionary to save
+            changed: Ignored; the server stores whole states
+
+        Returns:
+            A tuple of (success, new version)
+        """
+        try:
+            payload = self._serialize(fn_id, state)
+            conn = self._connection()
+            if conn.depths.get(fn_id) and self.durability != "strict":
+                if fn_id in conn.pending:
+                    self._flush_pending(fn_id)
+                version = self.get_version(fn_id)
+                if version is not None:
+                    conn.prefetched.pop(fn_id, None)
+                    conn.pending[fn_id] = (payload, version)
+                    self._known[fn_id] = version + 1
+                    return True, version + 1
+            return self._save(fn_id, payload, -1)
+        except (OSError, EOFError, TypeError, ValueError) as e:
+            logger.error(f"Error saving state for {fn_id}: {e}")
+            return False, None
+
+    def compare_and_swap(self, fn_id: str, state: Dict[str, Any],
+                         expected_version: Optional[int],
+                         changed: Optional[Set[str]] = None) -> Tuple[bool, Optional[int]]:
+        """
+        Save state only if its version still equals the expected version.
+
+        Args:
+            fn_id: Function identifier
+            state: The state dictionary to save
+            expected_version: Version the state was loaded at (0 if it did not exist)
+            changed: Ignored; the server stores whole states
+
+        Returns:
+            A tuple of (saved, new version); saved is False on a version conflict
+        """
+        if expected_version is None:
+            return False, None
+        try:
+            if fn_id in self._connection().pending:
+                self._flush_pending(fn_id)
+            return self._save(fn_id, self._serialize(fn_id, state), expected_version)
+        except (OSError, EOFError, TypeError, ValueError) as e:
+            logger.error(f"Error saving state for {fn_id}: {e}")
+            return False, None
+
+    def _save(self, fn_id: str, payload: bytes, expected_version: int) -> Tuple[bool, Optional[int]]:
+        """Save a serialized state and wait for the server."""
+        op = OP_SAVE | FLAG_PERSIST if self.durability == "strict" else OP_SAVE
+        status, version, message = self._request(op, fn_id, expected_version, payload)
+        if status == STATUS_CONFLICT:
+            return False, None
+        if status != STATUS_OK:
+            logger.error(f"Server rejected save for {fn_id}: {message.decode('utf-8', 'replace')}")
+            return False, None
+        self._known[fn_id] = version
+        return True, version
+
+    def acquire_lock(self, fn_id: str, timeout: float = 10.0) -> bool:
+        """
+        Acquire a lock for a function.
+
+        The server answers with the state's version, and the state if this
+        backend does not have that version yet.
+
+        Args:
+            fn_id: Function identifier
+            timeout: Timeout for acquiring the lock
+
+        Returns:
+            True if the lock was acquired, False otherwise
+        """
+        try:
+            conn = self._connection()
+            status, version, payload = self._request(
+                OP_LOCK, fn_id, self._known.get(fn_id, -1), timeout=max(timeout, 0.0)
+            )
+        except (OSError, EOFError) as e:
+            logger.error(f"Error acquiring lock for {fn_id}: {e}")
+            return False
+        if status != STATUS_OK:
+            logger.error(f"Timeout acquiring lock for {fn_id}")
+            return False
+        conn.depths[fn_id] = conn.depths.get(fn_id, 0) + 1
+        conn.prefetched[fn_id] = (version, payload if version and version != self._known.get(fn_id)
+                                  else None)
+        return True
+
+    def release_lock(self, fn_id: str) -> bool:
+        """
+        Release a lock for a function, sending a deferred save with it.
+
+        The release does not wait for the server unless durability is 'strict'.
+
+        Args:
+            fn_id: Function identifier
+
+        Returns:
+            True if the lock was released, False if this thread did not hold it
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None or conn.pid != os.getpid() or not conn.depths.get(fn_id):
+            return False
+        conn.depths[fn_id] -= 1
+        if not conn.depths[fn_id]:
+            del conn.depths[fn_id]
+            conn.prefetched.pop(fn_id, None)
+        payload, expected = conn.pending.pop(fn_id, (b"", -1))
+        try:
+            if self.durability == "strict":
+                status, _, message = self._request(OP_UNLOCK | FLAG_PERSIST, fn_id, expected, payload)
+                if status != STATUS_OK:
+                    logger.error(f"Server rejected release for {fn_id}: "
+                                 f"{message.decode('utf-8', 'replace') or 'version conflict'}")
+                    return False
+                return True
+            conn.send(OP_UNLOCK, fn_id, expected, payload)
+            conn.unread.append(fn_id)
+            return True
+        except (OSError, EOFError) as e:
+            logger.error(f"Error releasing lock for {fn_id}: {e}")
+            self._drop(conn)
+            return False
+
+    def close(self) -> None:
+        """Read outstanding replies and close all connections."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and conn.pid == os.getpid():
+            try:
+                self._drain(conn)
+            except (OSError, EOFError) as e:
+                logger.error(f"Error reading replies from {self.socket_path}: {e}")
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except OSError:
+                pass
+        self._local = threading.local()
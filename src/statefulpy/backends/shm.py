@@ -0,0 +1,554 @@
+"""
+Shared-memory backend for statefulpy.
+
+States live in a ``multiprocessing.shared_memory`` segment that every process
+on the host opens by name, so workers of one machine share state without a
+database or network round trip. Cross-process locking uses ``fcntl`` record
+locks on a lock file: byte 0 guards the segment itself and byte ``1 + i``
+is the function lock of slot ``i``. Record locks are released by the kernel
+when a process dies, so a crashed worker never leaves a state locked. POSIX
+only.
+
+Segment layout::
+
+    header   magic, format, slot count, arena start, arena size, arena top
+    slots    one fixed-size entry per function: key and data offsets,
+             capacity, data length, version
+    arena    keys and serialized states, allocated by bumping ``arena top``;
+             compacted in place when it runs out of space
+
+Slots form an open-addressing hash table keyed by a CRC-32 of the function
+id. Slots are never freed, so a process can cache the slot of a function.
+"""
+import contextlib
+import fcntl
+import logging
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from multiprocessing import shared_memory
+from typing import Any, Dict, Iterator, List, Optional, Tuple, cast
+
+from statefulpy import metrics
+from statefulpy.backends.base import StateBackend, check_durability
+from statefulpy.serializers import get_serializer
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b"SPYSHM\x00\x01"
+_FORMAT = 1
+# magic, format, slot count, arena start, arena size, arena top
+_HEADER = struct.Struct("<8sIIQQQ")
+_HEADER_SIZE = 64
+# key offset, key length, data offset, capacity, data length, version
+_SLOT = struct.Struct("<QQQQQQ")
+_ALIGN = 8
+
+
+def _align(size: int) -> int:
+    return (size + _ALIGN - 1) & ~(_ALIGN - 1)
+
+
+def _open_segment(name: str, create: bool, size: int = 0) -> shared_memory.SharedMemory:
+    """
+    Open a shared memory segment that outlives the processes using it.
+
+    The resource tracker of Python < 3.13 unlinks segments when the process
+    that opened them exits, so they are removed from its bookkeeping.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    segment = shared_memory.SharedMemory(name=name, create=create, size=size)
+    from multiprocessing import resource_tracker
+    resource_tracker.unregister(segment._name, "shared_memory")  # type: ignore[attr-defined]
+    return segment
+
+
+class _Segment:
+    """A process's handle on a shared memory segment and its lock file."""
+
+    def __init__(self, name: str, size: int, slots: int, lock_path: str):
+        self.name = name
+        self.lock_path = lock_path
+        # Number of open backends using the segment in this process
+        self.users = 0
+        self._fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        # Record locks belong to the process, so threads are excluded in-process first
+        self._mutex = threading.Lock()
+        self._slot_cache: Dict[str, int] = {}
+        self._slot_locks: Dict[int, threading.RLock] = {}
+        # slot -> (owning thread, acquisition depth) of function locks held by this process
+        self._slot_holders: Dict[int, Tuple[int, int]] = {}
+        self._slot_locks_mutex = threading.Lock()
+        try:
+            with self._locked():
+                self.shm = self._attach(size, slots)
+        except BaseException:
+            os.close(self._fd)
+            raise
+        self.buf = cast(memoryview, self.shm.buf)
+        self.slot_count: int
+        self.arena_start: int
+        self.arena_size: int
+        _, _, self.slot_count, self.arena_start, self.arena_size, _ = _HEADER.unpack_from(self.buf, 0)
+
+    def _attach(self, size: int, slots: int) -> shared_memory.SharedMemory:
+        """Open the segment, creating and formatting it if it does not exist yet."""
+        try:
+            shm = _open_segment(self.name, create=False)
+        except FileNotFoundError:
+            arena_start = _align(_HEADER_SIZE + slots * _SLOT.size)
+            if size <= arena_start:
+                raise ValueError(f"size must be larger than {arena_start} bytes for {slots} slots")
+            shm = _open_segment(self.name, create=True, size=size)
+            buf = cast(memoryview, shm.buf)
+            buf[:arena_start] = bytes(arena_start)
+            _HEADER.pack_into(buf, 0, _MAGIC, _FORMAT, slots, arena_start,
+                              size - arena_start, arena_start)
+            del buf
+            return shm
+        magic, version = struct.unpack_from("<8sI", cast(memoryview, shm.buf), 0)
+        if magic != _MAGIC or version != _FORMAT:
+            shm.close()
+            raise ValueError(f"Shared memory segment {self.name} is not a statefulpy segment")
+        return shm
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Hold the lock that guards the slot table and the arena."""
+        with self._mutex:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, 0)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 0)
+
+    def _slot(self, index: int) -> List[int]:
+        return list(_SLOT.unpack_from(self.buf, _HEADER_SIZE + index * _SLOT.size))
+
+    def _set_slot(self, index: int, entry: List[int]) -> None:
+        _SLOT.pack_into(self.buf, _HEADER_SIZE + index * _SLOT.size, *entry)
+
+    def _find(self, fn_id: str, create: bool) -> Optional[int]:
+        """Return the slot of a function, claiming a free one if ``create``; needs the lock."""
+        index = self._slot_cache.get(fn_id)
+        if index is not None:
+            return index
+        key = fn_id.encode("utf-8")
+        start = zlib.crc32(key) % self.slot_count
+        for probe in range(self.slot_count):
+            index = (start + probe) % self.slot_count
+            key_offset, key_len = self._slot(index)[:2]
+            if key_len == 0:
+                if not create:
+                    return None
+                allocated = self._allocate(len(key))
+                if allocated is None:
+                    raise MemoryError(f"Shared memory segment {self.name} is full")
+                key_offset = allocated
+                self.buf[key_offset:key_offset + len(key)] = key
+                self._set_slot(index, [key_offset, len(key), 0, 0, 0, 0])
+                self._slot_cache[fn_id] = index
+                return index
+            if key_len == len(key) and self.buf[key_offset:key_offset + key_len] == key:
+                self._slot_cache[fn_id] = index
+                return index
+        raise MemoryError(f"All {self.slot_count} slots of shared memory segment {self.name} are in use")
+
+    def _top(self) -> int:
+        return cast(int, struct.unpack_from("<Q", self.buf, 32)[0])
+
+    def _set_top(self, top: int) -> None:
+        struct.pack_into("<Q", self.buf, 32, top)
+
+    def _allocate(self, size: int) -> Optional[int]:
+        """Allocate arena space, compacting the arena if needed; None if it does not fit."""
+        size = _align(max(size, 1))
+        end = self.arena_start + self.arena_size
+        if self._top() + size > end:
+            self._compact()
+        top = self._top()
+        if top + size > end:
+            return None
+        self._set_top(top + size)
+        return top
+
+    def _compact(self) -> None:
+        """Move all keys and states to the start of the arena, dropping abandoned blocks."""
+        live: List[Tuple[int, List[int], bytes, bytes]] = []
+        for index in range(self.slot_count):
+            entry = self._slot(index)
+            key_offset, key_len, data_offset, _, data_len, _ = entry
+            if key_len:
+                live.append((index, entry, bytes(self.buf[key_offset:key_offset + key_len]),
+                             bytes(self.buf[data_offset:data_offset + data_len])))
+        top = self.arena_start
+        for index, entry, key, data in live:
+            self.buf[top:top + len(key)] = key
+            entry[0] = top
+            top += _align(len(key))
+            if entry[3]:
+                self.buf[top:top + len(data)] = data
+                entry[2], entry[3] = top, _align(len(data))
+                top += entry[3]
+            self._set_slot(index, entry)
+        self._set_top(top)
+
+    def read(self, fn_id: str) -> Tuple[int, Optional[bytes]]:
+        """Return (version, serialized state); (0, None) if no state is stored."""
+        with self._locked():
+            index = self._find(fn_id, create=False)
+            if index is None:
+                return 0, None
+            _, _, data_offset, capacity, data_len, version = self._slot(index)
+            if not capacity:
+                return version, None
+            return version, bytes(self.buf[data_offset:data_offset + data_len])
+
+    def version(self, fn_id: str) -> int:
+        """Return the version of a state, 0 if none is stored."""
+        with self._locked():
+            index = self._find(fn_id, create=False)
+            return self._slot(index)[5] if index is not None else 0
+
+    def write(self, fn_id: str, data: bytes, expected_version: Optional[int] = None) -> Optional[int]:
+        """
+        Store a state and bump its version.
+
+        Returns:
+            The new version, or None if ``expected_version`` did not match
+
+        Raises:
+            MemoryError: If the segment has no room for the state
+        """
+        with self._locked():
+            index = cast(int, self._find(fn_id, create=True))
+            entry = self._slot(index)
+            if expected_version is not None and entry[5] != expected_version:
+                return None
+            if len(data) > entry[3]:
+                # Leave room to grow so that a growing state is not moved on every save.
+                # The old block is kept until the new one is allocated, so a
+                # state that does not fit is left intact.
+                capacity = _align(len(data) + len(data) // 4)
+                offset = self._allocate(capacity)
+                if offset is None:
+                    raise MemoryError(
+                        f"Shared memory segment {self.name} has no room for "
+                        f"{len(data)} bytes of state for {fn_id}"
+                    )
+                # Compaction may have moved the key and the old block
+                entry = self._slot(index)
+                entry[2], entry[3] = offset, capacity
+            self.buf[entry[2]:entry[2] + len(data)] = data
+            entry[4] = len(data)
+            entry[5] += 1
+            self._set_slot(index, entry)
+            return cast(int, entry[5])
+
+    def _slot_lock(self, index: int) -> threading.RLock:
+        with self._slot_locks_mutex:
+            lock = self._slot_locks.get(index)
+            if lock is None:
+                lock = self._slot_locks[index] = threading.RLock()
+            return lock
+
+    def acquire(self, fn_id: str, timeout: float) -> bool:
+        """Take the lock of a function for the current thread, waiting up to ``timeout`` seconds."""
+        deadline = time.monotonic() + timeout
+        with self._locked():
+            index = cast(int, self._find(fn_id, create=True))
+        lock = self._slot_lock(index)
+        if not lock.acquire(timeout=max(timeout, 0)):
+            return False
+        depth = self._slot_holders.get(index, (0, 0))[1]
+        if depth == 0:
+            delay = 0.0001
+            while True:
+                try:
+                    fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, 1 + index)
+                    break
+                except OSError:
+                    if time.monotonic() >= deadline:
+                        lock.release()
+                        return False
+                    time.sleep(delay)
+                    delay = min(delay * 2, 0.01)
+        self._slot_holders[index] = (threading.get_ident(), depth + 1)
+        return True
+
+    def release(self, fn_id: str) -> bool:
+        """Release one acquisition of a function lock; False if this thread does not hold it."""
+        index = self._slot_cache.get(fn_id)
+        if index is None:
+            return False
+        owner, depth = self._slot_holders.get(index, (None, 0))
+        if owner != threading.get_ident():
+            return False
+        depth -= 1
+        try:
+            if depth == 0:
+                del self._slot_holders[index]
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 1 + index)
+            else:
+                self._slot_holders[index] = (owner, depth)
+        finally:
+            self._slot_lock(index).release()
+        return True
+
+    def close(self) -> None:
+        """Detach from the segment and close the lock file; releases all record locks."""
+        del self.buf
+        self.shm.close()
+        os.close(self._fd)
+
+
+_segments: Dict[str, _Segment] = {}
+_segments_lock = threading.Lock()
+
+
+def _lock_path(name: str, lock_path: Optional[str]) -> str:
+    return os.path.abspath(lock_path or os.path.join(tempfile.gettempdir(), f"statefulpy-shm-{name}.lock"))
+
+
+def _get_segment(name: str, size: int, slots: int, lock_path: Optional[str]) -> _Segment:
+    """Return this process's handle on a segment, opening it on first use."""
+    with _segments_lock:
+        segment = _segments.get(name)
+        if segment is None:
+            segment = _segments[name] = _Segment(name, size, slots, _lock_path(name, lock_path))
+        segment.users += 1
+        return segment
+
+
+def _release_segment(segment: _Segment) -> None:
+    """Stop using a segment; the handle is closed once no backend of this process uses it."""
+    with _segments_lock:
+        segment.users -= 1
+        if segment.users > 0:
+            return
+        if _segments.get(segment.name) is segment:
+            del _segments[segment.name]
+    segment.close()
+
+
+class SharedMemoryBackend(StateBackend):
+    """Backend that shares state between the processes of one host through shared memory."""
+
+    def __init__(self, serializer: str = "pickle", name: str = "statefulpy",
+                 size: int = 64 * 1024 * 1024, slots: int = 4096,
+                 lock_path: Optional[str] = None, durability: Optional[str] = None):
+        """
+        Initialize the shared-memory backend.
+
+        Args:
+            serializer: Serializer to use ('pickle' or 'json'; e.g. 'json+zlib' to
+                compress large states)
+            name: Name of the shared memory segment; processes using the same
+                name share their states
+            size: Size of the segment in bytes when it is created. Pages are
+                only backed by memory once written.
+            slots: Maximum number of functions (state keys) when the segment is
+                created
+            lock_path: Lock file used for cross-process locking (default:
+                ``statefulpy-shm-<name>.lock`` in the temporary directory)
+            durability: Accepted for compatibility with the other backends;
+                the segment is lost when the host restarts
+
+        ``size`` and ``slots`` only apply to the process that creates the
+        segment; later processes use the existing one. The segment stays
+        until :meth:`unlink` is called or the host restarts.
+        """
+        if slots < 1:
+            raise ValueError("slots must be at least 1")
+        self.durability = check_durability(durability)
+        self.name = name
+        self.serializer = get_serializer(serializer)
+        self._segment = _get_segment(name, size, slots, lock_path)
+        self._closed = False
+
+    def load_state(self, fn_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Load state for a function from shared memory.
+
+        Args:
+            fn_id: Function identifier
+
+        Returns:
+            The state dictionary or None if it doesn't exist
+        """
+        state, _ = self.load_state_versioned(fn_id)
+        return state
+
+    def load_state_versioned(self, fn_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+        """
+        Load state for a function together with its version.
+
+        Args:
+            fn_id: Function identifier
+
+        Returns:
+            A tuple of (state dictionary or None, version). The version is 0 if
+            no state is stored and None if it could not be read.
+        """
+        try:
+            version, data = self._segment.read(fn_id)
+            if data is None:
+                return None, version
+            start = time.perf_counter()
+            state = self.serializer.deserialize(data)
+            metrics.record_serialization(fn_id, "deserialize", time.perf_counter() - start, len(data))
+            return state, version
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading state for {fn_id}: {e}")
+            return None, None
+
+    def get_version(self, fn_id: str) -> Optional[int]:
+        """
+        Get the version of a function's stored state.
+
+        Args:
+            fn_id: Function identifier
+
+        Returns:
+            The version, 0 if no state is stored, or None on error
+        """
+        try:
+            return self._segment.version(fn_id)
+        except OSError as e:
+            logger.error(f"Error reading state version for {fn_id}: {e}")
+            return None
+
+    def save_state(self, fn_id: str, state: Dict[str, Any]) -> bool:
+        """
+        Save state for a function to shared memory.
+
+        Args:
+            fn_id: Function identifier
+            state: The state dictionary to save
+
+        Returns:
+            True if successful, False otherwise
+        """
+        saved, _ = self.save_state_versioned(fn_id, state)
+        return saved
+
+    def save_state_versioned(self, fn_id: str, state: Dict[str, Any],
+                             changed: Optional[Any] = None) -> Tuple[bool, Optional[int]]:
+        """
+        Save state for a function and bump its version.
+
+        Args:
+            fn_id: Function identifier
+            state: The state dictionary to save
+            changed: Ignored; the whole state is always written
+
+        Returns:
+            A tuple of (success, new version)
+        """
+        return self._write(fn_id, state, None)
+
+    def compare_and_swap(self, fn_id: str, state: Dict[str, Any],
+                         expected_version: Optional[int],
+                         changed: Optional[Any] = None) -> Tuple[bool, Optional[int]]:
+        """
+        Save state only if its version still equals the expected version.
+
+        The version check and the write happen under the segment lock, so no
+        function lock is needed.
+
+        Args:
+            fn_id: Function identifier
+            state: The state dictionary to save
+            expected_version: Version the state was loaded at (0 if it did not exist)
+            changed: Ignored; the whole state is always written
+
+        Returns:
+            A tuple of (saved, new version); saved is False on a version conflict
+        """
+        if expected_version is None:
+            return False, None
+        return self._write(fn_id, state, expected_version)
+
+    def _write(self, fn_id: str, state: Dict[str, Any],
+               expected_version: Optional[int]) -> Tuple[bool, Optional[int]]:
+        """Serialize a state and store it, optionally only at the expected version."""
+        try:
+            start = time.perf_counter()
+            data = self.serializer.serialize(state)
+            metrics.record_serialization(fn_id, "serialize", time.perf_counter() - start, len(data))
+            version = self._segment.write(fn_id, data, expected_version)
+        except (MemoryError, OSError, TypeError, ValueError) as e:
+            logger.error(f"Error saving state for {fn_id}: {e}")
+            return False, None
+        return version is not None, version
+
+    def acquire_lock(self, fn_id: str, timeout: float = 10.0) -> bool:
+        """
+        Acquire a lock for a function.
+
+        Locks are reentrant, held by the acquiring thread and released by the
+        kernel if the process dies.
+
+        Args:
+            fn_id: Function identifier
+            timeout: Timeout for acquiring the lock
+
+        Returns:
+            True if the lock was acquired, False otherwise
+        """
+        try:
+            if self._segment.acquire(fn_id, timeout):
+                return True
+        except (MemoryError, OSError) as e:
+            logger.error(f"Error acquiring lock for {fn_id}: {e}")
+            return False
+        logger.error(f"Timeout acquiring lock for {fn_id}")
+        return False
+
+    def release_lock(self, fn_id: str) -> bool:
+        """
+        Release a lock for a function.
+
+        Args:
+            fn_id: Function identifier
+
+        Returns:
+            True if the lock was released, False if this thread did not hold it
+        """
+        try:
+            return self._segment.release(fn_id)
+        except OSError as e:
+            logger.error(f"Error releasing lock for {fn_id}: {e}")
+            return False
+
+    def close(self) -> None:
+        """Detach from the segment once no other backend of this process uses it."""
+        if not self._closed:
+            self._closed = True
+            _release_segment(self._segment)
+
+    def unlink(self) -> None:
+        """
+        Close the backend and remove the segment and its lock file.
+
+        Processes that still have the segment open keep using their mapping,
+        but new processes start with an empty segment.
+        """
+        lock_path = self._segment.lock_path
+        self.close()
+        try:
+            # Opened with resource tracking, which unlink() expects
+            segment = shared_memory.SharedMemory(name=self.name)
+            segment.close()
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+        try:
+            os.unlink(lock_path)
+        except FileNotFoundError:
+            pass
@@ -1,24 +1,298 @@
 """
 SQLite backend for statefulpy.
 """
+import io
 import os
+import re
 import json
+import asyncio
+import functools
+import hashlib
+import queue
 import sqlite3
+import tempfile
 import logging
 import time
 import threading
-from typing import Any, Dict, Optional, Union
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Set, Tuple, Union, cast
 from sqlite3 import Connection
 
 import portalocker
 
-from .base import StateBackend
+from .base import StateBackend, AsyncStateBackend, AsyncRLock, check_durability
+from statefulpy import metrics
 from statefulpy.serializers import get_serializer
 
 logger = logging.getLogger(__name__)
 
-# SQLite connection pool - thread-local connections
-_local = threading.local()
+# Statements kept prepared per connection; the backend uses a small fixed set
+# of queries, plus one per distinct field count in load_fields
+_CACHED_STATEMENTS = 256
+
+_SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+# PRAGMA synchronous used for each durability level unless set explicitly.
+# In WAL mode NORMAL only syncs at checkpoints: a power loss can drop the
+# latest commits but does not corrupt the database.
+_DURABILITY_SYNCHRONOUS = {"strict": "FULL", "normal": "NORMAL", "relaxed": "OFF"}
+_TEMP_STORE_MODES = ("DEFAULT", "FILE", "MEMORY")
+
+# Incremental blob I/O (Connection.blobopen) is available from Python 3.11
+_HAS_BLOBOPEN = hasattr(sqlite3.Connection, "blobopen")
+
+# Bytes copied per read or write when streaming a state blob
+_STREAM_CHUNK = 1024 * 1024
+
+
+# A serialized state: bytes, a spooled state for streaming, or None for the 'fields' layout
+_StateData = Union[bytes, "_SpooledState", None]
+
+# A write queued for group commit: (fn_id, write function, its arguments, result)
+_PendingWrite = Tuple[str, Any, Tuple[Any, ...], Future]
+
+
+class _GroupCommitWriter:
+    """
+    Thread that commits the writes of all threads using a database in shared transactions.
+    
+    Each batch is one ``BEGIN IMMEDIATE`` transaction with a savepoint per
+    write, so a failed or conflicting write does not affect the others. A
+    batch holds the writes queued while the previous one was committing, up
+    to ``max_batch`` of them, plus any arriving within ``delay`` seconds.
+    """
+    
+    def __init__(self, pool: "_ConnectionPool", delay: float, max_batch: int):
+        self._pool = pool
+        self.delay = delay
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Optional[_PendingWrite]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="statefulpy-sqlite-writer", daemon=True)
+        self._thread.start()
+    
+    def submit(self, item: _PendingWrite) -> None:
+        """Queue a write; its future is resolved once its batch committed."""
+        self._queue.put(item)
+    
+    def stop(self) -> None:
+        """Commit the writes queued so far, then stop the thread."""
+        self._queue.put(None)
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+    
+    def _run(self) -> None:
+        """Writer loop."""
+        stopping = False
+        try:
+            while not stopping:
+                item = self._queue.get()
+                if item is None:
+                    break
+                batch = [item]
+                deadline = time.monotonic() + self.delay
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        if remaining > 0:
+                            item = self._queue.get(timeout=remaining)
+                        else:
+                            item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stopping = True
+                        break
+                    batch.append(item)
+                self._commit(batch)
+        finally:
+            self._pool.close_connection()
+    
+    def _commit(self, batch: List[_PendingWrite]) -> None:
+        """Apply a batch of writes in one transaction and resolve their futures."""
+        outcomes: List[Any] = []
+        try:
+            conn = self._pool.get()
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            for fn_id, write, args, _ in batch:
+                cursor.execute("SAVEPOINT statefulpy_write")
+                try:
+                    outcome = write(cursor, *args)
+                except sqlite3.Error as e:
+                    logger.error(f"Error saving state for {fn_id}: {e}")
+                    outcome = (False, None)
+                except Exception as e:
+                    outcome = e
+                if not isinstance(outcome, tuple) or not outcome[0]:
+                    cursor.execute("ROLLBACK TO statefulpy_write")
+                cursor.execute("RELEASE statefulpy_write")
+                outcomes.append(outcome)
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error committing a batch of {len(batch)} writes: {e}")
+            try:
+                self._pool.get().rollback()
+            except sqlite3.Error:
+                pass
+            outcomes = [(False, None)] * len(batch)
+        
+        for (_, _, _, future), outcome in zip(batch, outcomes):
+            if isinstance(outcome, BaseException):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+
+
+class _SpooledState:
+    """A serialized state too large to buffer in memory, spooled to a temporary file."""
+
+    __slots__ = ("file", "size")
+
+    def __init__(self, file: Any, size: int):
+        self.file = file
+        self.size = size
+
+
+class _BlobReader(io.RawIOBase):
+    """Read-only raw stream over an open ``sqlite3.Blob``."""
+
+    def __init__(self, blob: Any):
+        self._blob = blob
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        data = self._blob.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class _ConnectionPool:
+    """
+    Thread-local connections to one database file, all opened with the same PRAGMAs.
+    
+    Each thread also records here how many transaction locks it holds on its
+    connection, so that backends sharing the connection share the transaction.
+    With group commit the pool also owns the database's writer thread. The
+    pool counts the backends using it and is only closed by the last of them.
+    """
+    
+    def __init__(self, db_path: str, busy_timeout: int, pragmas: Tuple[Tuple[str, Any], ...],
+                 group_commit: Optional[Tuple[float, int]] = None):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self.pragmas = pragmas
+        self.group_commit = group_commit
+        self._local = threading.local()
+        self._writer: Optional[_GroupCommitWriter] = None
+        self._writer_lock = threading.Lock()
+        # Open backends using the pool; guarded by _pools_lock
+        self.users = 0
+    
+    def get(self) -> Connection:
+        """Return the calling thread's connection, opening it if needed."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=self.busy_timeout / 1000,
+                cached_statements=_CACHED_STATEMENTS,
+            )
+            
+            # Enable WAL journal mode for better concurrency
+            conn.execute("PRAGMA journal_mode=WAL;")
+            
+            # Set foreign keys constraint
+            conn.execute("PRAGMA foreign_keys=ON;")
+            
+            # Enable extended error codes
+            conn.execute("PRAGMA legacy_file_format=OFF;")
+            
+            for name, value in self.pragmas:
+                conn.execute(f"PRAGMA {name}={value};")
+            
+            self._local.conn = conn
+            self._local.txn_depth = 0
+            self._local.busy_timeout = self.busy_timeout
+        return conn
+    
+    @property
+    def txn_depth(self) -> int:
+        """Number of transaction locks the calling thread holds."""
+        return getattr(self._local, 'txn_depth', 0)
+    
+    @txn_depth.setter
+    def txn_depth(self, value: int) -> None:
+        self._local.txn_depth = value
+    
+    def set_busy_timeout(self, milliseconds: int) -> None:
+        """Change how long the calling thread's connection waits for locks."""
+        conn = self.get()
+        if self._local.busy_timeout != milliseconds:
+            conn.execute(f"PRAGMA busy_timeout={milliseconds};")
+            self._local.busy_timeout = milliseconds
+    
+    def submit(self, fn_id: str, write: Any, args: Tuple[Any, ...]) -> Tuple[bool, Optional[int]]:
+        """Run a write on the writer thread and wait until it is committed."""
+        future: Future = Future()
+        with self._writer_lock:
+            if self._writer is None:
+                assert self.group_commit is not None
+                self._writer = _GroupCommitWriter(self, *self.group_commit)
+            self._writer.submit((fn_id, write, args, future))
+        return cast(Tuple[bool, Optional[int]], future.result())
+    
+    def close_connection(self) -> None:
+        """Close the calling thread's connection; a transaction still open is rolled back."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            self._local.txn_depth = 0
+            conn.close()
+    
+    def close(self) -> None:
+        """Close the calling thread's connection and stop the writer thread, if any."""
+        if self.txn_depth > 0:
+            logger.warning(f"Closing the connection to {self.db_path} rolls back "
+                           f"a transaction that holds {self.txn_depth} lock(s)")
+        with self._writer_lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            # Writes queued before this are still committed
+            writer.stop()
+        self.close_connection()
+
+
+_PoolKey = Tuple[str, int, Tuple[Tuple[str, Any], ...], Optional[Tuple[float, int]]]
+
+# Connection pools keyed by absolute database path and connection settings
+_pools: Dict[_PoolKey, _ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(db_path: str, busy_timeout: int, pragmas: Tuple[Tuple[str, Any], ...],
+              group_commit: Optional[Tuple[float, int]] = None) -> _ConnectionPool:
+    """Return the shared connection pool for a database and its settings, counting a new user."""
+    key = (os.path.abspath(db_path), busy_timeout, pragmas, group_commit)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = _ConnectionPool(key[0], busy_timeout, pragmas, group_commit)
+        pool.users += 1
+        return pool
+
+
+def _release_pool(pool: _ConnectionPool) -> bool:
+    """
+    Drop a user of a connection pool.
+    
+    Returns:
+        True if it was the last user, so the pool should be closed
+    """
+    with _pools_lock:
+        pool.users = max(pool.users - 1, 0)
+        return pool.users == 0
 
 # Add type annotations for file-lock tracking
 _locks: Dict[str, Any] = {}
@@ -27,19 +301,84 @@ _lock_counts: Dict[str, int] = {}
 class SQLiteBackend(StateBackend):
     """SQLite backend for state persistence."""
 
-    def __init__(self, db_path: str = "stateful.db", serializer: str = "pickle"):
+    def __init__(self, db_path: str = "stateful.db", serializer: str = "pickle", layout: str = "blob",
+                 locking: str = "file", synchronous: Optional[str] = None,
+                 cache_size: Optional[int] = None, mmap_size: Optional[int] = None,
+                 temp_store: Optional[str] = None, busy_timeout: int = 5000,
+                 wal_autocheckpoint: Optional[int] = None, group_commit: bool = False,
+                 group_commit_delay: float = 0.0, group_commit_size: int = 128,
+                 durability: Optional[str] = None, stream_threshold: Optional[int] = None):
         """
         Initialize the SQLite backend.
         
         Args:
             db_path: Path to the SQLite database file
-            serializer: Serializer to use ('pickle' or 'json')
+            serializer: Serializer to use ('pickle' or 'json'; e.g. 'json+zlib' to
+                compress large states)
+            layout: 'blob' stores each state as one serialized value; 'fields'
+                stores every top-level key as its own row so that only changed
+                keys are rewritten
+            locking: 'file' locks each function with a lock file next to the
+                database; 'transaction' runs each locked call inside a single
+                ``BEGIN IMMEDIATE`` transaction that is committed when the lock
+                is released. Transaction locks exclude all writers of the
+                database, not just those of the same function.
+            synchronous: ``PRAGMA synchronous`` ('OFF', 'NORMAL', 'FULL' or
+                'EXTRA'; default: SQLite's default, FULL)
+            cache_size: ``PRAGMA cache_size``; pages if positive, KiB if negative
+            mmap_size: ``PRAGMA mmap_size`` in bytes (0 disables memory mapping)
+            temp_store: ``PRAGMA temp_store`` ('DEFAULT', 'FILE' or 'MEMORY')
+            busy_timeout: Milliseconds to wait for a locked database
+            wal_autocheckpoint: ``PRAGMA wal_autocheckpoint`` in pages (0
+                disables automatic checkpoints)
+            group_commit: Hand saves to a writer thread that commits the saves
+                of all threads using the database in shared transactions; a
+                save returns once its transaction is committed. Not
+                available with 'transaction' locking.
+            group_commit_delay: Seconds the writer waits for more saves
+                before committing a batch (default: commit right away; saves
+                that arrive during a commit form the next batch)
+            group_commit_size: Maximum number of saves per batch
+            durability: 'strict', 'normal' or 'relaxed'; selects the
+                ``synchronous`` level (FULL, NORMAL or OFF) unless it is
+                given explicitly
+            stream_threshold: Stream states of at least this many bytes
+                between the serializer and the database with incremental
+                blob I/O instead of holding the serialized state in memory
+                (default: never). Saves serialize into a temporary file that
+                spills to disk at this size. Requires Python 3.11+ and only
+                applies to the 'blob' layout.
+        
+        Options left as None keep SQLite's defaults. Backends for the same
+        database file and settings share their per-thread connections.
         """
         super().__init__()
+        if layout not in ("blob", "fields"):
+            raise ValueError(f"Unknown layout: {layout}. Valid layouts are: blob, fields")
+        if locking not in ("file", "transaction"):
+            raise ValueError(f"Unknown locking mode: {locking}. Valid modes are: file, transaction")
+        if group_commit and locking == "transaction":
+            raise ValueError("group_commit cannot be combined with 'transaction' locking")
+        if group_commit_delay < 0:
+            raise ValueError("group_commit_delay must not be negative")
+        self._check_int("group_commit_size", group_commit_size, 1)
+        self.durability = check_durability(durability)
+        if synchronous is None and durability is not None:
+            synchronous = _DURABILITY_SYNCHRONOUS[durability]
+        self._pool = _get_pool(db_path, self._check_int("busy_timeout", busy_timeout, 0),
+                               self._pragmas(synchronous, cache_size, mmap_size,
+                                             temp_store, wal_autocheckpoint),
+                               (float(group_commit_delay), group_commit_size) if group_commit else None)
         self.db_path = db_path
         self.serializer = get_serializer(serializer)
-        self._locks = {}
-        self._lock_counts = {}  # For reentrance tracking
+        self.stream_threshold = (self._check_int("stream_threshold", stream_threshold, 1)
+                                 if stream_threshold is not None else None)
+        self.layout = layout
+        self.locking = locking
+        self._locks: Dict[str, Optional[int]] = {}
+        self._lock_counts: Dict[str, int] = {}  # For reentrance tracking
+        self._file_locks: Dict[str, portalocker.Lock] = {}
+        self._closed = False
         
         # Create database directory if it doesn't exist
         db_dir = os.path.dirname(os.path.abspath(db_path))
@@ -49,21 +388,43 @@ class SQLiteBackend(StateBackend):
         # Initialize database
         self._init_db()
     
+    @staticmethod
+    def _check_int(name: str, value: Any, minimum: Optional[int] = None) -> int:
+        """Validate an integer option."""
+        if isinstance(value, bool) or not isinstance(value, int) or (
+                minimum is not None and value < minimum):
+            bound = f" >= {minimum}" if minimum is not None else ""
+            raise ValueError(f"{name} must be an integer{bound}, got {value!r}")
+        return value
+    
+    @classmethod
+    def _pragmas(cls, synchronous: Optional[str], cache_size: Optional[int],
+                 mmap_size: Optional[int], temp_store: Optional[str],
+                 wal_autocheckpoint: Optional[int]) -> Tuple[Tuple[str, Any], ...]:
+        """Validate the tuning options and return them as (PRAGMA, value) pairs."""
+        pragmas: List[Tuple[str, Any]] = []
+        if synchronous is not None:
+            if str(synchronous).upper() not in _SYNCHRONOUS_MODES:
+                raise ValueError(f"Unknown synchronous mode: {synchronous}. "
+                                 f"Valid modes are: {', '.join(_SYNCHRONOUS_MODES)}")
+            pragmas.append(("synchronous", str(synchronous).upper()))
+        if cache_size is not None:
+            pragmas.append(("cache_size", cls._check_int("cache_size", cache_size)))
+        if mmap_size is not None:
+            pragmas.append(("mmap_size", cls._check_int("mmap_size", mmap_size, 0)))
+        if temp_store is not None:
+            if str(temp_store).upper() not in _TEMP_STORE_MODES:
+                raise ValueError(f"Unknown temp_store mode: {temp_store}. "
+                                 f"Valid modes are: {', '.join(_TEMP_STORE_MODES)}")
+            pragmas.append(("temp_store", str(temp_store).upper()))
+        if wal_autocheckpoint is not None:
+            pragmas.append(("wal_autocheckpoint",
+                            cls._check_int("wal_autocheckpoint", wal_autocheckpoint, 0)))
+        return tuple(pragmas)
+    
     def _get_connection(self) -> Connection:
-        """Get a thread-local connection to the database."""
-        if not hasattr(_local, 'conn') or _local.conn is None:
-            _local.conn = sqlite3.connect(self.db_path)
-            
-            # Enable WAL journal mode for better concurrency
-            _local.conn.execute("PRAGMA journal_mode=WAL;")
-            
-            # Set foreign keys constraint
-            _local.conn.execute("PRAGMA foreign_keys=ON;")
-            
-            # Enable extended error codes
-            _local.conn.execute("PRAGMA legacy_file_format=OFF;")
-        
-        return _local.conn
+        """Get this thread's connection to the database from the shared pool."""
+        return self._pool.get()
 
     def _init_db(self) -> None:
         """Initialize the database schema."""
@@ -76,10 +437,29 @@ class SQLiteBackend(StateBackend):
             CREATE TABLE IF NOT EXISTS stateful_state (
                 fn_id TEXT PRIMARY KEY,
                 state BLOB,
+                version INTEGER NOT NULL DEFAULT 0,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             );
             """)
             
+            # Databases created before versioning was added lack the column
+            cursor.execute("PRAGMA table_info(stateful_state)")
+            columns = {row[1] for row in cursor.fetchall()}
+            if "version" not in columns:
+                cursor.execute(
+                    "ALTER TABLE stateful_state ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
+                )
+            
+            # Create field table, used by the 'fields' layout
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stateful_fields (
+                fn_id TEXT NOT NULL,
+                field TEXT NOT NULL,
+                value BLOB,
+                PRIMARY KEY (fn_id, field)
+            );
+            """)
+            
             # Create lock table
             cursor.execute("""
             CREATE TABLE IF NOT EXISTS stateful_locks (
@@ -104,6 +484,86 @@ class SQLiteBackend(StateBackend):
         Returns:
             The state dictionary or None if it doesn't exist
         """
+        state, _ = self.load_state_versioned(fn_id)
+        return state
+    
+    def load_state_versioned(self, fn_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+        """
+        Load state for a function together with its version.
+        
+        Args:
+            fn_id: Function identifier
+            
+        Returns:
+            A tuple of (state dictionary or None, version). The version is 0 if
+            no state is stored and None if it could not be read.
+        """
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        streaming = self._streaming()
+        # Streamed reads need the row lookup and the blob in one snapshot
+        own_transaction = streaming and not conn.in_transaction
+        
+        try:
+            if own_transaction:
+                conn.execute("BEGIN")
+            if streaming:
+                cursor.execute(
+                    """
+                    SELECT CASE WHEN length(state) < ? THEN state END, version,
+                           length(state), rowid
+                    FROM stateful_state WHERE fn_id = ?
+                    """,
+                    (self.stream_threshold, fn_id)
+                )
+            else:
+                cursor.execute(
+                    "SELECT state, version FROM stateful_state WHERE fn_id = ?",
+                    (fn_id,)
+                )
+            row = cursor.fetchone()
+            
+            if not row:
+                return None, 0
+            
+            state_data, version = row[:2]
+            if streaming and state_data is None and row[2] is not None:
+                return self._read_blob(conn, fn_id, row[3], row[2]), version
+            if state_data is None:
+                # Stored with the 'fields' layout
+                cursor.execute(
+                    "SELECT field, value FROM stateful_fields WHERE fn_id = ?",
+                    (fn_id,)
+                )
+                return self._deserialize_rows(fn_id, cursor.fetchall()), version
+            
+            # Also used for states written with the 'blob' layout before
+            # switching to 'fields'; they are converted on the next save
+            return self._deserialize_state(fn_id, state_data), version
+        except sqlite3.Error as e:
+            logger.error(f"Error loading state for {fn_id}: {e}")
+            return None, None
+        finally:
+            if own_transaction:
+                conn.commit()
+    
+    def load_fields(self, fn_id: str, fields: Iterable[str]) -> Dict[str, Any]:
+        """
+        Load a subset of the top-level keys of a function's state.
+        
+        With the 'fields' layout only the requested rows are read.
+        
+        Args:
+            fn_id: Function identifier
+            fields: Names of the keys to load
+            
+        Returns:
+            A dictionary with the requested keys that exist
+        """
+        fields = list(fields)
+        if self.layout != "fields" or not fields:
+            return super().load_fields(fn_id, fields)
+        
         conn = self._get_connection()
         cursor = conn.cursor()
         
@@ -113,14 +573,41 @@ class SQLiteBackend(StateBackend):
                 (fn_id,)
             )
             row = cursor.fetchone()
+            if row and row[0] is not None:
+                return super().load_fields(fn_id, fields)
             
-            if not row:
-                return None
+            placeholders = ", ".join("?" for _ in fields)
+            cursor.execute(
+                f"SELECT field, value FROM stateful_fields WHERE fn_id = ? AND field IN ({placeholders})",
+                (fn_id, *fields)
+            )
+            return self._deserialize_rows(fn_id, cursor.fetchall())
+        except sqlite3.Error as e:
+            logger.error(f"Error loading fields for {fn_id}: {e}")
+            return {}
+    
+    def get_version(self, fn_id: str) -> Optional[int]:
+        """
+        Get the version of a function's stored state.
+        
+        Args:
+            fn_id: Function identifier
             
-            state_data = row[0]
-            return self.serializer.deserialize(state_data)
+        Returns:
+            The version, 0 if no state is stored, or None on error
+        """
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute(
+                "SELECT version FROM stateful_state WHERE fn_id = ?",
+                (fn_id,)
+            )
+            row = cursor.fetchone()
+            return row[0] if row else 0
         except sqlite3.Error as e:
-            logger.error(f"Error loading state for {fn_id}: {e}")
+            logger.error(f"Error reading state version for {fn_id}: {e}")
             return None
     
     def save_state(self, fn_id: str, state: Dict[str, Any]) -> bool:
@@ -134,37 +621,319 @@ class SQLiteBackend(StateBackend):
         Returns:
             True if successful, False otherwise
         """
-        if not state:
-            return True  # Nothing to save
+        saved, _ = self.save_state_versioned(fn_id, state)
+        return saved
+    
+    def save_state_versioned(self, fn_id: str, state: Dict[str, Any],
+                             changed: Optional[Set[str]] = None) -> Tuple[bool, Optional[int]]:
+        """
+        Save state for a function and bump its version.
+        
+        Args:
+            fn_id: Function identifier
+            state: The state dictionary to save
+            changed: Top-level keys that changed; with the 'fields' layout only
+                these rows are written (default: rewrite all keys)
+            
+        Returns:
+            A tuple of (success, new version)
+        """
+        if not state and self.layout == "blob":
+            return True, self.get_version(fn_id)  # Nothing to save
+        
+        state_data = self._serialize_state(fn_id, state) if self.layout == "blob" else None
+        try:
+            return self._write(fn_id, self._upsert_state, fn_id, state_data, state, changed)
+        finally:
+            if isinstance(state_data, _SpooledState):
+                state_data.file.close()
+    
+    def compare_and_swap(self, fn_id: str, state: Dict[str, Any],
+                         expected_version: Optional[int],
+                         changed: Optional[Set[str]] = None) -> Tuple[bool, Optional[int]]:
+        """
+        Save state only if its version still equals the expected version.
+        
+        Uses a single conditional upsert, so no lock is needed.
+        
+        Args:
+            fn_id: Function identifier
+            state: The state dictionary to save
+            expected_version: Version the state was loaded at (0 if it did not exist)
+            changed: Top-level keys that changed (see save_state_versioned)
+            
+        Returns:
+            A tuple of (saved, new version); saved is False on a version conflict
+        """
+        if expected_version is None:
+            return False, None
+        
+        state_data = self._serialize_state(fn_id, state) if self.layout == "blob" else None
+        try:
+            return self._write(fn_id, self._swap_state, fn_id, state_data, state,
+                               expected_version, changed)
+        finally:
+            if isinstance(state_data, _SpooledState):
+                state_data.file.close()
+    
+    def _write(self, fn_id: str, write: Any, *args: Any) -> Tuple[bool, Optional[int]]:
+        """
+        Run a write function in its own transaction and commit it if it succeeded.
+        
+        With group commit the write is handed to the database's writer thread
+        and this waits until the batch containing it is committed.
+        """
+        if self._pool.group_commit is not None and not self._holds_transaction():
+            return self._pool.submit(fn_id, write, args)
         
         conn = self._get_connection()
         cursor = conn.cursor()
         
         try:
-            state_data = self.serializer.serialize(state)
-            
-            cursor.execute(
-                """
-                INSERT INTO stateful_state (fn_id, state) 
-                VALUES (?, ?) 
-                ON CONFLICT(fn_id) DO UPDATE SET 
-                    state = excluded.state,
-                    updated_at = CURRENT_TIMESTAMP
-                """,
-                (fn_id, state_data)
-            )
-            
-            conn.commit()
-            return True
+            self._begin_write(conn)
+            saved, version = write(cursor, *args)
+            if saved:
+                self._commit_write(conn)
+            else:
+                self._rollback_write(conn)
+            return saved, version
         except sqlite3.Error as e:
             logger.error(f"Error saving state for {fn_id}: {e}")
+            self._rollback_write(conn)
+            return False, None
+    
+    def _upsert_state(self, cursor: sqlite3.Cursor, fn_id: str, state_data: "_StateData",
+                      state: Dict[str, Any], changed: Optional[Set[str]]) -> Tuple[bool, Optional[int]]:
+        """Write a state and bump its version inside the caller's transaction."""
+        if self.layout == "fields" and self._has_blob(cursor, fn_id):
+            changed = None
+        
+        cursor.execute(
+            """
+            INSERT INTO stateful_state (fn_id, state, version) 
+            VALUES (?, ?, 1) 
+            ON CONFLICT(fn_id) DO UPDATE SET 
+                state = excluded.state,
+                version = stateful_state.version + 1,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            (fn_id, self._state_param(state_data))
+        )
+        if isinstance(state_data, _SpooledState):
+            self._write_blob(cursor, fn_id, state_data)
+        if self.layout == "fields":
+            self._write_fields(cursor, fn_id, state, changed)
+        # Read the new version inside the same transaction
+        cursor.execute(
+            "SELECT version FROM stateful_state WHERE fn_id = ?",
+            (fn_id,)
+        )
+        return True, cursor.fetchone()[0]
+    
+    def _swap_state(self, cursor: sqlite3.Cursor, fn_id: str, state_data: "_StateData",
+                    state: Dict[str, Any], expected_version: int,
+                    changed: Optional[Set[str]]) -> Tuple[bool, Optional[int]]:
+        """Write a state if its version is unchanged, inside the caller's transaction."""
+        if self.layout == "fields" and self._has_blob(cursor, fn_id):
+            changed = None
+        
+        cursor.execute(
+            """
+            INSERT INTO stateful_state (fn_id, state, version) 
+            VALUES (?, ?, ? + 1) 
+            ON CONFLICT(fn_id) DO UPDATE SET 
+                state = excluded.state,
+                version = stateful_state.version + 1,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE stateful_state.version = ?
+            """,
+            (fn_id, self._state_param(state_data), expected_version, expected_version)
+        )
+        if cursor.rowcount != 1:
+            return False, None
+        
+        if isinstance(state_data, _SpooledState):
+            self._write_blob(cursor, fn_id, state_data)
+        if self.layout == "fields":
+            self._write_fields(cursor, fn_id, state, changed)
+        return True, expected_version + 1
+    
+    def _holds_transaction(self) -> bool:
+        """Return True if this thread holds a lock in 'transaction' locking mode."""
+        return self._pool.txn_depth > 0
+    
+    def _begin_write(self, conn: Connection) -> None:
+        """
+        Start a write.
+        
+        Inside a held transaction lock the write gets a savepoint, so a failed
+        save can be undone without discarding the rest of the transaction.
+        Otherwise sqlite3 opens a transaction implicitly.
+        """
+        if self._holds_transaction():
+            conn.execute("SAVEPOINT statefulpy_write")
+    
+    def _commit_write(self, conn: Connection) -> None:
+        """Finish a write; inside a held transaction lock the commit is left to release_lock."""
+        if self._holds_transaction():
+            conn.execute("RELEASE statefulpy_write")
+        else:
+            conn.commit()
+    
+    def _rollback_write(self, conn: Connection) -> None:
+        """Undo a write started with _begin_write."""
+        if not self._holds_transaction():
             conn.rollback()
-            return False
+            return
+        try:
+            conn.execute("ROLLBACK TO statefulpy_write")
+            conn.execute("RELEASE statefulpy_write")
+        except sqlite3.Error as e:
+            # SQLite may already have rolled back the whole transaction
+            logger.error(f"Error rolling back to savepoint: {e}")
+    
+    def _serialize_state(self, fn_id: str, state: Dict[str, Any]) -> "_StateData":
+        """
+        Serialize a whole state, recording the time taken and the payload size.
+        
+        When streaming, states of at least ``stream_threshold`` bytes are
+        returned as a _SpooledState that the caller must close.
+        """
+        start = time.perf_counter()
+        data: Optional[bytes]
+        if not self._streaming():
+            data = self.serializer.serialize(state)
+            metrics.record_serialization(fn_id, "serialize", time.perf_counter() - start, len(data))
+            return data
+        
+        spool = tempfile.SpooledTemporaryFile(max_size=cast(int, self.stream_threshold))
+        try:
+            self.serializer.serialize_to(state, cast(BinaryIO, spool))
+            size = spool.tell()
+            spool.seek(0)
+            data = spool.read() if size < cast(int, self.stream_threshold) else None
+        except BaseException:
+            spool.close()
+            raise
+        metrics.record_serialization(fn_id, "serialize", time.perf_counter() - start, size)
+        if data is None:
+            return _SpooledState(spool, size)
+        spool.close()
+        return data
+    
+    def _deserialize_state(self, fn_id: str, data: bytes) -> Dict[str, Any]:
+        """Deserialize a whole state, recording the time taken and the payload size."""
+        start = time.perf_counter()
+        state = self.serializer.deserialize(data)
+        metrics.record_serialization(fn_id, "deserialize", time.perf_counter() - start, len(data))
+        return state
+    
+    def _streaming(self) -> bool:
+        """Return True if large states are streamed with incremental blob I/O."""
+        return self.stream_threshold is not None and self.layout == "blob" and _HAS_BLOBOPEN
+    
+    @staticmethod
+    def _state_param(state_data: "_StateData") -> Optional[bytes]:
+        """Value bound to the state column; spooled states are written afterwards."""
+        return b"" if isinstance(state_data, _SpooledState) else state_data
+    
+    def _write_blob(self, cursor: sqlite3.Cursor, fn_id: str, state_data: _SpooledState) -> None:
+        """Stream a spooled state into its row, inside the caller's transaction."""
+        cursor.execute(
+            "UPDATE stateful_state SET state = zeroblob(?) WHERE fn_id = ?",
+            (state_data.size, fn_id)
+        )
+        cursor.execute("SELECT rowid FROM stateful_state WHERE fn_id = ?", (fn_id,))
+        rowid = cursor.fetchone()[0]
+        with cursor.connection.blobopen("stateful_state", "state", rowid) as blob:
+            while True:
+                chunk = state_data.file.read(_STREAM_CHUNK)
+                if not chunk:
+                    break
+                blob.write(chunk)
+    
+    def _read_blob(self, conn: Connection, fn_id: str, rowid: int, size: int) -> Dict[str, Any]:
+        """Deserialize a state straight from its blob, recording the time taken."""
+        start = time.perf_counter()
+        with conn.blobopen("stateful_state", "state", rowid, readonly=True) as blob:
+            stream = io.BufferedReader(_BlobReader(blob), _STREAM_CHUNK)
+            state = self.serializer.deserialize_from(stream)
+        metrics.record_serialization(fn_id, "deserialize", time.perf_counter() - start, size)
+        return state
+    
+    def _deserialize_rows(self, fn_id: str, rows: Iterable[Tuple[str, bytes]]) -> Dict[str, Any]:
+        """Deserialize (field, value) rows of the 'fields' layout into a state."""
+        start = time.perf_counter()
+        size = 0
+        state = {}
+        for field, value in rows:
+            state[field] = self._deserialize_field(field, value)
+            size += len(value)
+        metrics.record_serialization(fn_id, "deserialize", time.perf_counter() - start, size)
+        return state
+    
+    def _serialize_field(self, field: str, value: Any) -> bytes:
+        """Serialize the value of a single top-level key."""
+        return self.serializer.serialize({field: value})
+    
+    def _deserialize_field(self, field: str, data: bytes) -> Any:
+        """Deserialize the value of a single top-level key."""
+        return self.serializer.deserialize(data)[field]
+    
+    def _has_blob(self, cursor: sqlite3.Cursor, fn_id: str) -> bool:
+        """Return True if the state is currently stored as a single blob."""
+        cursor.execute(
+            "SELECT state IS NOT NULL FROM stateful_state WHERE fn_id = ?",
+            (fn_id,)
+        )
+        row = cursor.fetchone()
+        return bool(row and row[0])
+    
+    def _write_fields(self, cursor: sqlite3.Cursor, fn_id: str, state: Dict[str, Any],
+                      changed: Optional[Set[str]]) -> None:
+        """
+        Write field rows for a state inside the caller's transaction.
+        
+        If ``changed`` is None all fields are rewritten, otherwise only the
+        listed keys are upserted or deleted.
+        """
+        if changed is None:
+            cursor.execute("DELETE FROM stateful_fields WHERE fn_id = ?", (fn_id,))
+            changed = set(state)
+        
+        start = time.perf_counter()
+        upserts = [
+            (fn_id, field, self._serialize_field(field, state[field]))
+            for field in changed if field in state
+        ]
+        metrics.record_serialization(
+            fn_id, "serialize", time.perf_counter() - start, sum(len(row[2]) for row in upserts)
+        )
+        deletes = [(fn_id, field) for field in changed if field not in state]
+        if upserts:
+            cursor.executemany(
+                """
+                INSERT INTO stateful_fields (fn_id, field, value) 
+                VALUES (?, ?, ?) 
+                ON CONFLICT(fn_id, field) DO UPDATE SET value = excluded.value
+                """,
+                upserts
+            )
+        if deletes:
+            cursor.executemany(
+                "DELETE FROM stateful_fields WHERE fn_id = ? AND field = ?",
+                deletes
+            )
     
     def acquire_lock(self, fn_id: str, timeout: float = 10.0) -> bool:
         """
         Acquire a lock for a function.
         
+        In 'transaction' locking mode the lock is SQLite's write lock: the
+        first lock taken by a thread starts a ``BEGIN IMMEDIATE`` transaction,
+        and saves made while it is held are committed by the matching
+        release_lock.
+        
         Args:
             fn_id: Function identifier
             timeout: Timeout for acquiring the lock
@@ -182,12 +951,15 @@ class SQLiteBackend(StateBackend):
             self._lock_counts[fn_id] += 1
             return True
 
-        lock_file = f"{self.db_path}.{fn_id}.lock"
+        if self.locking == "transaction":
+            return self._acquire_transaction(fn_id, timeout)
+
+        lock_file = self._lock_file(fn_id)
         try:
-            if not os.path.exists(lock_file):
-                open(lock_file, 'w').close()
-            lock = portalocker.Lock(lock_file, timeout=timeout)
+            lock = portalocker.Lock(lock_file, mode='a', timeout=timeout)
             lock.acquire()
+            # Keep the Lock object: dropping it would close the file and release the lock
+            self._file_locks[fn_id] = lock
             self._locks[fn_id] = threading.current_thread().ident
             self._lock_counts[fn_id] = 1
             
@@ -215,6 +987,34 @@ class SQLiteBackend(StateBackend):
             logger.error(f"Error acquiring lock for {fn_id}: {e}")
             return False
     
+    def _lock_file(self, fn_id: str) -> str:
+        """Return the lock file path for a function, safe for any function identifier."""
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", fn_id)
+        if name != fn_id:
+            # Keep identifiers that only differ in replaced characters apart
+            name = f"{name}-{hashlib.sha1(fn_id.encode('utf-8')).hexdigest()[:8]}"
+        return f"{self.db_path}.{name}.lock"
+    
+    def _acquire_transaction(self, fn_id: str, timeout: float) -> bool:
+        """Take a lock in 'transaction' locking mode, starting the thread's transaction if needed."""
+        conn = self._get_connection()
+        depth = self._pool.txn_depth
+        if depth == 0:
+            try:
+                # The lock timeout applies while waiting for the write lock only
+                self._pool.set_busy_timeout(int(timeout * 1000))
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                finally:
+                    self._pool.set_busy_timeout(self._pool.busy_timeout)
+            except sqlite3.Error as e:
+                logger.error(f"Error acquiring lock for {fn_id}: {e}")
+                return False
+        self._pool.txn_depth = depth + 1
+        self._locks[fn_id] = threading.current_thread().ident
+        self._lock_counts[fn_id] = 1
+        return True
+    
     def release_lock(self, fn_id: str) -> bool:
         """
         Release a lock for a function.
@@ -223,7 +1023,9 @@ class SQLiteBackend(StateBackend):
             fn_id: Function identifier
             
         Returns:
-            True if the lock was released, False otherwise
+            True if the lock was released, False otherwise. In 'transaction'
+            locking mode False is also returned if the commit failed, in which
+            case the saves made under the lock were rolled back.
         """
         # Check if we hold the lock
         if fn_id not in self._locks or threading.current_thread().ident != self._locks[fn_id]:
@@ -236,16 +1038,22 @@ class SQLiteBackend(StateBackend):
         if self._lock_counts[fn_id] > 0:
             return True
         
-        lock_file = f"{self.db_path}.{fn_id}.lock"
+        if self.locking == "transaction":
+            return self._release_transaction(fn_id)
+        
+        # Stop tracking before unlocking, so a thread that takes the lock next
+        # does not have its tracking removed by us
+        lock = self._file_locks.pop(fn_id, None)
+        del self._locks[fn_id]
+        del self._lock_counts[fn_id]
+        
         retries = 3
         for attempt in range(retries):
             try:
-                # Attempt to release the file lock
-                lock = portalocker.Lock(lock_file)
-                lock.release()
-                # Try to remove the lock file
-                if os.path.exists(lock_file):
-                    os.unlink(lock_file)
+                # The lock file is left in place: unlinking it would let another
+                # process lock a new file while a waiter still holds the old one
+                if lock is not None:
+                    lock.release()
                 break
             except (portalocker.LockException, IOError) as e:
                 logger.error(f"Attempt {attempt+1} – Error releasing lock for {fn_id}: {e}")
@@ -253,10 +1061,6 @@ class SQLiteBackend(StateBackend):
         else:
             logger.error(f"Failed to release lock for {fn_id} after {retries} attempts")
             return False
-
-        # Remove from our tracking
-        del self._locks[fn_id]
-        del self._lock_counts[fn_id]
         
         # Remove from the database too
         conn = self._get_connection()
@@ -274,11 +1078,156 @@ class SQLiteBackend(StateBackend):
         
         return True
     
+    def _release_transaction(self, fn_id: str) -> bool:
+        """Release a lock in 'transaction' locking mode, committing once the thread holds no more."""
+        del self._locks[fn_id]
+        del self._lock_counts[fn_id]
+        self._pool.txn_depth -= 1
+        if self._pool.txn_depth > 0:
+            return True
+        
+        conn = self._get_connection()
+        try:
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error committing state for {fn_id}: {e}")
+            conn.rollback()
+            return False
+    
     def close(self) -> None:
-        """Close the database connection."""
-        if hasattr(_local, 'conn') and _local.conn:
-            try:
-                _local.conn.close()
-                _local.conn = None
-            except sqlite3.Error as e:
-                logger.error(f"Error closing SQLite connection: {e}")
+        """
+        Close this thread's connection to the database.
+        
+        The connection is shared with other backends for the same database
+        and settings, so it is only closed together with the last of them;
+        closing one backend leaves the transactions of the others intact.
+        With group commit the writer thread is stopped once the saves queued
+        so far are committed, and started again by the next save.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if not _release_pool(self._pool):
+            return
+        try:
+            self._pool.close()
+        except sqlite3.Error as e:
+            logger.error(f"Error closing SQLite connection: {e}")
+
+
+class AsyncSQLiteBackend(AsyncStateBackend):
+    """
+    Non-blocking SQLite backend for stateful ``async def`` functions.
+    
+    All database and file-lock operations of a :class:`SQLiteBackend` run on a
+    dedicated single-thread executor, so they never block the event loop and
+    always use the same thread-local connection. Tasks in this process are
+    serialized with a task-reentrant asyncio lock before the file lock is taken.
+    """
+    
+    def __init__(self, db_path: str = "stateful.db", serializer: str = "pickle", **kwargs: Any):
+        """
+        Initialize the asyncio SQLite backend.
+        
+        Args:
+            db_path: Path to the SQLite database file
+            serializer: Serializer to use ('pickle' or 'json'; e.g. 'json+zlib' to
+                compress large states)
+            **kwargs: Additional SQLiteBackend options
+        """
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="statefulpy-sqlite")
+        # Create the backend on the executor thread that will own its connection
+        self._backend: SQLiteBackend = self._executor.submit(
+            SQLiteBackend, db_path=db_path, serializer=serializer, **kwargs
+        ).result()
+        self._task_locks: Dict[str, AsyncRLock] = {}
+    
+    async def _run(self, fn: Any, *args: Any) -> Any:
+        """Run a blocking backend call on the dedicated executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args))
+    
+    async def load_state(self, fn_id: str) -> Optional[Dict[str, Any]]:
+        """Load state for a function from the database."""
+        return cast(Optional[Dict[str, Any]], await self._run(self._backend.load_state, fn_id))
+    
+    async def load_state_versioned(self, fn_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+        """Load state for a function together with its version."""
+        return cast(
+            Tuple[Optional[Dict[str, Any]], Optional[int]],
+            await self._run(self._backend.load_state_versioned, fn_id),
+        )
+    
+    async def load_fields(self, fn_id: str, fields: Iterable[str]) -> Dict[str, Any]:
+        """Load a subset of the top-level keys of a function's state."""
+        return cast(Dict[str, Any], await self._run(self._backend.load_fields, fn_id, list(fields)))
+    
+    async def get_version(self, fn_id: str) -> Optional[int]:
+        """Get the version of a function's stored state."""
+        return cast(Optional[int], await self._run(self._backend.get_version, fn_id))
+    
+    async def save_state(self, fn_id: str, state: Dict[str, Any]) -> bool:
+        """Save state for a function to the database."""
+        return bool(await self._run(self._backend.save_state, fn_id, state))
+    
+    async def save_state_versioned(self, fn_id: str, state: Dict[str, Any],
+                                   changed: Optional[Set[str]] = None) -> Tuple[bool, Optional[int]]:
+        """Save state for a function and bump its version."""
+        return cast(
+            Tuple[bool, Optional[int]],
+            await self._run(self._backend.save_state_versioned, fn_id, state, changed),
+        )
+    
+    async def compare_and_swap(self, fn_id: str, state: Dict[str, Any],
+                               expected_version: Optional[int],
+                               changed: Optional[Set[str]] = None) -> Tuple[bool, Optional[int]]:
+        """Save state only if its version still equals the expected version."""
+        return cast(
+            Tuple[bool, Optional[int]],
+            await self._run(self._backend.compare_and_swap, fn_id, state, expected_version, changed),
+        )
+    
+    async def acquire_lock(self, fn_id: str, timeout: float = 10.0) -> bool:
+        """
+        Acquire a lock for a function without blocking the event loop.
+        
+        Args:
+            fn_id: Function identifier
+            timeout: Timeout for acquiring the lock
+            
+        Returns:
+            True if the lock was acquired, False otherwise
+        """
+        task_lock = self._task_locks.setdefault(fn_id, AsyncRLock())
+        start_time = time.monotonic()
+        if not await task_lock.acquire(timeout):
+            return False
+        remaining = max(timeout - (time.monotonic() - start_time), 0.0)
+        if not await self._run(self._backend.acquire_lock, fn_id, remaining):
+            task_lock.release()
+            return False
+        return True
+    
+    async def release_lock(self, fn_id: str) -> bool:
+        """
+        Release a lock for a function.
+        
+        Args:
+            fn_id: Function identifier
+            
+        Returns:
+            True if the lock was released, False otherwise
+        """
+        task_lock = self._task_locks.get(fn_id)
+        if task_lock is None or not task_lock.owned():
+            return False
+        try:
+            return bool(await self._run(self._backend.release_lock, fn_id))
+        finally:
+            task_lock.release()
+    
+    async def close(self) -> None:
+        """Close the database connection and stop the executor."""
+        await self._run(self._backend.close)
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,199 @@
+"""
+Persistent memoization on top of the state backends.
+"""
+import functools
+import hashlib
+import inspect
+import logging
+import threading
+import time
+from collections import namedtuple
+from typing import Any, Callable, Dict, List, Optional, Set, cast
+
+from statefulpy.backends.base import StateBackend, get_backend
+from statefulpy.config import get_config
+from statefulpy.serializers import get_serializer
+
+logger = logging.getLogger(__name__)
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+# Field holding {entry field: [last used, expires at]} for eviction
+_INDEX_FIELD = "__index__"
+
+# Backends that support the 'fields' layout, which lets a lookup read a single entry
+_FIELD_LAYOUT_BACKENDS = ("sqlite", "redis", "memory")
+
+
+def _entry_field(signature: inspect.Signature, args: Any, kwargs: Any) -> str:
+    """Return the storage field for a call, derived from a hash of its arguments."""
+    try:
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = repr(sorted(bound.arguments.items()))
+    except TypeError:
+        key = repr((args, sorted(kwargs.items())))
+    return "r:" + hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def stateful_cache(
+    maxsize: Optional[int] = 128,
+    ttl: Optional[float] = None,
+    backend: Optional[str] = None,
+    serializer: Optional[str] = None,
+    **backend_kwargs: Any
+) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    Decorator that memoizes a function's results in a state backend.
+
+    Results are stored per call under a hash of the arguments, so the cache
+    survives restarts and is shared by every process using the same backend.
+    A lookup reads only the requested entry (with the SQLite and Redis
+    backends the 'fields' layout is selected automatically); the backend lock
+    is only taken to insert a result. Arguments must have a stable ``repr``.
+
+    Misses return the result as a hit would, after a round trip through the
+    serializer (e.g. tuples come back as lists with JSON). Results the
+    serializer cannot encode are returned as they are and not cached.
+
+    Eviction is approximately LRU: hits are recorded in process memory and
+    merged into the stored access index on the next insert, so recency seen
+    by other processes lags behind until then.
+
+    Args:
+        maxsize: Maximum number of cached results (None for no limit)
+        ttl: Seconds after which a result expires (None for no expiry)
+        backend: Name of the backend to use ('sqlite', 'redis', 'memory', 'shm', 'log'
+            or 'server'; default: the backend chosen with ``set_backend``, 'sqlite'
+            unless changed)
+        serializer: Name of the serializer to use (default: 'json')
+        **backend_kwargs: Additional backend parameters (e.g., db_path, function_id)
+
+    Returns:
+        Decorator producing the cached function. The function gains
+        ``cache_info()`` and ``cache_clear()`` like ``functools.lru_cache``.
+    """
+    if maxsize is not None and maxsize < 1:
+        raise ValueError("maxsize must be at least 1 or None")
+    if ttl is not None and ttl <= 0:
+        raise ValueError("ttl must be positive or None")
+    if serializer is None:
+        serializer = "json"
+    if backend is None:
+        backend = cast(str, get_config()["backend"])
+    if backend in _FIELD_LAYOUT_BACKENDS:
+        backend_kwargs.setdefault("layout", "fields")
+
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        if inspect.iscoroutinefunction(func):
+            raise ValueError("stateful_cache does not support coroutine functions")
+
+        key = backend_kwargs.pop("function_id", f"{func.__module__}.{func.__qualname__}")
+        backend_instance: StateBackend = get_backend(backend, serializer=serializer, **backend_kwargs)
+        field_layout = getattr(backend_instance, "layout", "blob") == "fields"
+        codec = get_serializer(serializer)
+        signature = inspect.signature(func)
+
+        stats = {"hits": 0, "misses": 0}
+        # Entries used since the last insert: {entry field: last used}
+        touched: Dict[str, float] = {}
+        local_lock = threading.Lock()
+
+        def load_for_update() -> Dict[str, Any]:
+            """Load what an insert rewrites: the index, or the whole state for blob backends."""
+            if field_layout:
+                return backend_instance.load_fields(key, [_INDEX_FIELD])
+            return backend_instance.load_state(key) or {}
+
+        def store(field: str, result: Any) -> None:
+            now = time.time()
+            expires_at = now + ttl if ttl is not None else None
+
+            if not backend_instance.acquire_lock(key):
+                logger.error(f"Failed to acquire lock for {key}; result not cached")
+                return
+            try:
+                state = load_for_update()
+                index: Dict[str, List[Optional[float]]] = state.get(_INDEX_FIELD) or {}
+                with local_lock:
+                    for used_field, used_at in touched.items():
+                        if used_field in index:
+                            index[used_field][0] = max(index[used_field][0] or 0, used_at)
+                    touched.clear()
+                index[field] = [now, expires_at]
+                state[field] = {"value": result, "expires_at": expires_at}
+
+                evicted: Set[str] = {
+                    name for name, (_, expiry) in index.items()
+                    if expiry is not None and expiry <= now
+                }
+                evicted.discard(field)
+                if maxsize is not None:
+                    live = sorted(
+                        (name for name in index if name not in evicted),
+                        key=lambda name: index[name][0] or 0
+                    )
+                    evicted.update(name for name in live[:max(0, len(live) - maxsize)]
+                                   if name != field)
+                for name in evicted:
+                    index.pop(name, None)
+                    state.pop(name, None)
+                state[_INDEX_FIELD] = index
+
+                changed = {field, _INDEX_FIELD} | evicted if field_layout else None
+                saved, _ = backend_instance.save_state_versioned(key, state, changed=changed)
+                if not saved:
+                    logger.error(f"Failed to cache result for {key}")
+            except Exception as e:
+                logger.error(f"Failed to cache result for {key}: {e}")
+            finally:
+                backend_instance.release_lock(key)
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            field = _entry_field(signature, args, kwargs)
+            entry = backend_instance.load_fields(key, [field]).get(field)
+            now = time.time()
+            if entry is not None and (entry["expires_at"] is None or entry["expires_at"] > now):
+                with local_lock:
+                    stats["hits"] += 1
+                    touched[field] = now
+                return entry["value"]
+
+            with local_lock:
+                stats["misses"] += 1
+            # Computed without holding the lock; concurrent misses may compute twice
+            result = func(*args, **kwargs)
+            try:
+                # Return what later hits will: the result as it comes back from storage
+                result = codec.deserialize(codec.serialize({"value": result}))["value"]
+            except Exception as e:
+                logger.error(f"Result of {key} cannot be serialized and is not cached: {e}")
+                return result
+            store(field, result)
+            return result
+
+        def cache_info() -> CacheInfo:
+            """Report hit and miss counts of this process and the stored entry count."""
+            index = backend_instance.load_fields(key, [_INDEX_FIELD]).get(_INDEX_FIELD) or {}
+            with local_lock:
+                return CacheInfo(stats["hits"], stats["misses"], maxsize, len(index))
+
+        def cache_clear() -> None:
+            """Remove all cached results from the backend."""
+            if not backend_instance.acquire_lock(key):
+                logger.error(f"Failed to acquire lock for {key}; cache not cleared")
+                return
+            try:
+                backend_instance.save_state_versioned(key, {_INDEX_FIELD: {}})
+            finally:
+                backend_instance.release_lock(key)
+            with local_lock:
+                stats["hits"] = stats["misses"] = 0
+                touched.clear()
+
+        wrapper.cache_info = cache_info  # type: ignore[attr-defined]
+        wrapper.cache_clear = cache_clear  # type: ignore[attr-defined]
+        return wrapper
+
+    return decorator
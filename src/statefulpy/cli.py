@@ -5,13 +5,14 @@ import argparse
 import sys
 import logging
 import os
-import json
 import time
-import pickle
 
 from statefulpy.backends.base import get_backend
 from statefulpy.config import get_backend_options
 
+# Serializers selectable for migration, including their compressed variants
+SERIALIZER_CHOICES = ["pickle", "json", "pickle+zlib", "json+zlib", "pickle+lzma", "json+lzma"]
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -20,6 +21,20 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def _scan_redis_function_ids(client, prefix):
+    """Return the IDs of all functions with state stored under ``prefix``, in either layout."""
+    function_ids = set()
+    for kind in ("state", "fields"):
+        key_prefix = f"{prefix}{kind}:"
+        cursor = 0
+        while True:
+            cursor, keys = client.scan(cursor=cursor, match=f"{key_prefix}*", count=100)
+            function_ids.update(key.decode('utf-8')[len(key_prefix):] for key in keys)
+            if cursor == 0:
+                break
+    return sorted(function_ids)
+
+
 def init_command(args):
     """Initialize a backend storage."""
     backend_type = args.backend
@@ -101,6 +116,10 @@ def migrate_command(args):
         source_options['serializer'] = args.from_serializer
     if args.to_serializer:
         target_options['serializer'] = args.to_serializer
+    if args.from_layout:
+        source_options['layout'] = args.from_layout
+    if args.to_layout:
+        target_options['layout'] = args.to_layout
     
     logger.info(f"Migrating from {source_type} to {target_type}")
     
@@ -129,7 +148,7 @@ def migrate_command(args):
                 # Use a context manager for the connection
                 with source_backend._get_connection() as conn:
                     cursor = conn.cursor()
-                    cursor.execute("SELECT fn_id, state FROM stateful_state")
+                    cursor.execute("SELECT fn_id FROM stateful_state")
                     records = cursor.fetchall()
                     
                     if not records:
@@ -139,13 +158,12 @@ def migrate_command(args):
                     logger.info(f"Found {len(records)} state records to migrate")
                     migrated_count = 0
                     
-                    for fn_id, state_blob in records:
+                    for (fn_id,) in records:
                         try:
-                            # Deserialize based on source backend's serializer
-                            if source_backend.serializer == "pickle":
-                                state = pickle.loads(state_blob)
-                            else:  # json
-                                state = json.loads(state_blob.decode('utf-8'))
+                            # Load through the backend so either layout is read
+                            state = source_backend.load_state(fn_id)
+                            if not state:
+                                continue
                             
                             # Save to target backend
                             if target_backend.save_state(fn_id, state):
@@ -166,36 +184,20 @@ def migrate_command(args):
         # For Redis, we need to scan for keys with our prefix
         elif source_type == 'redis':
             prefix = source_options.get('prefix', 'statefulpy:')
-            state_prefix = f"{prefix}state:"
-            
-            # Scan for keys matching our pattern
-            cursor = 0
-            all_keys = []
             
             try:
-                while True:
-                    cursor, keys = source_backend.client.scan(
-                        cursor=cursor, 
-                        match=f"{state_prefix}*", 
-                        count=100
-                    )
-                    all_keys.extend(keys)
-                    if cursor == 0:
-                        break
+                function_ids = _scan_redis_function_ids(source_backend.client, prefix)
                 
-                if not all_keys:
+                if not function_ids:
                     logger.info("No state records found to migrate")
                     return 0
                 
-                logger.info(f"Found {len(all_keys)} state records to migrate")
+                logger.info(f"Found {len(function_ids)} state records to migrate")
                 migrated_count = 0
                 
                 # Process each key
-                for key in all_keys:
+                for fn_id in function_ids:
                     try:
-                        # Extract function ID from key
-                        fn_id = key.decode('utf-8').replace(state_prefix, '')
-                        
                         # Get state data
                         state_data = source_backend.load_state(fn_id)
                         
@@ -207,9 +209,9 @@ def migrate_command(args):
                             else:
                                 logger.error(f"Failed to migrate state for {fn_id}")
                     except Exception as e:
-                        logger.error(f"Error migrating state for key {key}: {e}")
+                        logger.error(f"Error migrating state for {fn_id}: {e}")
                 
-                logger.info(f"Successfully migrated {migrated_count}/{len(all_keys)} records")
+                logger.info(f"Successfully migrated {migrated_count}/{len(function_ids)} records")
                 
             except Exception as e:
                 logger.error(f"Redis migration error: {e}")
@@ -309,29 +311,12 @@ def list_command(args):
         elif backend_type == 'redis':
             try:
                 prefix = options.get('prefix', 'statefulpy:')
-                state_prefix = f"{prefix}state:"
-                
-                # Scan for keys matching our pattern
-                cursor = 0
-                all_keys = []
+                function_ids = _scan_redis_function_ids(backend.client, prefix)
                 
-                while True:
-                    cursor, keys = backend.client.scan(
-                        cursor=cursor, 
-                        match=f"{state_prefix}*", 
-                        count=100
-                    )
-                    all_keys.extend(keys)
-                    if cursor == 0:
-                        break
-                
-                if not all_keys:
+                if not function_ids:
                     print("No stateful functions found in Redis.")
                     return 0
                 
-                # Extract function IDs from keys
-                function_ids = [key.decode('utf-8').replace(state_prefix, '') for key in all_keys]
-                
                 print(f"\nFound {len(function_ids)} stateful functions:")
                 print(f"{'FUNCTION ID':<50}")
                 print("-" * 50)
@@ -348,6 +333,22 @@ def list_command(args):
         return 1
 
 
+def serve_command(args):
+    """Run the local state server."""
+    from statefulpy.server import serve
+    
+    options = get_backend_options('server')
+    socket_path = args.socket or options.get('socket_path', 'statefulpy.sock')
+    db_path = args.db_path or get_backend_options('sqlite').get('db_path', 'statefulpy.db')
+    
+    try:
+        serve(socket_path, db_path=db_path, flush_interval=args.flush_interval)
+    except (OSError, ValueError) as e:
+        logger.error(f"Failed to start the state server: {e}")
+        return 1
+    return 0
+
+
 def main():
     """Main entry point for the CLI."""
     parser = argparse.ArgumentParser(
@@ -394,14 +395,24 @@ def main():
     )
     migrate_parser.add_argument(
         "--from-serializer",
-        choices=["pickle", "json"],
+        choices=SERIALIZER_CHOICES,
         help="Source serializer type"
     )
     migrate_parser.add_argument(
         "--to-serializer",
-        choices=["pickle", "json"],
+        choices=SERIALIZER_CHOICES,
         help="Target serializer type"
     )
+    migrate_parser.add_argument(
+        "--from-layout",
+        choices=["blob", "fields"],
+        help="Source storage layout"
+    )
+    migrate_parser.add_argument(
+        "--to-layout",
+        choices=["blob", "fields"],
+        help="Target storage layout"
+    )
     
     # healthcheck command
     healthcheck_parser = subparsers.add_parser("healthcheck", help="Check the health of a backend")
@@ -429,6 +440,23 @@ def main():
         help="Path to database file (SQLite) or Redis URL"
     )
     
+    # serve command
+    serve_parser = subparsers.add_parser("serve", help="Run a local state server on a Unix socket")
+    serve_parser.add_argument(
+        "--socket",
+        help="Path of the Unix socket to listen on (default: statefulpy.sock)"
+    )
+    serve_parser.add_argument(
+        "--db-path",
+        help="SQLite database the states are persisted to (default: statefulpy.db)"
+    )
+    serve_parser.add_argument(
+        "--flush-interval",
+        type=float,
+        default=1.0,
+        help="Seconds between writes of changed states to the database (default: 1)"
+    )
+    
     args = parser.parse_args()
     
     if not args.command:
@@ -443,6 +471,8 @@ def main():
         return healthcheck_command(args)
     elif args.command == "list":
         return list_command(args)
+    elif args.command == "serve":
+        return serve_command(args)
     else:
         parser.print_help()
         return 0
@@ -19,7 +19,22 @@ _DEFAULT_CONFIG: Dict[str, Any] = {
             'redis_url': 'redis://localhost:6379/0',
             'serializer': 'pickle',
             'prefix': 'statefulpy:',
-            'lock_timeout': 30000,  # 30 seconds in milliseconds
+            'lock_timeout': 2000,  # 2 seconds in milliseconds, renewed while held
+        },
+        'memory': {
+            'serializer': 'pickle',
+        },
+        'shm': {
+            'serializer': 'pickle',
+            'name': 'statefulpy',
+        },
+        'log': {
+            'serializer': 'pickle',
+            'path': 'statefulpy-log',
+        },
+        'server': {
+            'serializer': 'pickle',
+            'socket_path': 'statefulpy.sock',
         }
     },
     'debug': False,
@@ -37,7 +52,7 @@ def set_backend(backend: str, **options) -> None:
     and options for all @stateful decorators that don't specify a backend.
     
     Args:
-        backend: Backend type ('sqlite' or 'redis')
+        backend: Backend type ('sqlite', 'redis', 'memory', 'shm', 'log' or 'server')
         **options: Backend-specific options
     
     Raises:
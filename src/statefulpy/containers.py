@@ -0,0 +1,284 @@
+"""
+Bounded containers for function state.
+
+State that accumulates entries forever makes every save more expensive. The
+containers in this module evict on write, so the size of a state, and with it
+the cost of serializing it, stays bounded:
+
+* :class:`LRUDict` drops the least recently used keys
+* :class:`TTLDict` drops keys a fixed time after they were written
+* :class:`CappedDeque` keeps only the newest items
+
+All of them round-trip through both the pickle and the JSON serializer.
+"""
+import pickle
+import sys
+import time
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Key marking a JSON object that encodes one of the containers below
+JSON_TAG = "__statefulpy__"
+
+
+def _item_size(key: Any, value: Any) -> int:
+    """Approximate the serialized size of an entry in bytes."""
+    try:
+        return len(pickle.dumps((key, value), protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(key) + sys.getsizeof(value)
+
+
+def _rebuild(cls: type, options: Dict[str, Any], items: List[Any]) -> Any:
+    """Recreate a container from the output of ``_dump``; used by pickle and JSON."""
+    container = cls(**options)
+    container._load(items)
+    return container
+
+
+class _BoundedMapping(MutableMapping):
+    """
+    Insertion-ordered mapping that evicts its oldest entries when it is full.
+
+    Args:
+        maxsize: Maximum number of entries (None for no limit)
+        max_bytes: Maximum approximate serialized size of all entries (None for
+            no limit). Sizes are measured when an entry is written; growing a
+            mutable value in place is not accounted for.
+    """
+
+    def __init__(self, maxsize: Optional[int] = None, max_bytes: Optional[int] = None):
+        if maxsize is not None and maxsize < 1:
+            raise ValueError("maxsize must be at least 1 or None")
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError("max_bytes must be at least 1 or None")
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[Any, Any]" = OrderedDict()
+        self._sizes: Dict[Any, int] = {}
+        self._total_bytes = 0
+
+    def __getitem__(self, key: Any) -> Any:
+        return self._data[key]
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        if key in self._data:
+            self._discard(key)
+        self._data[key] = value
+        if self.max_bytes is not None:
+            size = _item_size(key, value)
+            self._sizes[key] = size
+            self._total_bytes += size
+        self._evict(keep=key)
+
+    def __delitem__(self, key: Any) -> None:
+        if key not in self._data:
+            raise KeyError(key)
+        self._discard(key)
+
+    def __iter__(self) -> Iterator[Any]:
+        self._purge()
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        self._purge()
+        return len(self._data)
+
+    def __contains__(self, key: Any) -> bool:
+        self._purge()
+        return key in self._data
+
+    # Views read the entries directly, so iterating them does not count as use
+    def keys(self) -> Any:
+        self._purge()
+        return self._data.keys()
+
+    def values(self) -> Any:
+        self._purge()
+        return self._data.values()
+
+    def items(self) -> Any:
+        self._purge()
+        return self._data.items()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self._data)!r}, {self._options()!r})"
+
+    def _purge(self) -> None:
+        """Drop entries that are no longer valid; a no-op unless entries expire."""
+
+    def _discard(self, key: Any) -> None:
+        """Remove an entry and its size bookkeeping."""
+        del self._data[key]
+        self._total_bytes -= self._sizes.pop(key, 0)
+
+    def _oldest(self) -> Any:
+        """Key of the entry to evict first."""
+        return next(iter(self._data))
+
+    def _evict(self, keep: Any) -> None:
+        """Drop the oldest entries until the bounds hold, never dropping ``keep``."""
+        while len(self._data) > 1 and (
+                (self.maxsize is not None and len(self._data) > self.maxsize) or
+                (self.max_bytes is not None and self._total_bytes > self.max_bytes)):
+            oldest = self._oldest()
+            if oldest == keep:
+                break
+            self._discard(oldest)
+
+    def _options(self) -> Dict[str, Any]:
+        """Constructor arguments needed to recreate the container."""
+        return {"maxsize": self.maxsize, "max_bytes": self.max_bytes}
+
+    def _dump(self) -> List[Any]:
+        """Entries in eviction order, as plain lists."""
+        return [[key, value] for key, value in self._data.items()]
+
+    def _load(self, items: List[Any]) -> None:
+        """Restore entries produced by ``_dump`` without re-applying eviction."""
+        for key, value in items:
+            self._data[key] = value
+            if self.max_bytes is not None:
+                self._sizes[key] = _item_size(key, value)
+                self._total_bytes += self._sizes[key]
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return _rebuild, (type(self), self._options(), self._dump())
+
+
+class LRUDict(_BoundedMapping):
+    """
+    Mapping that evicts the least recently used keys beyond ``maxsize`` entries
+    or ``max_bytes`` bytes.
+
+    Reading a key marks it as recently used in this process. Entries are stored
+    in the order they were last written, so reads leave the stored form alone
+    and a call that only reads does not make the function state dirty. After
+    a reload, recency is the order of the last writes.
+    """
+
+    def __init__(self, maxsize: Optional[int] = 128, max_bytes: Optional[int] = None):
+        super().__init__(maxsize=maxsize, max_bytes=max_bytes)
+        # Keys from least to most recently used, including reads
+        self._used: "OrderedDict[Any, None]" = OrderedDict()
+
+    def __getitem__(self, key: Any) -> Any:
+        value = self._data[key]
+        self._used.move_to_end(key)
+        return value
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        super().__setitem__(key, value)
+        self._used[key] = None
+
+    def _discard(self, key: Any) -> None:
+        super()._discard(key)
+        self._used.pop(key, None)
+
+    def _oldest(self) -> Any:
+        return next(iter(self._used))
+
+    def _load(self, items: List[Any]) -> None:
+        super()._load(items)
+        self._used = OrderedDict.fromkeys(self._data)
+
+
+class TTLDict(_BoundedMapping):
+    """
+    Mapping whose keys expire ``ttl`` seconds after they were last written.
+
+    Expiry uses wall-clock time, so it carries over between processes and
+    restarts. Expired keys are dropped on the next write or lookup.
+
+    Args:
+        ttl: Seconds a key stays after it was written
+        maxsize: Maximum number of entries; the oldest are evicted first
+        max_bytes: Maximum approximate serialized size of all entries
+    """
+
+    def __init__(self, ttl: float, maxsize: Optional[int] = None, max_bytes: Optional[int] = None):
+        if ttl <= 0:
+            raise ValueError("ttl must be positive")
+        super().__init__(maxsize=maxsize, max_bytes=max_bytes)
+        self.ttl = ttl
+        self._expires: Dict[Any, float] = {}
+
+    def __getitem__(self, key: Any) -> Any:
+        self._purge()
+        return self._data[key]
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self._purge()
+        super().__setitem__(key, value)
+        self._expires[key] = time.time() + self.ttl
+
+    def _discard(self, key: Any) -> None:
+        super()._discard(key)
+        self._expires.pop(key, None)
+
+    def _purge(self) -> None:
+        """Drop expired keys; they are ordered by expiry, so only the front is checked."""
+        now = time.time()
+        while self._data:
+            oldest = next(iter(self._data))
+            if self._expires.get(oldest, now + 1) > now:
+                break
+            self._discard(oldest)
+
+    def _options(self) -> Dict[str, Any]:
+        return {"ttl": self.ttl, **super()._options()}
+
+    def _dump(self) -> List[Any]:
+        return [[key, value, self._expires.get(key)] for key, value in self._data.items()]
+
+    def _load(self, items: List[Any]) -> None:
+        super()._load([[key, value] for key, value, _ in items])
+        self._expires.update((key, expires) for key, _, expires in items if expires is not None)
+
+
+class CappedDeque(deque):
+    """
+    Deque that keeps only the newest ``maxlen`` items.
+
+    This is a ``collections.deque`` with a mandatory ``maxlen`` that can also be
+    stored with the JSON serializer.
+    """
+
+    def __init__(self, iterable: Iterable[Any] = (), maxlen: Optional[int] = None):
+        if maxlen is None or maxlen < 1:
+            raise ValueError("maxlen must be at least 1")
+        super().__init__(iterable, maxlen)
+
+    def _dump(self) -> List[Any]:
+        return list(self)
+
+    def _load(self, items: List[Any]) -> None:
+        self.extend(items)
+
+
+_JSON_TYPES: Dict[str, type] = {cls.__name__: cls for cls in (LRUDict, TTLDict, CappedDeque)}
+
+
+def to_json(obj: Any) -> Dict[str, Any]:
+    """
+    Encode a container as a tagged JSON object; usable as ``json.dumps(default=...)``.
+
+    Raises:
+        TypeError: If ``obj`` is not one of the containers in this module
+    """
+    name = type(obj).__name__
+    if _JSON_TYPES.get(name) is type(obj):
+        if isinstance(obj, CappedDeque):
+            return {JSON_TAG: name, "options": {"maxlen": obj.maxlen}, "items": obj._dump()}
+        if isinstance(obj, _BoundedMapping):
+            return {JSON_TAG: name, "options": obj._options(), "items": obj._dump()}
+    raise TypeError(f"Object of type {name} is not JSON serializable")
+
+
+def from_json(obj: Dict[str, Any]) -> Any:
+    """Decode objects produced by :func:`to_json`; usable as ``json.loads(object_hook=...)``."""
+    name = obj.get(JSON_TAG)
+    if name is None or name not in _JSON_TYPES:
+        return obj
+    return _rebuild(_JSON_TYPES[name], obj["options"], obj["items"])
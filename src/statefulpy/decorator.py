@@ -5,37 +5,111 @@ import functools
 import inspect
 import logging
 import atexit
+import contextvars
+import pickle
 import sys
-from typing import Any, Callable, Dict, Optional, TypeVar, cast, Tuple
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Set, TypeVar, cast, Tuple
 
-from statefulpy.backends.base import StateBackend, get_backend
+from statefulpy.backends.base import (
+    AsyncRLock,
+    AsyncStateBackend,
+    StateBackend,
+    check_durability,
+    get_async_backend,
+    get_backend,
+)
+from statefulpy import metrics
+from statefulpy.write_behind import WriteBehindBuffer
 
 logger = logging.getLogger(__name__)
 F = TypeVar('F', bound=Callable[..., Any])
 
 # Track all stateful functions for cleanup
-_stateful_functions: Dict[str, Tuple[Callable[..., Any], Any]] = {}
+_stateful_functions: Dict[str, Tuple[Callable[..., Any], Any, bool]] = {}
+
+class StateConflictError(RuntimeError):
+    """Raised when an optimistic call keeps conflicting with concurrent writers."""
+
+# Value types that cannot be mutated in place; reading them never needs a snapshot
+_IMMUTABLE_TYPES = (type(None), bool, int, float, complex, str, bytes)
+
+def _fingerprint(value: Any) -> bytes:
+    """Pickle a value; if its pickle is unchanged later, the value was not mutated."""
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
 
 class StateProxy:
-    """Proxy class that provides attribute-style access to the underlying state dictionary."""
+    """
+    Proxy class that provides attribute-style access to the underlying state dictionary.
     
-    def __init__(self, state_dict=None):
+    The proxy also tracks which top-level keys were changed since the state was
+    last loaded or saved. Assignments and deletions mark a key as changed
+    directly. Mutable values (lists, dicts, ...) that were read are pickled
+    when the changes are collected, and in-place mutations of nested
+    containers show up as a pickle that differs from the one taken after the
+    last load or save. Pickling runs in C and costs far less than a deep copy
+    and comparison, but still grows with the size of the values read: a call
+    that reads a large container pays for one pickle of it, on top of the
+    save if it changed it. Calls that only read their state can then skip
+    serialization and the backend write entirely.
+    
+    With ``fingerprint_reads=False`` reading a mutable value marks its key as
+    changed right away instead. Write-behind mode uses this: its saves run in
+    the background, so writing back a value that was only read is cheaper
+    than pickling it on every call.
+    """
+    
+    def __init__(self, state_dict=None, fingerprint_reads=True):
         object.__setattr__(self, "_state_dict", state_dict or {})
+        object.__setattr__(self, "_fingerprint_reads", fingerprint_reads)
+        object.__setattr__(self, "_changed", set())
+        # Mutable keys read since the last load or save, their fingerprints as
+        # of that load or save, and the fingerprints taken by changed_keys()
+        object.__setattr__(self, "_read", set())
+        object.__setattr__(self, "_snapshots", {})
+        object.__setattr__(self, "_fingerprints", {})
+    
+    def _track_read(self, name, value):
+        """Remember a mutable value that was read; fingerprint it unless that was done at the last save."""
+        if type(value) in _IMMUTABLE_TYPES:
+            return value
+        changed = object.__getattribute__(self, "_changed")
+        if not object.__getattribute__(self, "_fingerprint_reads"):
+            changed.add(name)
+            return value
+        read = object.__getattribute__(self, "_read")
+        if name in changed or name in read:
+            return value
+        read.add(name)
+        snapshots = object.__getattribute__(self, "_snapshots")
+        if name not in snapshots:
+            try:
+                snapshots[name] = _fingerprint(value)
+            except Exception:
+                # Values we cannot pickle are conservatively treated as changed
+                changed.add(name)
+        return value
+    
+    def _mark_changed(self, name):
+        object.__getattribute__(self, "_changed").add(name)
     
     def __getattr__(self, name):
         state_dict = object.__getattribute__(self, "_state_dict")
         if name in state_dict:
-            return state_dict[name]
+            return self._track_read(name, state_dict[name])
         raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
     
     def __setattr__(self, name, value):
         state_dict = object.__getattribute__(self, "_state_dict")
         state_dict[name] = value
+        self._mark_changed(name)
     
     def __delattr__(self, name):
         state_dict = object.__getattribute__(self, "_state_dict")
         if name in state_dict:
             del state_dict[name]
+            self._mark_changed(name)
         else:
             raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
             
@@ -44,35 +118,221 @@ class StateProxy:
     
     def update_from_dict(self, new_state):
         object.__setattr__(self, "_state_dict", new_state or {})
+        object.__getattribute__(self, "_snapshots").clear()
+        object.__getattribute__(self, "_fingerprints").clear()
+        self.mark_clean()
+    
+    def mark_clean(self) -> None:
+        """
+        Forget all tracked changes, e.g. after the state was loaded or saved.
+        
+        The fingerprints taken by the preceding changed_keys() describe the
+        saved values, so the next call does not need to pickle them again.
+        """
+        changed = object.__getattribute__(self, "_changed")
+        snapshots = object.__getattribute__(self, "_snapshots")
+        fingerprints = object.__getattribute__(self, "_fingerprints")
+        for name in changed:
+            snapshots.pop(name, None)
+        snapshots.update(fingerprints)
+        fingerprints.clear()
+        changed.clear()
+        object.__getattribute__(self, "_read").clear()
+    
+    def changed_keys(self) -> Set[str]:
+        """
+        Return the top-level keys that changed since the last load or save.
+        
+        Deleted keys are included as well.
+        """
+        state_dict = object.__getattribute__(self, "_state_dict")
+        changed = set(object.__getattribute__(self, "_changed"))
+        snapshots = object.__getattribute__(self, "_snapshots")
+        fingerprints = object.__getattribute__(self, "_fingerprints")
+        fingerprints.clear()
+        for name in object.__getattribute__(self, "_read"):
+            if name in changed:
+                continue
+            if name not in state_dict:
+                changed.add(name)
+                continue
+            try:
+                fingerprint = _fingerprint(state_dict[name])
+            except Exception:
+                changed.add(name)
+                continue
+            if fingerprint != snapshots.get(name):
+                changed.add(name)
+            fingerprints[name] = fingerprint
+        return changed
+    
+    def is_dirty(self) -> bool:
+        """Return True if the state changed since the last load or save."""
+        return bool(self.changed_keys())
 
     def __contains__(self, key):
         return key in self.get_state_dict()
     
     def __getitem__(self, key):
-        return self.get_state_dict()[key]
+        return self._track_read(key, self.get_state_dict()[key])
     
     def __setitem__(self, key, value):
         self.get_state_dict()[key] = value
+        self._mark_changed(key)
     
     def __delitem__(self, key):
         del self.get_state_dict()[key]
+        self._mark_changed(key)
     
     def __iter__(self):
         return iter(self.get_state_dict())
 
+class PartitionedStateProxy:
+    """
+    State of a function decorated with ``key_by``.
+    
+    Each partition has its own :class:`StateProxy`; this object forwards to the
+    partition of the call that is currently running in this thread or task, so
+    ``fn.state`` can be used inside the function exactly as without partitions.
+    """
+    
+    def __init__(self, current: "contextvars.ContextVar[Optional[StateProxy]]"):
+        object.__setattr__(self, "_current", current)
+    
+    def _proxy(self) -> StateProxy:
+        proxy = object.__getattribute__(self, "_current").get()
+        if proxy is None:
+            raise RuntimeError("The state of a partitioned function is only available during a call")
+        return cast(StateProxy, proxy)
+    
+    def __getattr__(self, name):
+        return getattr(self._proxy(), name)
+    
+    def __setattr__(self, name, value):
+        setattr(self._proxy(), name, value)
+    
+    def __delattr__(self, name):
+        delattr(self._proxy(), name)
+    
+    def __contains__(self, key):
+        return key in self._proxy()
+    
+    def __getitem__(self, key):
+        return self._proxy()[key]
+    
+    def __setitem__(self, key, value):
+        self._proxy()[key] = value
+    
+    def __delitem__(self, key):
+        del self._proxy()[key]
+    
+    def __iter__(self):
+        return iter(self._proxy())
+
+class _StateSlot:
+    """In-memory state of one state key: a function or one partition of it."""
+    
+    __slots__ = ("key", "proxy", "version", "lock", "active")
+    
+    def __init__(self, key: str, lock: Any, state: Optional[dict] = None,
+                 version: Optional[int] = None, fingerprint_reads: bool = True):
+        self.key = key
+        self.proxy = StateProxy(state or {}, fingerprint_reads)
+        # Version of the persisted state the in-memory state corresponds to;
+        # None forces a load on the next call
+        self.version = version
+        # Serializes calls within this process where the backend lock is not used
+        self.lock = lock
+        # Calls of this partition that are running; busy slots are never evicted
+        self.active = 0
+    
+    def discard(self) -> None:
+        """Drop the in-memory state, e.g. changes of a failed call; the next call reloads it."""
+        self.version = None
+        self.proxy.update_from_dict({})
+
+def _partitioner(func: Callable[..., Any], key_by: Any) -> Optional[Callable[..., str]]:
+    """
+    Build a function mapping call arguments to a partition name.
+    
+    Args:
+        func: The decorated function
+        key_by: None, a callable taking the call arguments, or the name (or
+            names) of arguments whose values select the partition
+    """
+    if key_by is None:
+        return None
+    if callable(key_by):
+        return lambda args, kwargs: str(key_by(*args, **kwargs))
+    
+    names = [key_by] if isinstance(key_by, str) else list(key_by)
+    signature = inspect.signature(func)
+    unknown = [name for name in names if name not in signature.parameters]
+    if not names or unknown:
+        raise ValueError(f"key_by must name arguments of {func.__qualname__}, got {key_by!r}")
+    
+    def partition(args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> str:
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return ",".join(str(bound.arguments[name]) for name in names)
+    return partition
+
 def stateful_decorator(
     backend=None, 
     serializer=None, 
     reentrant=False, 
     save_on_exit=True, 
-    cache=True, 
+    cache=False, 
+    flush_interval=1.0,
+    flush_every=None,
+    concurrency="pessimistic",
+    max_retries=10,
+    key_by=None,
+    max_partitions=1024,
+    durability=None,
     **backend_kwargs  # <-- Added to capture extra arguments such as db_path, function_id, etc.
 ):
     """
     Decorator that adds persistent state to a function.
     
+    Coroutine functions (``async def``) are supported as well; they use the
+    asyncio variant of the backend so that I/O and lock waits do not block
+    the event loop.
+    
     Args:
-        backend: Name of the backend to use ('sqlite' or 'redis')
+        backend: Name of the backend to use ('sqlite', 'redis', 'memory', 'shm', 'log'
+            or 'server')
+        serializer: Name of the serializer to use (default: 'json')
+        save_on_exit: Flush unsaved state when the interpreter exits
+        cache: Enable write-behind mode. The state is kept in process memory and
+            written to the backend in the background instead of being locked,
+            loaded and saved on every call. Only use this when a single process
+            writes the state.
+        flush_interval: Seconds between background flushes in write-behind mode
+            (None to disable periodic flushing)
+        flush_every: In write-behind mode, flush early once this many calls
+            changed the state (None to disable)
+        concurrency: 'pessimistic' (default) takes the backend lock around every
+            call. 'optimistic' runs the function without the lock and commits
+            with a conditional write that fails if another writer saved in the
+            meantime, in which case the state is reloaded and the function is
+            called again. Only use it for functions that are safe to retry.
+        max_retries: Number of retries after a conflict in optimistic mode before
+            StateConflictError is raised
+        key_by: Partition the state by call arguments. Either a callable that
+            receives the call arguments and returns the partition name, or the
+            name (or a list of names) of arguments whose values select it.
+            Every partition is stored and locked under its own key,
+            ``"<function key>[<partition>]"``.
+        max_partitions: With ``key_by``, the number of partitions kept in
+            memory. Beyond it the least recently used partitions are dropped
+            once they are idle and have no unsaved changes, and loaded from
+            the backend again on their next call (None for no limit).
+        durability: Trade-off between save latency and safety, passed to the
+            backend: 'strict', 'normal' or 'relaxed' (default: the backend's
+            own default). SQLite maps it to ``PRAGMA synchronous``; Redis
+            waits for replicas with 'strict' and sends saves together with
+            the lock release with 'relaxed'.
         **backend_kwargs: Additional backend parameters (e.g., db_path)
     
     Returns:
@@ -80,6 +340,17 @@ def stateful_decorator(
     """
     if serializer is None:
         serializer = "json"
+    if concurrency not in ("pessimistic", "optimistic"):
+        raise ValueError(
+            f"Unknown concurrency mode: {concurrency}. "
+            f"Valid modes are: pessimistic, optimistic"
+        )
+    if cache and concurrency == "optimistic":
+        raise ValueError("Write-behind caching cannot be combined with optimistic concurrency")
+    if max_partitions is not None and max_partitions < 1:
+        raise ValueError("max_partitions must be at least 1 or None")
+    if check_durability(durability) is not None:
+        backend_kwargs["durability"] = durability
     
     def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
         # Allow override of the state key using a 'function_id' kwarg
@@ -91,56 +362,434 @@ def stateful_decorator(
             else:
                 key = f"{func.__module__}.{func.__name__}"
         
+        partition = _partitioner(func, key_by)
+        
+        if inspect.iscoroutinefunction(func):
+            if cache:
+                raise ValueError("Write-behind caching is not supported for coroutine functions")
+            async_backend = get_async_backend(backend, serializer=serializer, **backend_kwargs)
+            return _async_stateful(
+                func, key, async_backend, concurrency, max_retries, save_on_exit, partition,
+                max_partitions
+            )
+        
         # Initialize backend with extra keyword arguments
         backend_instance = get_backend(backend, serializer=serializer, **backend_kwargs)
         
-        state_dict = backend_instance.load_state(key) or {}
-        state_proxy = StateProxy(state_dict)
+        write_behind: Optional[WriteBehindBuffer] = None
+        if cache:
+            write_behind = WriteBehindBuffer(
+                backend_instance, flush_interval=flush_interval, flush_every=flush_every,
+                function_key=key
+            )
         
-        _stateful_functions[key] = (func, backend_instance)
+        # Partition slots are kept in least recently used order
+        slots: "OrderedDict[str, _StateSlot]" = OrderedDict()
+        slots_lock = threading.Lock()
         
-        @functools.wraps(func)
-        def wrapper(*args: Any, **kwargs: Any) -> Any:
-            backend_instance.acquire_lock(key)
-            try:
-                fresh_state = backend_instance.load_state(key)
-                if fresh_state:
-                    state_proxy.update_from_dict(fresh_state)
-                    for k, v in state_proxy.get_state_dict().items():
+        def get_slot(state_key: str, load: bool = False) -> _StateSlot:
+            """Return the slot for a state key, creating it on first use."""
+            slot = slots.get(state_key)
+            if slot is not None:
+                return slot
+            with slots_lock:
+                slot = slots.get(state_key)
+                if slot is None:
+                    if write_behind is not None:
+                        # Mutable values read by a call are written back without checking for changes
+                        state, version = backend_instance.load_state_versioned(state_key)
+                        slot = _StateSlot(state_key, threading.RLock(), state, version,
+                                          fingerprint_reads=False)
+                    elif load:
+                        state, version = backend_instance.load_state_versioned(state_key)
+                        slot = _StateSlot(state_key, threading.RLock(), state, version)
+                    else:
+                        slot = _StateSlot(state_key, threading.RLock())
+                    if write_behind is not None:
+                        write_behind.register(state_key, slot.proxy)
+                    slots[state_key] = slot
+            return slot
+        
+        def enter_partition(state_key: str) -> _StateSlot:
+            """Return the slot of a partition for a call; release it with leave_partition."""
+            while True:
+                slot = get_slot(state_key)
+                with slots_lock:
+                    # Retry if the slot was evicted before this call claimed it
+                    if slots.get(state_key) is slot:
+                        slot.active += 1
+                        slots.move_to_end(state_key)
+                        evict_partitions()
+                        return slot
+        
+        def leave_partition(slot: _StateSlot) -> None:
+            with slots_lock:
+                slot.active -= 1
+        
+        def evict_partitions() -> None:
+            """Drop idle, saved partitions beyond max_partitions, least recently used first."""
+            excess = len(slots) - max_partitions if max_partitions is not None else 0
+            for state_key, slot in list(slots.items()):
+                if excess <= 0:
+                    return
+                if slot.active or slot.proxy.changed_keys():
+                    continue
+                if write_behind is not None and not write_behind.unregister(state_key):
+                    continue
+                del slots[state_key]
+                excess -= 1
+        
+        current_slot: "contextvars.ContextVar[Optional[StateProxy]]" = contextvars.ContextVar(
+            f"statefulpy_partition:{key}", default=None
+        )
+        
+        def refresh_state(slot: _StateSlot) -> None:
+            """Reload the state unless the stored version matches the in-memory one."""
+            if slot.version is not None:
+                version = backend_instance.get_version(slot.key)
+                if version is not None and version == slot.version:
+                    return
+            fresh_state, slot.version = backend_instance.load_state_versioned(slot.key)
+            if fresh_state:
+                slot.proxy.update_from_dict(fresh_state)
+                if partition is None:
+                    for k in list(slot.proxy):
                         if not hasattr(wrapper, k):
-                            setattr(wrapper, k, v)
-                result = func(*args, **kwargs)
-                if not hasattr(wrapper, "state"):
-                    wrapper.state = state_proxy
-                backend_instance.save_state(key, state_proxy.get_state_dict())
-                logger.debug(f"State for {key} updated: {state_proxy.get_state_dict()}")
-                return result
+                            # Read through the proxy so in-place mutations are tracked
+                            setattr(wrapper, k, slot.proxy[k])
+        
+        def call_optimistic(slot: _StateSlot, args: Tuple[Any, ...], kwargs: Dict[str, Any],
+                            timer: Any) -> Any:
+            for attempt in range(max_retries + 1):
+                refresh_state(slot)
+                timer.lap("load")
+                try:
+                    result = func(*args, **kwargs)
+                except BaseException:
+                    slot.discard()
+                    raise
+                timer.lap("call")
+                changed = slot.proxy.changed_keys()
+                if not changed:
+                    return result
+                saved, version = backend_instance.compare_and_swap(
+                    slot.key, slot.proxy.get_state_dict(), slot.version, changed=changed
+                )
+                timer.lap("save")
+                if saved:
+                    slot.version = version
+                    slot.proxy.mark_clean()
+                    return result
+                # Someone else saved first: discard our changes and retry on fresh state
+                logger.debug(f"Version conflict for {slot.key} (attempt {attempt + 1})")
+                slot.discard()
+            raise StateConflictError(
+                f"State for {slot.key} changed concurrently on {max_retries + 1} attempts"
+            )
+        
+        def call(slot: _StateSlot, args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> Any:
+            timer = metrics.timer(key)
+            try:
+                if write_behind is not None:
+                    # The in-memory state is authoritative; the flusher persists it
+                    with write_behind.lock(slot.key):
+                        timer.lap("lock")
+                        result = func(*args, **kwargs)
+                        timer.lap("call")
+                        write_behind.record_call(slot.key)
+                    return result
+                
+                if concurrency == "optimistic":
+                    with slot.lock:
+                        timer.lap("lock")
+                        return call_optimistic(slot, args, kwargs, timer)
+                
+                backend_instance.acquire_lock(slot.key)
+                timer.lap("lock")
+                released = False
+                try:
+                    # Only reload and deserialize when another writer changed the state
+                    refresh_state(slot)
+                    timer.lap("load")
+                    try:
+                        result = func(*args, **kwargs)
+                    except BaseException:
+                        # A failed call's changes are never saved, not even by a later call
+                        slot.discard()
+                        raise
+                    timer.lap("call")
+                    # Skip serialization and the write entirely for read-only calls
+                    changed = slot.proxy.changed_keys()
+                    if changed:
+                        # The save releases the lock, in one round trip where supported
+                        released = True
+                        saved, slot.version = backend_instance.save_and_release(
+                            slot.key, slot.proxy.get_state_dict(), changed=changed
+                        )
+                        timer.lap("save")
+                        if saved:
+                            slot.proxy.mark_clean()
+                        logger.debug(f"Saved {len(changed)} changed keys of {slot.key}")
+                    return result
+                finally:
+                    if not released:
+                        timer.start()
+                        backend_instance.release_lock(slot.key)
+                        timer.lap("release")
             finally:
-                backend_instance.release_lock(key)
+                timer.finish()
+        
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if partition is None:
+                return call(get_slot(key), args, kwargs)
+            
+            with metrics.function_key(key):
+                slot = enter_partition(f"{key}[{partition(args, kwargs)}]")
+                token = current_slot.set(slot.proxy)
+                try:
+                    return call(slot, args, kwargs)
+                finally:
+                    current_slot.reset(token)
+                    leave_partition(slot)
+        
+        def flush_slot(slot: _StateSlot) -> bool:
+            changed = slot.proxy.changed_keys()
+            if not changed:
+                return True
+            if concurrency == "optimistic":
+                with slot.lock:
+                    saved, version = backend_instance.compare_and_swap(
+                        slot.key, slot.proxy.get_state_dict(), slot.version, changed=changed
+                    )
+                    if saved:
+                        slot.version = version
+                        slot.proxy.mark_clean()
+                    return saved
+            backend_instance.acquire_lock(slot.key)
+            saved, slot.version = backend_instance.save_and_release(
+                slot.key, slot.proxy.get_state_dict(), changed=changed
+            )
+            if saved:
+                slot.proxy.mark_clean()
+            return saved
+        
+        def flush_state() -> bool:
+            """Write any unsaved state of this function to the backend."""
+            if write_behind is not None:
+                return write_behind.flush()
+            with metrics.function_key(key):
+                results = [flush_slot(slot) for slot in list(slots.values())]
+            return all(results)
         
-        if not hasattr(wrapper, "state"):
-            wrapper.state = state_proxy
+        if partition is None:
+            # Load eagerly so the state is available before the first call
+            wrapper.state = get_slot(key, load=True).proxy  # type: ignore[attr-defined]
+        else:
+            wrapper.state = PartitionedStateProxy(current_slot)  # type: ignore[attr-defined]
+        wrapper.flush_state = flush_state  # type: ignore[attr-defined]
+        
+        _stateful_functions[key] = (wrapper, backend_instance, save_on_exit)
         
         return wrapper
     return decorator
 
-# Register cleanup function
-@atexit.register
-def _cleanup_stateful_functions():
-    """Clean up all stateful functions by ensuring state is saved and locks are released."""
-    for fn_id, (func, backend) in _stateful_functions.items():
+def _async_stateful(
+    func: Callable[..., Any],
+    key: str,
+    backend_instance: AsyncStateBackend,
+    concurrency: str,
+    max_retries: int,
+    save_on_exit: bool,
+    partition: Optional[Callable[..., str]] = None,
+    max_partitions: Optional[int] = None,
+) -> Callable[..., Any]:
+    """
+    Build the wrapper for a stateful ``async def`` function.
+    
+    Mirrors the blocking wrapper, but awaits a non-blocking backend. The state
+    is loaded lazily on the first call since no event loop may be running at
+    decoration time.
+    """
+    slots: "OrderedDict[str, _StateSlot]" = OrderedDict()
+    
+    def get_slot(state_key: str) -> _StateSlot:
+        slot = slots.get(state_key)
+        if slot is None:
+            slot = slots[state_key] = _StateSlot(state_key, AsyncRLock())
+        return slot
+    
+    def enter_partition(state_key: str) -> _StateSlot:
+        """Return the slot of a partition for a call, evicting idle ones beyond max_partitions."""
+        slot = get_slot(state_key)
+        slot.active += 1
+        slots.move_to_end(state_key)
+        excess = len(slots) - max_partitions if max_partitions is not None else 0
+        for other_key, other in list(slots.items()):
+            if excess <= 0:
+                break
+            if not other.active and not other.proxy.changed_keys():
+                del slots[other_key]
+                excess -= 1
+        return slot
+    
+    current_slot: "contextvars.ContextVar[Optional[StateProxy]]" = contextvars.ContextVar(
+        f"statefulpy_partition:{key}", default=None
+    )
+    
+    async def refresh_state(slot: _StateSlot) -> None:
+        """Reload the state unless the stored version matches the in-memory one."""
+        if slot.version is not None:
+            version = await backend_instance.get_version(slot.key)
+            if version is not None and version == slot.version:
+                return
+        fresh_state, slot.version = await backend_instance.load_state_versioned(slot.key)
+        if fresh_state:
+            slot.proxy.update_from_dict(fresh_state)
+    
+    async def call_optimistic(slot: _StateSlot, args: Tuple[Any, ...], kwargs: Dict[str, Any],
+                              timer: Any) -> Any:
+        for attempt in range(max_retries + 1):
+            await refresh_state(slot)
+            timer.lap("load")
+            try:
+                result = await func(*args, **kwargs)
+            except BaseException:
+                slot.discard()
+                raise
+            timer.lap("call")
+            changed = slot.proxy.changed_keys()
+            if not changed:
+                return result
+            saved, version = await backend_instance.compare_and_swap(
+                slot.key, slot.proxy.get_state_dict(), slot.version, changed=changed
+            )
+            timer.lap("save")
+            if saved:
+                slot.version = version
+                slot.proxy.mark_clean()
+                return result
+            logger.debug(f"Version conflict for {slot.key} (attempt {attempt + 1})")
+            slot.discard()
+        raise StateConflictError(
+            f"State for {slot.key} changed concurrently on {max_retries + 1} attempts"
+        )
+    
+    async def call(slot: _StateSlot, args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> Any:
+        # Phases of coroutine calls include time other tasks ran while this one waited
+        timer = metrics.timer(key)
+        try:
+            if concurrency == "optimistic":
+                async with slot.lock:
+                    timer.lap("lock")
+                    return await call_optimistic(slot, args, kwargs, timer)
+            
+            await backend_instance.acquire_lock(slot.key)
+            timer.lap("lock")
+            released = False
+            try:
+                await refresh_state(slot)
+                timer.lap("load")
+                try:
+                    result = await func(*args, **kwargs)
+                except BaseException:
+                    slot.discard()
+                    raise
+                timer.lap("call")
+                changed = slot.proxy.changed_keys()
+                if changed:
+                    released = True
+                    saved, slot.version = await backend_instance.save_and_release(
+                        slot.key, slot.proxy.get_state_dict(), changed=changed
+                    )
+                    timer.lap("save")
+                    if saved:
+                        slot.proxy.mark_clean()
+                    logger.debug(f"Saved {len(changed)} changed keys of {slot.key}")
+                return result
+            finally:
+                if not released:
+                    timer.start()
+                    await backend_instance.release_lock(slot.key)
+                    timer.lap("release")
+        finally:
+            timer.finish()
+    
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if partition is None:
+            return await call(get_slot(key), args, kwargs)
+        
+        with metrics.function_key(key):
+            slot = enter_partition(f"{key}[{partition(args, kwargs)}]")
+            token = current_slot.set(slot.proxy)
+            try:
+                return await call(slot, args, kwargs)
+            finally:
+                current_slot.reset(token)
+                slot.active -= 1
+    
+    async def flush_slot(slot: _StateSlot) -> bool:
+        changed = slot.proxy.changed_keys()
+        if not changed:
+            return True
+        await backend_instance.acquire_lock(slot.key)
+        saved, slot.version = await backend_instance.save_and_release(
+            slot.key, slot.proxy.get_state_dict(), changed=changed
+        )
+        if saved:
+            slot.proxy.mark_clean()
+        return saved
+    
+    async def flush_state() -> bool:
+        """Write any unsaved state of this function to the backend."""
+        with metrics.function_key(key):
+            results = [await flush_slot(slot) for slot in list(slots.values())]
+        return all(results)
+    
+    if partition is None:
+        wrapper.state = get_slot(key).proxy  # type: ignore[attr-defined]
+    else:
+        wrapper.state = PartitionedStateProxy(current_slot)  # type: ignore[attr-defined]
+    wrapper.flush_state = flush_state  # type: ignore[attr-defined]
+    
+    _stateful_functions[key] = (wrapper, backend_instance, save_on_exit)
+    
+    return wrapper
+
+def _flush_stateful_functions(final: bool = False) -> None:
+    """
+    Write unsaved state of all stateful functions to their backends.
+    
+    Args:
+        final: Whether the interpreter is exiting. Functions decorated with
+            ``save_on_exit=False`` are skipped and locks are released.
+    """
+    for fn_id, (func, backend, save_on_exit) in list(_stateful_functions.items()):
+        if isinstance(backend, AsyncStateBackend):
+            # Async functions save on every call and need their event loop to flush;
+            # use ``await fn.flush_state()`` for changes made outside of a call.
+            continue
         try:
-            # Ensure the state is saved
-            if hasattr(func, 'state'):
-                backend.save_state(fn_id, func.state.get_state_dict())
+            if save_on_exit or not final:
+                func.flush_state()  # type: ignore[attr-defined]
             
-            # Release any locks that might be held
-            backend.release_lock(fn_id)
+            if final:
+                # Release any locks that might be held
+                backend.release_lock(fn_id)
         except Exception as e:
             logger.error(f"Error during cleanup of {fn_id}: {e}")
 
+# Register cleanup function
+@atexit.register
+def _cleanup_stateful_functions():
+    """Clean up all stateful functions by ensuring state is saved and locks are released."""
+    _flush_stateful_functions(final=True)
+
 # New alias for backward compatibility
-_flush_all_state = _cleanup_stateful_functions
+def _flush_all_state() -> None:
+    """Flush unsaved state of all stateful functions without releasing locks."""
+    _flush_stateful_functions()
 
 class _Wrapped:
     state: Any  # Add state attribute
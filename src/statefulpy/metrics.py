@@ -0,0 +1,260 @@
+"""
+In-process timing statistics for stateful calls.
+
+Every call of a stateful function is split into phases, and the time spent in
+each phase is recorded per function key; the partitions of a ``key_by``
+function (``"<function key>[<partition>]"``) share the statistics of their
+function, so the number of histograms does not grow with the partitions:
+
+* ``lock``: acquiring the backend lock
+* ``load``: checking the version and reloading the state (includes ``deserialize``)
+* ``deserialize``: turning stored bytes into the state
+* ``call``: the decorated function itself
+* ``serialize``: turning the state into bytes
+* ``save``: writing the state (includes ``serialize``)
+* ``release``: releasing the backend lock
+
+The sizes of the serialized payloads are recorded as ``bytes_read`` and
+``bytes_written``. Recording costs a few hundred nanoseconds per phase and can
+be switched off with :func:`enable`.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Upper bounds of the histogram buckets: powers of two starting at one
+# microsecond for timings and at 64 bytes for sizes; the last bucket is open
+_TIME_BOUNDS = tuple(1e-6 * 2 ** i for i in range(27))
+_SIZE_BOUNDS = tuple(64 * 2 ** i for i in range(24))
+
+_SIZE_METRICS = ("bytes_read", "bytes_written")
+
+
+class _Histogram:
+    """Count, sum, extremes and log2 buckets of recorded values."""
+
+    __slots__ = ("bounds", "count", "total", "min", "max", "buckets")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.buckets = [0] * (len(bounds) + 1)
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        # Buckets double in size, so the index is ceil(log2(value / first bound))
+        ratio = value / self.bounds[0]
+        if ratio <= 1:
+            index = 0
+        else:
+            mantissa, exponent = math.frexp(ratio)
+            index = min(exponent - 1 if mantissa == 0.5 else exponent, len(self.bounds))
+        self.buckets[index] += 1
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bound of the bucket holding the given fraction of values."""
+        threshold = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.buckets):
+            seen += count
+            if seen >= threshold:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "min": self.min if self.count else 0.0,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "histogram": [
+                (bound, count)
+                for bound, count in zip(self.bounds + (float("inf"),), self.buckets) if count
+            ],
+        }
+
+
+_enabled = True
+_lock = threading.Lock()
+# Function key set by function_key() for the code running in this context
+_function_key: "ContextVar[Optional[str]]" = ContextVar("statefulpy_function_key", default=None)
+_stats: Dict[str, Dict[str, _Histogram]] = {}
+
+
+def enable(flag: bool = True) -> None:
+    """Turn recording on or off for the whole process."""
+    global _enabled
+    _enabled = flag
+
+
+def is_enabled() -> bool:
+    """Return True if statistics are being recorded."""
+    return _enabled
+
+
+@contextmanager
+def function_key(fn_id: Optional[str]) -> Iterator[None]:
+    """
+    Record the (de)serializations made in this block under the function key ``fn_id``.
+
+    Backends only know the state key they read or write, which for a
+    partition is ``"<function key>[<partition>]"``; the decorator knows the
+    function key and sets it around partitioned calls. None leaves the key as is.
+    """
+    if fn_id is None:
+        yield
+        return
+    token = _function_key.set(fn_id)
+    try:
+        yield
+    finally:
+        _function_key.reset(token)
+
+
+def _add(fn_id: str, metric: str, value: float) -> None:
+    """Add one value; must be called with ``_lock`` held."""
+    metrics = _stats.get(fn_id)
+    if metrics is None:
+        metrics = _stats[fn_id] = {}
+    histogram = metrics.get(metric)
+    if histogram is None:
+        bounds = _SIZE_BOUNDS if metric in _SIZE_METRICS else _TIME_BOUNDS
+        histogram = metrics[metric] = _Histogram(bounds)
+    histogram.add(value)
+
+
+def record(fn_id: str, metric: str, value: float) -> None:
+    """
+    Record a duration in seconds, or a size in bytes for ``bytes_read``/``bytes_written``.
+
+    Args:
+        fn_id: State key the value belongs to
+        metric: Phase name or size metric
+        value: The measured value
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _add(fn_id, metric, value)
+
+
+def record_serialization(fn_id: str, direction: str, seconds: float, size: int) -> None:
+    """
+    Record one (de)serialization and the size of its payload.
+
+    Args:
+        fn_id: State key the payload belongs to; recorded under the key set
+            by :func:`function_key` instead, if any
+        direction: 'serialize' or 'deserialize'
+        seconds: Time spent converting the payload
+        size: Payload size in bytes
+    """
+    if not _enabled:
+        return
+    fn_id = _function_key.get() or fn_id
+    with _lock:
+        _add(fn_id, direction, seconds)
+        _add(fn_id, "bytes_written" if direction == "serialize" else "bytes_read", size)
+
+
+class CallTimer:
+    """
+    Times the consecutive phases of one call and records them together.
+
+    ``lap(phase)`` attributes the time since the previous lap (or ``start``)
+    to ``phase``; ``finish`` records all laps under a single lock acquisition.
+    """
+
+    __slots__ = ("fn_id", "last", "laps")
+
+    def __init__(self, fn_id: str):
+        self.fn_id = fn_id
+        self.last = time.perf_counter()
+        self.laps: List[Tuple[str, float]] = []
+
+    def start(self) -> None:
+        """Restart timing without recording, e.g. after a phase that raised."""
+        self.last = time.perf_counter()
+
+    def lap(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.laps.append((phase, now - self.last))
+        self.last = now
+
+    def finish(self) -> None:
+        if not _enabled:
+            return
+        with _lock:
+            for phase, seconds in self.laps:
+                _add(self.fn_id, phase, seconds)
+        self.laps.clear()
+
+
+class _NullTimer:
+    """Stand-in for CallTimer while recording is disabled."""
+
+    __slots__ = ()
+
+    def start(self) -> None:
+        pass
+
+    def lap(self, phase: str) -> None:
+        pass
+
+    def finish(self) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(fn_id: str) -> Any:
+    """Return a CallTimer for ``fn_id``, or a no-op timer while recording is disabled."""
+    return CallTimer(fn_id) if _enabled else _NULL_TIMER
+
+
+def stats(fn_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Return a snapshot of the recorded statistics.
+
+    Args:
+        fn_id: Only return the statistics of this function key
+
+    Returns:
+        ``{function key: {metric: {count, total, mean, min, max, p50, p90, p99,
+        histogram}}}``, or the inner dictionary if ``fn_id`` is given. Times
+        are in seconds; percentiles are bucket upper bounds, accurate to a
+        factor of two. ``histogram`` lists ``(upper bound, count)`` pairs of
+        non-empty buckets.
+    """
+    with _lock:
+        if fn_id is not None:
+            return {metric: h.snapshot() for metric, h in _stats.get(fn_id, {}).items()}
+        return {
+            key: {metric: h.snapshot() for metric, h in metrics.items()}
+            for key, metrics in _stats.items()
+        }
+
+
+def reset_stats(fn_id: Optional[str] = None) -> None:
+    """Discard recorded statistics, for one function key or for all of them."""
+    with _lock:
+        if fn_id is None:
+            _stats.clear()
+        else:
+            _stats.pop(fn_id, None)
@@ -19,11 +19,31 @@ class StateSerializer(ABC):
     def deserialize(self, data: bytes) -> dict:
         """Deserialize bytes to data."""
         pass
+    
+    def serialize_to(self, data: dict, stream: t.BinaryIO) -> None:
+        """
+        Serialize data into a writable binary stream.
+        
+        The default implementation writes the output of :meth:`serialize`;
+        serializers that can produce their output incrementally override it.
+        """
+        stream.write(self.serialize(data))
+    
+    def deserialize_from(self, stream: t.BinaryIO) -> dict:
+        """
+        Deserialize data from a readable binary stream.
+        
+        The default implementation reads the whole stream and calls
+        :meth:`deserialize`; serializers that can consume their input
+        incrementally override it.
+        """
+        return self.deserialize(stream.read())
 
 
 _SERIALIZERS = {
     'pickle': 'statefulpy.serializers.pickle_serializer:PickleSerializer',
     'json': 'statefulpy.serializers.json_serializer:JSONSerializer',
+    'compressed': 'statefulpy.serializers.compressed_serializer:CompressedSerializer',
 }
 
 
@@ -33,7 +53,15 @@ def register_serializer(name: str, serializer_path: str) -> None:
 
 
 def get_serializer(serializer_type: str, **kwargs) -> StateSerializer:
-    """Get a serializer instance by type."""
+    """
+    Get a serializer instance by type.
+
+    A name of the form ``'<serializer>+<codec>'``, such as ``'json+zlib'``,
+    returns the named serializer wrapped in a compressing serializer.
+    """
+    if serializer_type not in _SERIALIZERS and '+' in serializer_type:
+        inner, _, codec = serializer_type.rpartition('+')
+        return get_serializer('compressed', inner=inner, codec=codec, **kwargs)
     if serializer_type not in _SERIALIZERS:
         raise ValueError(f"Unknown serializer type: {serializer_type}")
     
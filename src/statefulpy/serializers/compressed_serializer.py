@@ -0,0 +1,97 @@
+"""
+Compressing serializer implementation.
+
+Wraps another serializer and compresses its output with a standard library
+codec. Compressed payloads start with a header naming the codec, so they can be
+told apart from plain payloads; states written before compression was enabled,
+or smaller than the threshold, are stored and loaded unchanged.
+"""
+import lzma
+import zlib
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+from statefulpy.serializers.base import StateSerializer, get_serializer
+
+# Prefix of compressed payloads, followed by one byte identifying the codec.
+# Neither JSON nor pickle output can start with a NUL byte.
+MAGIC = b"\x00SPZ"
+
+_Codec = Tuple[int, Callable[[bytes, Optional[int]], bytes], Callable[[bytes], bytes]]
+
+
+def _zlib_compress(data: bytes, level: Optional[int]) -> bytes:
+    return zlib.compress(data, -1 if level is None else level)
+
+
+def _lzma_compress(data: bytes, level: Optional[int]) -> bytes:
+    return lzma.compress(data, preset=level)
+
+
+# Codec name -> (header id, compress, decompress)
+_CODECS: Dict[str, _Codec] = {
+    'zlib': (1, _zlib_compress, zlib.decompress),
+    'lzma': (2, _lzma_compress, lzma.decompress),
+}
+_CODEC_IDS: Dict[int, _Codec] = {codec[0]: codec for codec in _CODECS.values()}
+
+
+class CompressedSerializer(StateSerializer):
+    """
+    Serializer that compresses the output of another serializer.
+
+    Payloads shorter than ``threshold`` bytes, and payloads that do not get
+    smaller, are stored uncompressed. Loading accepts compressed payloads of any
+    supported codec as well as plain payloads of the inner serializer.
+    """
+
+    def __init__(self,
+                 inner: Union[str, StateSerializer] = "json",
+                 codec: str = "zlib",
+                 level: Optional[int] = None,
+                 threshold: int = 1024,
+                 **kwargs: Any):
+        """
+        Initialize the compressing serializer.
+
+        Args:
+            inner: Serializer whose output is compressed, as a registered name
+                or an instance
+            codec: Compression codec ('zlib' or 'lzma')
+            level: Compression level (zlib 0-9) or preset (lzma 0-9); None for
+                the codec's default
+            threshold: Minimum payload size in bytes to compress
+            **kwargs: Arguments for the inner serializer when given by name
+        """
+        if codec not in _CODECS:
+            raise ValueError(f"Unknown codec: {codec}. Valid codecs are: {', '.join(_CODECS)}")
+        if level is not None and not 0 <= level <= 9:
+            raise ValueError("level must be between 0 and 9 or None")
+        if threshold < 0:
+            raise ValueError("threshold must not be negative")
+        self.inner = inner if isinstance(inner, StateSerializer) else get_serializer(inner, **kwargs)
+        self.codec = codec
+        self.level = level
+        self.threshold = threshold
+        codec_id, self._compress, _ = _CODECS[codec]
+        self._header = MAGIC + bytes([codec_id])
+
+    def serialize(self, data: Dict[str, Any]) -> bytes:
+        """Serialize data with the inner serializer and compress large payloads."""
+        payload = self.inner.serialize(data)
+        if len(payload) < self.threshold:
+            return payload
+        compressed = self._header + self._compress(payload, self.level)
+        return compressed if len(compressed) < len(payload) else payload
+
+    def deserialize(self, data: bytes) -> Dict[str, Any]:
+        """Decompress data if it carries a compression header and deserialize it."""
+        if data[:len(MAGIC)] != MAGIC:
+            return self.inner.deserialize(data)
+        codec = _CODEC_IDS.get(data[len(MAGIC)]) if len(data) > len(MAGIC) else None
+        if codec is None:
+            raise ValueError("Unknown compression codec in state payload")
+        try:
+            payload = codec[2](data[len(MAGIC) + 1:])
+        except (zlib.error, lzma.LZMAError) as e:
+            raise ValueError(f"Failed to decompress state payload: {e}")
+        return self.inner.deserialize(payload)
@@ -2,13 +2,22 @@
 JSON serializer implementation.
 """
 import json
-from typing import Any, Dict, cast
+from typing import Any, BinaryIO, Dict, cast
 
+from statefulpy import containers
 from statefulpy.serializers.base import StateSerializer
 
+# Bytes present in every payload that contains an encoded container
+_CONTAINER_MARKER = f'"{containers.JSON_TAG}"'.encode('utf-8')
+
 
 class JSONSerializer(StateSerializer):
-    """Serializer using JSON."""
+    """
+    Serializer using JSON.
+    
+    The bounded containers from :mod:`statefulpy.containers` are encoded as
+    tagged objects and restored on load.
+    """
     
     def __init__(self, **kwargs):
         """
@@ -18,6 +27,7 @@ class JSONSerializer(StateSerializer):
             **kwargs: Additional arguments to pass to json.dumps
         """
         self.kwargs = kwargs
+        self.kwargs.setdefault("default", containers.to_json)
     
     def serialize(self, data: Dict[str, Any]) -> bytes:
         """Serialize data to bytes using JSON."""
@@ -25,5 +35,26 @@ class JSONSerializer(StateSerializer):
     
     def deserialize(self, data: bytes) -> Dict[str, Any]:
         """Deserialize bytes to data using JSON."""
-        result = json.loads(data.decode('utf-8'))
+        # Only pay for the object hook when the payload contains a container
+        object_hook = containers.from_json if _CONTAINER_MARKER in data else None
+        result = json.loads(data.decode('utf-8'), object_hook=object_hook)
         return cast(Dict[str, Any], result)
+    
+    def serialize_to(self, data: Dict[str, Any], stream: BinaryIO) -> None:
+        """
+        Serialize data into a stream one top-level value at a time.
+        
+        Only the encoding of the largest value is held in memory at once. The
+        output is identical to :meth:`serialize`; with custom ``json.dumps``
+        arguments or non-string keys the whole state is encoded at once.
+        """
+        if set(self.kwargs) != {"default"} or not all(isinstance(key, str) for key in data):
+            super().serialize_to(data, stream)
+            return
+        stream.write(b"{")
+        for i, (key, value) in enumerate(data.items()):
+            if i:
+                stream.write(b", ")
+            stream.write(json.dumps(key).encode('utf-8') + b": ")
+            stream.write(json.dumps(value, **self.kwargs).encode('utf-8'))
+        stream.write(b"}")
@@ -6,7 +6,7 @@ WARNING: The use of pickle is inherently insecure when working with untrusted da
 """
 import pickle  # Move this import from line 17 to the top
 import warnings
-from typing import Any, Dict, cast
+from typing import Any, BinaryIO, Dict, cast
 
 # Emit a warning when the module is imported
 warnings.warn(
@@ -56,3 +56,15 @@ class PickleSerializer(StateSerializer):
         except (pickle.UnpicklingError, AttributeError, EOFError, ImportError,
                 IndexError, TypeError) as e:
             raise ValueError(f"Failed to unpickle data: {e}")
+    
+    def serialize_to(self, data: Dict[str, Any], stream: BinaryIO) -> None:
+        """Pickle data directly into a stream, one frame at a time."""
+        pickle.dump(data, stream, protocol=self.protocol)
+    
+    def deserialize_from(self, stream: BinaryIO) -> Dict[str, Any]:
+        """Unpickle data directly from a stream."""
+        try:
+            return cast(Dict[str, Any], pickle.load(stream))
+        except (pickle.UnpicklingError, AttributeError, EOFError, ImportError,
+                IndexError, TypeError) as e:
+            raise ValueError(f"Failed to unpickle data: {e}")
@@ -0,0 +1,345 @@
+"""
+Local state server for statefulpy.
+
+``statefulpy serve`` runs a daemon that keeps states in memory, serializes
+access per function id and talks to worker processes of the same host over a
+Unix domain socket (see the ``server`` backend). States are written to a
+SQLite database in the background and loaded from it at startup; the database
+uses the schema of the SQLite backend, so it can be read or migrated with the
+other CLI commands.
+
+The server never deserializes states: clients send and receive the bytes of
+their own serializer.
+
+Wire format (little endian). Requests::
+
+    payload length (4) | op (1) | number (8) | timeout (8, double) | key length (2) | key | payload
+
+Responses::
+
+    payload length (4) | status (1) | number (8) | payload
+
+``number`` carries the version the client already has (-1 for none) or the
+version a save expects, and the resulting version in responses.
+"""
+import io
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sqlite3
+import struct
+import threading
+import time
+from typing import Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+REQUEST = struct.Struct("<IBqdH")
+RESPONSE = struct.Struct("<IBq")
+
+# Operations
+OP_LOCK = 1      # Lock; respond with the version, and the state if it differs from ``number``
+OP_UNLOCK = 2    # Save the payload if ``number`` >= 0 (the expected version), then unlock
+OP_LOAD = 3      # Respond with the version, and the state if it differs from ``number``
+OP_SAVE = 4      # Save the payload if the version equals ``number`` (-1: unconditionally)
+OP_VERSION = 5   # Respond with the version
+# Flag: write changes to the database before responding
+FLAG_PERSIST = 0x80
+
+# Statuses
+STATUS_OK = 0
+STATUS_CONFLICT = 1  # Version mismatch or lock timeout
+STATUS_ERROR = 2     # Payload holds the error message
+
+
+def read_exact(stream: io.BufferedIOBase, size: int) -> bytes:
+    """Read exactly ``size`` bytes from a buffered stream, raising EOFError at its end."""
+    data = stream.read(size)
+    if len(data) != size:
+        raise EOFError("Connection closed")
+    return data
+
+
+class _Entry:
+    """A state held by the server and its lock."""
+
+    __slots__ = ("version", "state", "owner", "depth", "released")
+
+    def __init__(self, mutex: threading.Lock, version: int = 0, state: Optional[bytes] = None):
+        self.version = version
+        self.state = state
+        self.owner: Optional[int] = None
+        self.depth = 0
+        self.released = threading.Condition(mutex)
+
+
+class StateServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server holding states in memory and persisting them to SQLite."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, db_path: str = "statefulpy.db",
+                 flush_interval: float = 1.0):
+        """
+        Initialize the server and load the stored states.
+
+        Args:
+            socket_path: Path of the Unix socket to listen on
+            db_path: SQLite database the states are persisted to
+            flush_interval: Seconds between background writes of changed states
+
+        Raises:
+            ValueError: If ``flush_interval`` is not positive or another server
+                listens on the socket
+        """
+        if flush_interval <= 0:
+            raise ValueError("flush_interval must be positive")
+        self.socket_path = socket_path
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self._mutex = threading.Lock()
+        self._entries: Dict[str, _Entry] = {}
+        self._dirty: Set[str] = set()
+        self._persist_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        self._conn = self._open_database()
+        for fn_id, state, version in self._conn.execute(
+                "SELECT fn_id, state, version FROM stateful_state WHERE state IS NOT NULL"):
+            self._entries[fn_id] = _Entry(self._mutex, version, bytes(state))
+        logger.info(f"Loaded {len(self._entries)} states from {db_path}")
+
+        if os.path.exists(socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+            except OSError:
+                # Left behind by a server that did not shut down cleanly
+                os.unlink(socket_path)
+            else:
+                self._conn.close()
+                raise ValueError(f"A server is already listening on {socket_path}")
+            finally:
+                probe.close()
+        super().__init__(socket_path, _Handler)
+        self._flusher = threading.Thread(target=self._flush_loop, name="statefulpy-serve-flush",
+                                         daemon=True)
+        self._flusher.start()
+
+    def _open_database(self) -> sqlite3.Connection:
+        """Open the database, creating the SQLite backend's schema if needed."""
+        from statefulpy.backends.sqlite import SQLiteBackend
+        SQLiteBackend(db_path=self.db_path, serializer="json").close()
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    # State operations, called by connection handlers
+
+    def lock(self, client: int, fn_id: str, timeout: float) -> bool:
+        """Take the lock of a state for a client; reentrant. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._mutex:
+            entry = self._entries.setdefault(fn_id, _Entry(self._mutex))
+            while entry.owner is not None and entry.owner != client:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not entry.released.wait(remaining):
+                    if entry.owner is not None and entry.owner != client:
+                        return False
+            entry.owner = client
+            entry.depth += 1
+            return True
+
+    def unlock(self, client: int, fn_id: str) -> bool:
+        """Release one acquisition of a lock; False if the client does not hold it."""
+        with self._mutex:
+            entry = self._entries.get(fn_id)
+            if entry is None or entry.owner != client:
+                return False
+            entry.depth -= 1
+            if entry.depth == 0:
+                entry.owner = None
+                entry.released.notify()
+            return True
+
+    def release_all(self, client: int, fn_ids: Set[str]) -> None:
+        """Release the locks a disconnected client held."""
+        with self._mutex:
+            for fn_id in fn_ids:
+                entry = self._entries.get(fn_id)
+                if entry is not None and entry.owner == client:
+                    entry.owner = None
+                    entry.depth = 0
+                    entry.released.notify()
+
+    def read(self, fn_id: str, known_version: int) -> Tuple[int, Optional[bytes]]:
+        """Return the version of a state and the state unless the client has that version."""
+        with self._mutex:
+            entry = self._entries.get(fn_id)
+            if entry is None:
+                return 0, None
+            return entry.version, entry.state if entry.version != known_version else None
+
+    def version(self, fn_id: str) -> int:
+        """Return the version of a state, 0 if it does not exist."""
+        with self._mutex:
+            entry = self._entries.get(fn_id)
+            return entry.version if entry is not None else 0
+
+    def write(self, fn_id: str, state: bytes, expected_version: int) -> Optional[int]:
+        """Store a state if its version equals ``expected_version`` (-1: always); return the new version."""
+        with self._mutex:
+            entry = self._entries.setdefault(fn_id, _Entry(self._mutex))
+            if expected_version >= 0 and entry.version != expected_version:
+                return None
+            entry.version += 1
+            entry.state = state
+            self._dirty.add(fn_id)
+            return entry.version
+
+    # Persistence
+
+    def persist(self) -> bool:
+        """
+        Write the states changed since the last write to the database.
+
+        Returns:
+            True if successful, False otherwise
+        """
+        with self._persist_lock:
+            with self._mutex:
+                rows = [(fn_id, self._entries[fn_id].state, self._entries[fn_id].version)
+                        for fn_id in self._dirty]
+                self._dirty.clear()
+            if not rows:
+                return True
+            try:
+                with self._conn:
+                    self._conn.executemany(
+                        """
+                        INSERT INTO stateful_state (fn_id, state, version)
+                        VALUES (?, ?, ?)
+                        ON CONFLICT(fn_id) DO UPDATE SET
+                            state = excluded.state,
+                            version = excluded.version,
+                            updated_at = CURRENT_TIMESTAMP
+                        """,
+                        rows
+                    )
+            except sqlite3.Error as e:
+                logger.error(f"Error persisting {len(rows)} states to {self.db_path}: {e}")
+                with self._mutex:
+                    self._dirty.update(fn_id for fn_id, _, _ in rows)
+                return False
+            logger.debug(f"Persisted {len(rows)} states to {self.db_path}")
+            return True
+
+    def _flush_loop(self) -> None:
+        while not self._stopped.wait(self.flush_interval):
+            self.persist()
+
+    def server_close(self) -> None:
+        """Stop listening, write pending changes and close the database."""
+        super().server_close()
+        self._stopped.set()
+        self._flusher.join()
+        self.persist()
+        self._conn.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Serves the requests of one client connection."""
+
+    server: StateServer
+
+    def handle(self) -> None:
+        client = id(self)
+        held: Set[str] = set()
+        try:
+            while True:
+                try:
+                    header = read_exact(self.rfile, REQUEST.size)
+                except EOFError:
+                    return
+                length, op, number, timeout, key_length = REQUEST.unpack(header)
+                fn_id = read_exact(self.rfile, key_length).decode("utf-8")
+                payload = read_exact(self.rfile, length) if length else b""
+                status, number, payload = self._dispatch(client, held, op & ~FLAG_PERSIST,
+                                                         fn_id, number, timeout, payload)
+                if op & FLAG_PERSIST and status == STATUS_OK and not self.server.persist():
+                    status, payload = STATUS_ERROR, b"Could not persist the state"
+                self.wfile.write(RESPONSE.pack(len(payload), status, number) + payload)
+        except (OSError, EOFError) as e:
+            # Clients may exit without reading the reply to their last release
+            logger.debug(f"Connection closed: {e}")
+        finally:
+            self.server.release_all(client, held)
+
+    def _dispatch(self, client: int, held: Set[str], op: int, fn_id: str, number: int,
+                  timeout: float, payload: bytes) -> Tuple[int, int, bytes]:
+        """Run one request and return (status, number, payload) of the response."""
+        server = self.server
+        if op == OP_LOCK:
+            if not server.lock(client, fn_id, timeout):
+                return STATUS_CONFLICT, 0, b""
+            held.add(fn_id)
+            version, state = server.read(fn_id, number)
+            return STATUS_OK, version, state or b""
+        if op == OP_UNLOCK:
+            version = server.version(fn_id)
+            if number >= 0:
+                saved = server.write(fn_id, payload, number)
+                if saved is None:
+                    server.unlock(client, fn_id)
+                    return STATUS_CONFLICT, version, b""
+                version = saved
+            if not server.unlock(client, fn_id):
+                return STATUS_ERROR, version, f"Lock for {fn_id} is not held".encode("utf-8")
+            return STATUS_OK, version, b""
+        if op == OP_LOAD:
+            version, state = server.read(fn_id, number)
+            return STATUS_OK, version, state or b""
+        if op == OP_SAVE:
+            saved = server.write(fn_id, payload, number)
+            if saved is None:
+                return STATUS_CONFLICT, server.version(fn_id), b""
+            return STATUS_OK, saved, b""
+        if op == OP_VERSION:
+            return STATUS_OK, server.version(fn_id), b""
+        return STATUS_ERROR, 0, f"Unknown operation: {op}".encode("utf-8")
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def serve(socket_path: str, db_path: str = "statefulpy.db", flush_interval: float = 1.0) -> None:
+    """
+    Run a state server until it is interrupted or terminated.
+
+    Args:
+        socket_path: Path of the Unix socket to listen on
+        db_path: SQLite database the states are persisted to
+        flush_interval: Seconds between background writes of changed states
+    """
+    server = StateServer(socket_path, db_path=db_path, flush_interval=flush_interval)
+    main_thread = threading.current_thread() is threading.main_thread()
+    if main_thread:
+        # Shut down cleanly on SIGTERM too, writing pending changes
+        signal.signal(signal.SIGTERM, _interrupt)
+    logger.info(f"Serving states from {db_path} on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if main_thread:
+            # Do not let a second signal interrupt the final write
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+        server.server_close()
+        logger.info("State server stopped")
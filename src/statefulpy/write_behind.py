@@ -0,0 +1,189 @@
+"""
+Write-behind buffering of function state.
+
+In write-behind mode the state of a stateful function lives in process memory
+and is flushed to the backend by a background thread, either periodically or
+after a number of calls that changed the state, instead of being locked,
+loaded and saved on every call. This is only safe when a single process
+writes the state.
+"""
+import logging
+import threading
+from typing import Any, Dict, Optional, Set
+
+from statefulpy import metrics
+from statefulpy.backends.base import StateBackend
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    """Buffered state for a single state key."""
+
+    __slots__ = ("proxy", "lock", "pending")
+
+    def __init__(self, proxy: Any):
+        self.proxy = proxy
+        self.lock = threading.RLock()
+        # Top-level keys changed since the last successful flush
+        self.pending: Set[str] = set()
+
+    def collect(self) -> bool:
+        """Move the proxy's tracked changes into ``pending``; True if any were found."""
+        changed = self.proxy.changed_keys()
+        if not changed:
+            return False
+        self.proxy.mark_clean()
+        self.pending |= changed
+        return True
+
+
+class WriteBehindBuffer:
+    """
+    Holds the in-memory state of one stateful function and flushes it in the background.
+
+    Calls are serialized in-process with a per-key lock; the flusher thread takes
+    the same lock while it writes, so a flush never observes a half-finished call.
+    """
+
+    def __init__(self,
+                 backend: StateBackend,
+                 flush_interval: Optional[float] = 1.0,
+                 flush_every: Optional[int] = None,
+                 function_key: Optional[str] = None):
+        """
+        Initialize the write-behind buffer.
+
+        Args:
+            backend: Backend that buffered state is flushed to
+            flush_interval: Seconds between background flushes (None to disable)
+            flush_every: Flush early after this many calls changed the state
+                (None to disable)
+            function_key: Key of the stateful function, under which the
+                (de)serializations of its partitions are recorded
+        """
+        if flush_interval is not None and flush_interval <= 0:
+            raise ValueError("flush_interval must be positive or None")
+        if flush_every is not None and flush_every < 1:
+            raise ValueError("flush_every must be at least 1 or None")
+
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+        self.function_key = function_key
+        self._entries: Dict[str, _Entry] = {}
+        self._entries_lock = threading.Lock()
+        self._dirty_calls = 0
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, key: str, proxy: Any) -> None:
+        """Start buffering the state held by ``proxy`` under ``key``."""
+        with self._entries_lock:
+            if key not in self._entries:
+                self._entries[key] = _Entry(proxy)
+
+    def unregister(self, key: str) -> bool:
+        """
+        Stop buffering ``key`` unless it has changes that were not flushed yet.
+
+        Returns:
+            True if the key is no longer buffered, False if it was kept
+        """
+        with self._entries_lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return True
+            # A call or flush of this key is running
+            if not entry.lock.acquire(blocking=False):
+                return False
+            try:
+                if entry.pending or entry.proxy.changed_keys():
+                    return False
+                del self._entries[key]
+                return True
+            finally:
+                entry.lock.release()
+
+    def lock(self, key: str) -> threading.RLock:
+        """Return the in-process lock that serializes calls and flushes for ``key``."""
+        return self._entries[key].lock
+
+    def record_call(self, key: str) -> None:
+        """
+        Record that a call finished; must be called while holding ``lock(key)``.
+
+        If the call changed the state, the key is marked as pending and the
+        background flusher is started or woken up as needed.
+        """
+        if not self._entries[key].collect():
+            return
+
+        with self._entries_lock:
+            self._dirty_calls += 1
+            wake = self.flush_every is not None and self._dirty_calls >= self.flush_every
+            if self._thread is None and not self._stopped.is_set() and (
+                    self.flush_interval is not None or self.flush_every is not None):
+                self._thread = threading.Thread(
+                    target=self._run, name="statefulpy-write-behind", daemon=True
+                )
+                self._thread.start()
+        if wake:
+            self._wakeup.set()
+
+    def flush(self, key: Optional[str] = None) -> bool:
+        """
+        Write pending state to the backend.
+
+        Args:
+            key: Only flush this key (default: all keys)
+
+        Returns:
+            True if every pending state was written, False otherwise
+        """
+        with self._entries_lock:
+            self._dirty_calls = 0
+            if key is None:
+                items = list(self._entries.items())
+            else:
+                items = [(key, self._entries[key])] if key in self._entries else []
+
+        success = True
+        with metrics.function_key(self.function_key):
+            for fn_id, entry in items:
+                with entry.lock:
+                    # Changes made outside of a call are picked up here as well
+                    entry.collect()
+                    if not entry.pending:
+                        continue
+                    try:
+                        saved, _ = self.backend.save_state_versioned(
+                            fn_id, entry.proxy.get_state_dict(), changed=set(entry.pending)
+                        )
+                    except Exception as e:
+                        logger.error(f"Error flushing state for {fn_id}: {e}")
+                        saved = False
+                    if saved:
+                        entry.pending.clear()
+                    else:
+                        success = False
+        return success
+
+    def _run(self) -> None:
+        """Background flusher loop."""
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            self.flush()
+
+    def close(self) -> bool:
+        """Stop the background flusher and write any remaining pending state."""
+        self._stopped.set()
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        return self.flush()
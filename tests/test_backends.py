@@ -1,8 +1,14 @@
 """
 Tests for backend implementations.
 """
+import glob
+import multiprocessing
 import os
+import socket
+import sqlite3
+import sys
 import tempfile
+import threading
 import time
 import unittest
 from unittest import mock
@@ -10,7 +16,10 @@ from unittest import mock
 import pytest
 
 from statefulpy.backends.base import get_backend
+from statefulpy.backends.log import LogBackend
+from statefulpy.backends.memory import MemoryBackend
 from statefulpy.backends.sqlite import SQLiteBackend
+from statefulpy.serializers.compressed_serializer import MAGIC
 
 
 class TestSQLiteBackend(unittest.TestCase):
@@ -25,8 +34,9 @@ class TestSQLiteBackend(unittest.TestCase):
     def tearDown(self):
         """Clean up test environment."""
         self.backend.close()
-        if os.path.exists(self.temp_db.name):
-            os.unlink(self.temp_db.name)
+        for path in [self.temp_db.name] + glob.glob(f"{self.temp_db.name}*.lock"):
+            if os.path.exists(path):
+                os.unlink(path)
     
     def test_save_and_load_state(self):
         """Test saving and loading state."""
@@ -77,12 +87,696 @@ class TestSQLiteBackend(unittest.TestCase):
         # Release again - should be fully unlocked
         second_release = self.backend.release_lock(fn_id)
         self.assertTrue(second_release)
+    
+    def test_lock_file_names(self):
+        """Test that identifiers which are not valid file names can be locked."""
+        fn_id = "module.func[user/1]"
+        self.assertTrue(self.backend.acquire_lock(fn_id))
+        lock_files = glob.glob(f"{self.temp_db.name}*.lock")
+        self.assertEqual(len(lock_files), 1)
+        self.assertEqual(os.path.dirname(lock_files[0]), os.path.dirname(self.temp_db.name))
+        self.assertTrue(self.backend.release_lock(fn_id))
+    
+    def test_transaction_locking(self):
+        """Test that saves under a transaction lock are committed on release."""
+        self.backend.close()
+        self.backend = SQLiteBackend(db_path=self.temp_db.name, locking="transaction")
+        fn_id = "test_transaction"
+        
+        self.assertTrue(self.backend.acquire_lock(fn_id))
+        self.assertTrue(self.backend.acquire_lock(fn_id))
+        self.assertEqual(self.backend.save_state_versioned(fn_id, {"n": 1}), (True, 1))
+        self.assertEqual(self.backend.load_state(fn_id), {"n": 1})
+        # A failed write only undoes itself, not the earlier save
+        self.assertEqual(self.backend.compare_and_swap(fn_id, {"n": 2}, 0), (False, None))
+        self.assertTrue(self.backend.release_lock(fn_id))
+        
+        other = sqlite3.connect(self.temp_db.name)
+        try:
+            query = "SELECT COUNT(*) FROM stateful_state"
+            self.assertEqual(other.execute(query).fetchone(), (0,))
+            self.assertTrue(self.backend.release_lock(fn_id))
+            self.assertEqual(other.execute(query).fetchone(), (1,))
+            # No lock rows or lock files are written in this mode
+            self.assertEqual(other.execute("SELECT COUNT(*) FROM stateful_locks").fetchone(), (0,))
+        finally:
+            other.close()
+        self.assertEqual(glob.glob(f"{self.temp_db.name}*.lock"), [])
+        self.assertEqual(self.backend.load_state_versioned(fn_id), ({"n": 1}, 1))
+    
+    def test_transaction_locking_excludes_threads(self):
+        """Test that transaction locks serialize read-modify-write cycles across threads."""
+        self.backend.close()
+        self.backend = SQLiteBackend(db_path=self.temp_db.name, locking="transaction")
+        fn_id = "test_transaction_threads"
+        
+        def increment():
+            for _ in range(20):
+                self.assertTrue(self.backend.acquire_lock(fn_id))
+                try:
+                    state = self.backend.load_state(fn_id) or {"n": 0}
+                    state["n"] += 1
+                    self.backend.save_state(fn_id, state)
+                finally:
+                    self.backend.release_lock(fn_id)
+            self.backend.close()
+        
+        threads = [threading.Thread(target=increment) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.backend.load_state_versioned(fn_id), ({"n": 80}, 80))
+    
+    def test_close_keeps_shared_transaction(self):
+        """Test that closing a backend keeps the transaction of another one sharing its connection."""
+        holder = SQLiteBackend(db_path=self.temp_db.name, locking="transaction")
+        other = SQLiteBackend(db_path=self.temp_db.name, locking="transaction")
+        self.assertTrue(holder.acquire_lock("shared_txn"))
+        self.assertTrue(holder.save_state("shared_txn", {"n": 1}))
+        other.close()
+        self.assertTrue(holder.release_lock("shared_txn"))
+        self.assertEqual(holder.load_state("shared_txn"), {"n": 1})
+        holder.close()
+    
+    def test_connections_per_database(self):
+        """Test that backends for different files do not share a connection."""
+        other_db = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
+        other_db.close()
+        other = SQLiteBackend(db_path=other_db.name)
+        try:
+            self.backend.save_state("shared_id", {"db": "first"})
+            other.save_state("shared_id", {"db": "second"})
+            other.close()
+            self.assertEqual(self.backend.load_state("shared_id"), {"db": "first"})
+            self.assertEqual(other.load_state("shared_id"), {"db": "second"})
+        finally:
+            other.close()
+            os.unlink(other_db.name)
+    
+    def test_connection_pragmas(self):
+        """Test that tuning options are applied to the backend's connections."""
+        self.backend.close()
+        self.backend = SQLiteBackend(
+            db_path=self.temp_db.name, synchronous="normal", cache_size=-4096,
+            mmap_size=1 << 20, temp_store="memory", busy_timeout=250, wal_autocheckpoint=0
+        )
+        conn = self.backend._get_connection()
+        pragmas = {name: conn.execute(f"PRAGMA {name}").fetchone()[0]
+                   for name in ("journal_mode", "synchronous", "cache_size", "mmap_size",
+                                "temp_store", "busy_timeout", "wal_autocheckpoint")}
+        self.assertEqual(pragmas, {
+            "journal_mode": "wal", "synchronous": 1, "cache_size": -4096, "mmap_size": 1 << 20,
+            "temp_store": 2, "busy_timeout": 250, "wal_autocheckpoint": 0,
+        })
+        
+        # Backends with other settings get their own connections
+        default = SQLiteBackend(db_path=self.temp_db.name)
+        self.assertIsNot(default._get_connection(), conn)
+        self.assertIs(SQLiteBackend(db_path=self.temp_db.name)._get_connection(),
+                      default._get_connection())
+        default.close()
+        
+        with self.assertRaises(ValueError):
+            SQLiteBackend(db_path=self.temp_db.name, synchronous="sometimes")
+        with self.assertRaises(ValueError):
+            SQLiteBackend(db_path=self.temp_db.name, mmap_size=-1)
+    
+    def test_durability_sets_synchronous(self):
+        """Test that durability levels select the synchronous PRAGMA unless it is given."""
+        expected = {"strict": 2, "normal": 1, "relaxed": 0}
+        for durability, synchronous in expected.items():
+            backend = SQLiteBackend(db_path=self.temp_db.name, durability=durability)
+            conn = backend._get_connection()
+            self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], synchronous)
+            backend.close()
+        
+        backend = SQLiteBackend(db_path=self.temp_db.name, durability="relaxed", synchronous="FULL")
+        self.assertEqual(backend._get_connection().execute("PRAGMA synchronous").fetchone()[0], 2)
+        backend.close()
+        
+        with self.assertRaises(ValueError):
+            SQLiteBackend(db_path=self.temp_db.name, durability="paranoid")
+    
+    def test_group_commit(self):
+        """Test that saves from many threads are committed through the writer thread."""
+        self.backend.close()
+        self.backend = SQLiteBackend(db_path=self.temp_db.name, group_commit=True,
+                                     group_commit_delay=0.001)
+        results = []
+        
+        def save(index):
+            for n in range(10):
+                results.append(self.backend.save_state_versioned(f"fn{index}", {"n": n}))
+        
+        threads = [threading.Thread(target=save, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(all(saved for saved, _ in results))
+        for index in range(4):
+            self.assertEqual(self.backend.load_state_versioned(f"fn{index}"), ({"n": 9}, 10))
+        
+        # A conflicting write in a batch is rolled back on its own
+        self.assertEqual(self.backend.compare_and_swap("fn0", {"n": -1}, 3), (False, None))
+        self.assertEqual(self.backend.compare_and_swap("fn0", {"n": 10}, 10), (True, 11))
+        
+        # Closing stops the writer; the next save starts a new one
+        self.backend.close()
+        self.assertEqual(self.backend.save_state_versioned("fn1", {"n": 10}), (True, 11))
+        
+        with self.assertRaises(ValueError):
+            SQLiteBackend(db_path=self.temp_db.name, group_commit=True, locking="transaction")
+    
+    def test_compressed_serializer(self):
+        """Test that large states are compressed and uncompressed states still load."""
+        plain = SQLiteBackend(db_path=self.temp_db.name, serializer="json")
+        plain.save_state("old_function", {"items": ["x"] * 1000})
+        plain.close()
+        
+        backend = SQLiteBackend(db_path=self.temp_db.name, serializer="json+zlib")
+        try:
+            self.assertEqual(backend.load_state("old_function"), {"items": ["x"] * 1000})
+            self.assertTrue(backend.save_state("large", {"items": ["x"] * 1000}))
+            self.assertTrue(backend.save_state("small", {"counter": 1}))
+            self.assertEqual(backend.load_state("large"), {"items": ["x"] * 1000})
+            self.assertEqual(backend.load_state("small"), {"counter": 1})
+        finally:
+            backend.close()
+        
+        with sqlite3.connect(self.temp_db.name) as conn:
+            stored = dict(conn.execute("SELECT fn_id, state FROM stateful_state"))
+        self.assertTrue(stored["large"].startswith(MAGIC))
+        self.assertLess(len(stored["large"]), len(stored["old_function"]))
+        self.assertFalse(stored["small"].startswith(MAGIC))
+        
+        with self.assertRaises(ValueError):
+            SQLiteBackend(db_path=self.temp_db.name, serializer="json+snappy")
+    
+    def test_streamed_states(self):
+        """Test that large states are streamed to and from their blob."""
+        state = {"items": ["x" * 100] * 1000, "counter": 1}
+        for serializer in ("pickle", "json"):
+            with self.subTest(serializer=serializer):
+                fn_id = f"large_{serializer}"
+                backend = SQLiteBackend(db_path=self.temp_db.name, serializer=serializer,
+                                        stream_threshold=1024)
+                plain = SQLiteBackend(db_path=self.temp_db.name, serializer=serializer)
+                try:
+                    self.assertTrue(backend.save_state(fn_id, state))
+                    self.assertTrue(backend.save_state("small", {"counter": 1}))
+                    self.assertEqual(backend.load_state(fn_id), state)
+                    self.assertEqual(backend.load_state("small"), {"counter": 1})
+                    # Streamed blobs are stored exactly as serialized
+                    self.assertEqual(plain.load_state(fn_id), state)
+                    self.assertTrue(plain.save_state(fn_id, dict(state, counter=2)))
+                    self.assertEqual(backend.load_state_versioned(fn_id),
+                                     (dict(state, counter=2), 2))
+                    self.assertEqual(
+                        backend.compare_and_swap(fn_id, dict(state, counter=3), 2), (True, 3)
+                    )
+                    self.assertEqual(plain.load_state(fn_id), dict(state, counter=3))
+                finally:
+                    backend.close()
+                    plain.close()
+    
+    def test_state_versions(self):
+        """Test that every save bumps the state version."""
+        fn_id = "test_versions"
+        self.assertEqual(self.backend.get_version(fn_id), 0)
+        self.assertEqual(self.backend.load_state_versioned(fn_id), (None, 0))
+        
+        self.assertEqual(self.backend.save_state_versioned(fn_id, {"n": 1}), (True, 1))
+        self.assertTrue(self.backend.save_state(fn_id, {"n": 2}))
+        self.assertEqual(self.backend.get_version(fn_id), 2)
+        self.assertEqual(self.backend.load_state_versioned(fn_id), ({"n": 2}, 2))
+    
+    def test_compare_and_swap(self):
+        """Test conditional saves against the stored version."""
+        fn_id = "test_cas"
+        self.assertEqual(self.backend.compare_and_swap(fn_id, {"n": 1}, 0), (True, 1))
+        self.assertEqual(self.backend.compare_and_swap(fn_id, {"n": 2}, 0), (False, None))
+        self.assertEqual(self.backend.compare_and_swap(fn_id, {"n": 2}, 1), (True, 2))
+        self.assertEqual(self.backend.load_state_versioned(fn_id), ({"n": 2}, 2))
+    
+    def test_version_column_migration(self):
+        """Test that databases without the version column are upgraded."""
+        self.backend.close()
+        conn = sqlite3.connect(self.temp_db.name)
+        conn.execute("DROP TABLE stateful_state")
+        conn.execute("CREATE TABLE stateful_state (fn_id TEXT PRIMARY KEY, state BLOB, "
+                     "updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+        conn.commit()
+        conn.close()
+        
+        self.backend = SQLiteBackend(db_path=self.temp_db.name)
+        self.assertEqual(self.backend.save_state_versioned("migrated", {"n": 1}), (True, 1))
+    
+    def test_fields_layout(self):
+        """Test that the 'fields' layout writes only the changed keys."""
+        self.backend.close()
+        self.backend = SQLiteBackend(db_path=self.temp_db.name, layout="fields")
+        fn_id = "test_fields"
+        self.assertEqual(self.backend.save_state_versioned(fn_id, {"a": 1, "b": [1, 2]}), (True, 1))
+        
+        # Only 'a' is written; 'b' is left as stored and 'c' is deleted
+        self.assertEqual(
+            self.backend.save_state_versioned(fn_id, {"a": 2, "b": "ignored"}, changed={"a", "c"}),
+            (True, 2)
+        )
+        self.assertEqual(self.backend.load_state_versioned(fn_id), ({"a": 2, "b": [1, 2]}, 2))
+        self.assertEqual(self.backend.load_fields(fn_id, ["b", "missing"]), {"b": [1, 2]})
+        
+        self.assertEqual(self.backend.compare_and_swap(fn_id, {"a": 3}, 2, changed={"a", "b"}), (True, 3))
+        self.assertEqual(self.backend.load_state(fn_id), {"a": 3})
+    
+    def test_fields_layout_upgrades_blobs(self):
+        """Test that states saved as blobs are rewritten as fields on the next save."""
+        fn_id = "test_upgrade"
+        self.backend.save_state(fn_id, {"a": 1, "b": 2})
+        self.backend.close()
+        self.backend = SQLiteBackend(db_path=self.temp_db.name, layout="fields")
+        
+        self.assertEqual(self.backend.load_fields(fn_id, ["a"]), {"a": 1})
+        self.backend.save_state_versioned(fn_id, {"a": 5, "b": 2}, changed={"a"})
+        self.assertEqual(self.backend.load_state(fn_id), {"a": 5, "b": 2})
+        
+        # The 'blob' layout can still read states stored as fields
+        self.backend.close()
+        self.backend = SQLiteBackend(db_path=self.temp_db.name)
+        self.assertEqual(self.backend.load_state(fn_id), {"a": 5, "b": 2})
+
+
+class TestMemoryBackend(unittest.TestCase):
+    """Test suite for the in-memory backend."""
+    
+    def setUp(self):
+        """Set up test environment."""
+        self.name = f"test-{self.id()}"
+        self.backend = MemoryBackend(name=self.name)
+    
+    def tearDown(self):
+        """Clean up test environment."""
+        self.backend.clear()
+        self.backend.close()
+    
+    def test_save_and_load_state(self):
+        """Test saving, loading and versioning states."""
+        self.assertEqual(self.backend.load_state_versioned("fn"), (None, 0))
+        state = {"counter": 1, "items": [1, 2]}
+        self.assertEqual(self.backend.save_state_versioned("fn", state), (True, 1))
+        state["items"].append(3)
+        # The store holds a copy, not the caller's objects
+        self.assertEqual(self.backend.load_state_versioned("fn"), ({"counter": 1, "items": [1, 2]}, 1))
+        
+        other = get_backend("memory", name=self.name)
+        self.assertEqual(other.load_state("fn"), {"counter": 1, "items": [1, 2]})
+        self.assertEqual(other.compare_and_swap("fn", {"counter": 2}, 0), (False, None))
+        self.assertEqual(other.compare_and_swap("fn", {"counter": 2}, 1), (True, 2))
+        self.assertEqual(self.backend.get_version("fn"), 2)
+    
+    def test_fields_layout(self):
+        """Test that the 'fields' layout serializes only changed keys."""
+        backend = MemoryBackend(name=self.name, layout="fields")
+        backend.save_state_versioned("fn", {"a": 1, "b": 2, "c": 3})
+        with mock.patch.object(backend.serializer, "serialize",
+                               wraps=backend.serializer.serialize) as serialize:
+            self.assertEqual(
+                backend.save_state_versioned("fn", {"a": 10, "b": 2}, changed={"a", "c"}), (True, 2)
+            )
+        serialize.assert_called_once_with({"a": 10})
+        self.assertEqual(backend.load_state("fn"), {"a": 10, "b": 2})
+        self.assertEqual(backend.load_fields("fn", ["b", "missing"]), {"b": 2})
+    
+    def test_locks_exclude_threads(self):
+        """Test that locks are reentrant and exclude other threads."""
+        self.assertTrue(self.backend.acquire_lock("fn"))
+        self.assertTrue(self.backend.acquire_lock("fn"))
+        results = []
+        thread = threading.Thread(target=lambda: results.append(
+            self.backend.acquire_lock("fn", timeout=0.05)))
+        thread.start()
+        thread.join()
+        self.assertEqual(results, [False])
+        self.assertTrue(self.backend.release_lock("fn"))
+        self.assertTrue(self.backend.release_lock("fn"))
+        self.assertFalse(self.backend.release_lock("fn"))
+    
+    def test_snapshot_and_restore(self):
+        """Test that a store is restored from its snapshot."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "state.json")
+            backend = MemoryBackend(name=f"{self.name}-a", snapshot_path=path, snapshot_on_exit=False)
+            fields = MemoryBackend(name=f"{self.name}-a", snapshot_path=path,
+                                   snapshot_on_exit=False, layout="fields")
+            backend.save_state("blob", {"n": 1})
+            fields.save_state("fields", {"a": 1, "b": [2]})
+            self.assertTrue(backend.snapshot())
+            
+            restored = MemoryBackend(name=f"{self.name}-b", snapshot_path=path, snapshot_on_exit=False)
+            self.assertEqual(restored.load_state_versioned("blob"), ({"n": 1}, 1))
+            self.assertEqual(restored.load_state("fields"), {"a": 1, "b": [2]})
+            
+            with self.assertRaises(ValueError):
+                MemoryBackend(name=f"{self.name}-a", snapshot_path=os.path.join(directory, "other"))
+            with open(path, "w") as f:
+                f.write("not json")
+            backend.save_state("blob", {"n": 2})
+            backend.close()
+            fields.close()
+            # Closing the last backend of a store takes a final snapshot
+            reopened = MemoryBackend(name=f"{self.name}-a", snapshot_path=path, snapshot_on_exit=False)
+            self.assertEqual(reopened.load_state_versioned("blob"), ({"n": 2}, 2))
+            reopened.close()
+            restored.close()
+            
+            with open(path, "w") as f:
+                f.write("not json")
+            with self.assertRaises(ValueError), self.assertLogs("statefulpy.backends.memory"):
+                MemoryBackend(name=f"{self.name}-c", snapshot_path=path)
+    
+    def test_periodic_snapshots(self):
+        """Test that changed states are snapshotted in the background."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "state.json")
+            backend = MemoryBackend(name=self.name + "-periodic", snapshot_path=path,
+                                    snapshot_interval=0.01, snapshot_on_exit=False)
+            backend.save_state("fn", {"n": 1})
+            deadline = time.monotonic() + 5
+            while not os.path.exists(path) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            restored = MemoryBackend(name=self.name + "-restored", snapshot_path=path,
+                                     snapshot_on_exit=False)
+            self.assertEqual(restored.load_state("fn"), {"n": 1})
+            backend.close()
+            restored.close()
+
+
+class TestLogBackend(unittest.TestCase):
+    """Test suite for the log-structured backend."""
+    
+    def setUp(self):
+        """Set up test environment."""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "log")
+        self.backend = self._open()
+    
+    def tearDown(self):
+        """Clean up test environment."""
+        self.backend.close()
+        self.temp_dir.cleanup()
+    
+    def _open(self, **kwargs):
+        kwargs.setdefault("segment_size", 1024)
+        return LogBackend(path=self.path, serializer="json", compact_interval=None, **kwargs)
+    
+    def _segments(self):
+        return sorted(name for name in os.listdir(self.path) if name.endswith(".log"))
+    
+    def test_save_and_load_state(self):
+        """Test saving, loading and versioning states."""
+        self.assertEqual(self.backend.load_state_versioned("fn"), (None, 0))
+        self.assertEqual(self.backend.save_state_versioned("fn", {"counter": 1}), (True, 1))
+        self.assertEqual(self.backend.load_state_versioned("fn"), ({"counter": 1}, 1))
+        self.assertEqual(self.backend.compare_and_swap("fn", {"counter": 2}, 0), (False, None))
+        self.assertEqual(self.backend.compare_and_swap("fn", {"counter": 2}, 1), (True, 2))
+        self.assertEqual(get_backend("log", path=self.path, serializer="json",
+                                     segment_size=1024, compact_interval=None).get_version("fn"), 2)
+    
+    def test_deltas(self):
+        """Test that changed keys are appended as deltas and replayed on load."""
+        self.backend.save_state("fn", {"a": 1, "b": "x" * 100})
+        size = os.path.getsize(os.path.join(self.path, self._segments()[-1]))
+        self.assertEqual(
+            self.backend.save_state_versioned("fn", {"a": 2, "b": "x" * 100}, changed={"a", "c"}), (True, 2)
+        )
+        self.assertLess(os.path.getsize(os.path.join(self.path, self._segments()[-1])) - size, 100)
+        self.assertEqual(self.backend.load_state_versioned("fn"), ({"a": 2, "b": "x" * 100}, 2))
+        
+        # A delta for a new state is written in full
+        self.assertEqual(self.backend.save_state_versioned("new", {"a": 1}, changed={"a"}), (True, 1))
+        self.assertEqual(self.backend.load_state("new"), {"a": 1})
+        
+        # Chains of deltas are bounded by writing the state in full again
+        for i in range(40):
+            self.backend.save_state_versioned("fn", {"a": i, "b": "x" * 100}, changed={"a"})
+        self.assertLessEqual(self.backend._log.chain_length("fn"), self.backend.max_deltas + 1)
+        self.assertEqual(self.backend.load_state("fn"), {"a": 39, "b": "x" * 100})
+    
+    def test_recovery(self):
+        """Test that reopening replays the log and truncates a torn record."""
+        for i in range(50):
+            self.backend.save_state_versioned(f"fn{i % 3}", {"n": i, "pad": "x" * 50}, changed={"n"})
+        self.backend.close()
+        self.assertGreater(len(self._segments()), 1)
+        with open(os.path.join(self.path, self._segments()[-1]), "ab") as f:
+            f.write(b"\x01\x02torn")
+        
+        with self.assertLogs("statefulpy.backends.log", level="WARNING"):
+            self.backend = self._open()
+        self.assertEqual(self.backend.load_state_versioned("fn2"), ({"n": 47, "pad": "x" * 50}, 16))
+        self.assertEqual(self.backend.save_state_versioned("fn2", {"n": 50}), (True, 17))
+        
+        with self.assertRaises(ValueError):
+            self._open(segment_size=2048)
+    
+    def test_compaction(self):
+        """Test that compaction keeps only live records and survives reopening."""
+        for i in range(100):
+            self.backend.save_state(f"fn{i % 2}", {"n": i, "pad": "x" * 50})
+        self.assertGreater(len(self._segments()), 5)
+        self.assertGreater(self.backend._log.garbage_ratio(), 0.9)
+        
+        self.assertTrue(self.backend.compact())
+        self.assertLessEqual(len(self._segments()), 2)
+        self.assertEqual(self.backend.load_state("fn0"), {"n": 98, "pad": "x" * 50})
+        self.assertEqual(self.backend.load_state_versioned("fn1"), ({"n": 99, "pad": "x" * 50}, 50))
+        
+        self.backend.close()
+        self.backend = self._open()
+        self.assertEqual(self.backend.load_state_versioned("fn1"), ({"n": 99, "pad": "x" * 50}, 50))
+    
+    def test_concurrent_saves(self):
+        """Test that threads saving with group fsync all reach the log."""
+        self.backend.close()
+        self.backend = self._open(sync="always", segment_size=4096)
+        
+        def increment(fn_id):
+            for i in range(50):
+                self.assertTrue(self.backend.save_state_versioned(fn_id, {"n": i + 1}, changed={"n"})[0])
+        
+        threads = [threading.Thread(target=increment, args=(f"fn{i}",)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(self.backend.compact())
+        for i in range(4):
+            self.assertEqual(self.backend.load_state_versioned(f"fn{i}"), ({"n": 50}, 50))
+        self.assertTrue(self.backend.acquire_lock("fn0"))
+        self.assertTrue(self.backend.release_lock("fn0"))
+        self.assertFalse(self.backend.release_lock("fn0"))
+    
+    def test_locks_shared_by_backends(self):
+        """Test that backends on the same log directory exclude each other."""
+        other = self._open()
+        try:
+            self.assertTrue(self.backend.acquire_lock("fn"))
+            results = []
+            thread = threading.Thread(target=lambda: results.append(other.acquire_lock("fn", timeout=0.05)))
+            thread.start()
+            thread.join()
+            self.assertEqual(results, [False])
+            self.assertTrue(self.backend.release_lock("fn"))
+            self.assertTrue(other.acquire_lock("fn", timeout=0))
+            self.assertTrue(other.release_lock("fn"))
+        finally:
+            other.close()
+
+
+# The shared-memory backend uses fcntl record locks
+try:
+    from statefulpy.backends.shm import SharedMemoryBackend
+    shm_available = True
+except ImportError:
+    shm_available = False
+
+
+def _shm_increment(name, fn_id, calls):
+    """Increment a counter under the backend lock; runs in a child process."""
+    backend = SharedMemoryBackend(name=name, serializer="json")
+    for _ in range(calls):
+        assert backend.acquire_lock(fn_id)
+        state = backend.load_state(fn_id) or {"n": 0}
+        state["n"] += 1
+        assert backend.save_state(fn_id, state)
+        assert backend.release_lock(fn_id)
+    backend.close()
+
+
+@pytest.mark.skipif(not shm_available, reason="The shared-memory backend requires POSIX")
+class TestSharedMemoryBackend(unittest.TestCase):
+    """Test suite for the shared-memory backend."""
+    
+    def setUp(self):
+        """Set up test environment."""
+        self.name = f"spytest{os.getpid()}_{self._testMethodName[-20:]}"
+        self.backend = SharedMemoryBackend(name=self.name, serializer="json",
+                                           size=64 * 1024, slots=16)
+    
+    def tearDown(self):
+        """Clean up test environment."""
+        self.backend.unlink()
+    
+    def test_save_and_load_state(self):
+        """Test saving, loading and versioning states."""
+        self.assertEqual(self.backend.load_state_versioned("fn"), (None, 0))
+        self.assertEqual(self.backend.save_state_versioned("fn", {"counter": 1}), (True, 1))
+        self.assertEqual(self.backend.load_state_versioned("fn"), ({"counter": 1}, 1))
+        self.assertEqual(self.backend.compare_and_swap("fn", {"counter": 2}, 0), (False, None))
+        self.assertEqual(self.backend.compare_and_swap("fn", {"counter": 2}, 1), (True, 2))
+        self.assertEqual(self.backend.get_version("fn"), 2)
+    
+    def test_arena_compaction(self):
+        """Test that growing states reuse the space of the blocks they left."""
+        for i in range(50):
+            self.assertTrue(self.backend.save_state(f"fn{i % 5}", {"data": "x" * (i * 200)}))
+        for i in range(45, 50):
+            self.assertEqual(self.backend.load_state(f"fn{i % 5}"), {"data": "x" * (i * 200)})
+        
+        with self.assertLogs("statefulpy.backends.shm", level="ERROR"):
+            self.assertFalse(self.backend.save_state("fn0", {"data": "x" * 100000}))
+        self.assertEqual(self.backend.load_state("fn0"), {"data": "x" * 9000})
+    
+    def test_locks_exclude_threads(self):
+        """Test that locks are reentrant and exclude other threads."""
+        self.assertTrue(self.backend.acquire_lock("fn"))
+        self.assertTrue(self.backend.acquire_lock("fn"))
+        results = []
+        thread = threading.Thread(target=lambda: results.append(
+            self.backend.acquire_lock("fn", timeout=0.05)))
+        thread.start()
+        thread.join()
+        self.assertEqual(results, [False])
+        self.assertTrue(self.backend.release_lock("fn"))
+        self.assertTrue(self.backend.release_lock("fn"))
+        self.assertFalse(self.backend.release_lock("fn"))
+    
+    def test_processes_share_state(self):
+        """Test that processes update a shared state under the lock."""
+        context = multiprocessing.get_context("fork" if sys.platform == "linux" else "spawn")
+        workers = [context.Process(target=_shm_increment, args=(self.name, "counter", 200))
+                   for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual([worker.exitcode for worker in workers], [0, 0, 0])
+        self.assertEqual(self.backend.load_state_versioned("counter"), ({"n": 600}, 600))
+
+
+# The state server listens on a Unix domain socket
+server_available = hasattr(socket, "AF_UNIX")
+if server_available:
+    from statefulpy.backends.server import ServerBackend
+    from statefulpy.server import StateServer
+
+
+@pytest.mark.skipif(not server_available, reason="The state server requires Unix domain sockets")
+class TestServerBackend(unittest.TestCase):
+    """Test suite for the state server and its client backend."""
+    
+    def setUp(self):
+        """Set up test environment."""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.temp_dir.name, "state.sock")
+        self.db_path = os.path.join(self.temp_dir.name, "state.db")
+        self._start()
+        self.backend = ServerBackend(socket_path=self.socket_path, serializer="json")
+    
+    def tearDown(self):
+        """Clean up test environment."""
+        self.backend.close()
+        self._stop()
+        self.temp_dir.cleanup()
+    
+    def _start(self):
+        self.server = StateServer(self.socket_path, db_path=self.db_path, flush_interval=60)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+    
+    def _stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+    
+    def test_save_and_load_state(self):
+        """Test saving, loading and versioning states."""
+        self.assertEqual(self.backend.load_state_versioned("fn"), (None, 0))
+        self.assertEqual(self.backend.save_state_versioned("fn", {"counter": 1}), (True, 1))
+        self.assertEqual(self.backend.load_state_versioned("fn"), ({"counter": 1}, 1))
+        self.assertEqual(self.backend.compare_and_swap("fn", {"counter": 2}, 0), (False, None))
+        self.assertEqual(self.backend.compare_and_swap("fn", {"counter": 2}, 1), (True, 2))
+        self.assertEqual(get_backend("server", socket_path=self.socket_path,
+                                     serializer="json").get_version("fn"), 2)
+    
+    def test_one_round_trip_under_lock(self):
+        """Test that the lock response serves the load and the save rides on the release."""
+        other = ServerBackend(socket_path=self.socket_path, serializer="json")
+        self.addCleanup(other.close)
+        other.save_state("fn", {"n": 1})
+        
+        self.assertTrue(self.backend.acquire_lock("fn"))
+        with mock.patch.object(self.backend, "_request") as request:
+            self.assertEqual(self.backend.get_version("fn"), 1)
+            self.assertEqual(self.backend.load_state_versioned("fn"), ({"n": 1}, 1))
+            self.assertEqual(self.backend.save_state_versioned("fn", {"n": 2}), (True, 2))
+            self.assertEqual(self.backend.get_version("fn"), 2)
+            self.assertTrue(self.backend.release_lock("fn"))
+        request.assert_not_called()
+        self.assertFalse(self.backend.release_lock("fn"))
+        
+        self.assertEqual(other.load_state_versioned("fn"), ({"n": 2}, 2))
+        self.assertTrue(other.acquire_lock("fn"))
+        self.assertFalse(self.backend.acquire_lock("fn", timeout=0.05))
+        self.assertTrue(other.release_lock("fn"))
+        self.assertTrue(self.backend.acquire_lock("fn"))
+        self.assertTrue(self.backend.release_lock("fn"))
+    
+    def test_disconnect_releases_locks(self):
+        """Test that the server releases the locks of a closed connection."""
+        other = ServerBackend(socket_path=self.socket_path, serializer="json")
+        self.assertTrue(other.acquire_lock("fn"))
+        other.close()
+        self.assertTrue(self.backend.acquire_lock("fn", timeout=5))
+        self.assertTrue(self.backend.release_lock("fn"))
+    
+    def test_persistence(self):
+        """Test that states are written to SQLite and loaded by a restarted server."""
+        strict = ServerBackend(socket_path=self.socket_path, serializer="json", durability="strict")
+        self.addCleanup(strict.close)
+        self.assertTrue(strict.acquire_lock("strict"))
+        strict.save_state("strict", {"n": 1})
+        self.assertTrue(strict.release_lock("strict"))
+        # Strict saves are in the database before the release returns
+        self.assertEqual(SQLiteBackend(db_path=self.db_path, serializer="json").load_state("strict"),
+                         {"n": 1})
+        
+        self.backend.save_state("fn", {"n": 5})
+        self.backend.close()
+        self._stop()
+        self.assertEqual(SQLiteBackend(db_path=self.db_path, serializer="json").load_state("fn"), {"n": 5})
+        self._start()
+        self.assertEqual(self.backend.load_state_versioned("fn"), ({"n": 5}, 1))
+        with self.assertRaises(ValueError):
+            StateServer(self.socket_path, db_path=self.db_path)
 
 
 # Skip Redis tests if redis is not installed or not running
 try:
     import redis
-    from statefulpy.backends.redis import RedisBackend
+    from statefulpy.backends.redis import _LOCK_AND_LOAD_SCRIPT, RedisBackend
     
     # Try to connect to Redis
     r = redis.Redis()
@@ -157,3 +851,383 @@ class TestRedisBackend(unittest.TestCase):
         # Release again - should be fully unlocked
         second_release = self.backend.release_lock(fn_id)
         self.assertTrue(second_release)
+    
+    def test_state_versions(self):
+        """Test that every save bumps the state version."""
+        fn_id = "test_versions"
+        self.assertEqual(self.backend.get_version(fn_id), 0)
+        self.assertEqual(self.backend.load_state_versioned(fn_id), (None, 0))
+        
+        self.assertEqual(self.backend.save_state_versioned(fn_id, {"n": 1}), (True, 1))
+        self.assertTrue(self.backend.save_state(fn_id, {"n": 2}))
+        self.assertEqual(self.backend.get_version(fn_id), 2)
+        self.assertEqual(self.backend.load_state_versioned(fn_id), ({"n": 2}, 2))
+    
+    def test_compare_and_swap(self):
+        """Test conditional saves against the stored version."""
+        fn_id = "test_cas"
+        self.assertEqual(self.backend.compare_and_swap(fn_id, {"n": 1}, 0), (True, 1))
+        self.assertEqual(self.backend.compare_and_swap(fn_id, {"n": 2}, 0), (False, None))
+        self.assertEqual(self.backend.compare_and_swap(fn_id, {"n": 2}, 1), (True, 2))
+        self.assertEqual(self.backend.load_state_versioned(fn_id), ({"n": 2}, 2))
+    
+    def test_fields_layout(self):
+        """Test that the 'fields' layout writes only the changed keys."""
+        fn_id = "test_fields"
+        self.backend.save_state(fn_id, {"a": 1, "b": 2})
+        backend = RedisBackend(prefix=self.prefix, layout="fields")
+        try:
+            # A blob written with the default layout is rewritten as fields
+            self.assertEqual(backend.load_fields(fn_id, ["a"]), {"a": 1})
+            self.assertEqual(backend.save_state_versioned(fn_id, {"a": 5, "b": 2}, changed={"a"}), (True, 2))
+            self.assertEqual(
+                backend.save_state_versioned(fn_id, {"a": 6, "b": "ignored"}, changed={"a"}), (True, 3)
+            )
+            self.assertEqual(backend.load_state_versioned(fn_id), ({"a": 6, "b": 2}, 3))
+            
+            self.assertEqual(backend.compare_and_swap(fn_id, {"b": 7}, 2, changed={"a", "b"}), (False, None))
+            self.assertEqual(backend.compare_and_swap(fn_id, {"b": 7}, 3, changed={"a", "b"}), (True, 4))
+            self.assertEqual(backend.load_fields(fn_id, ["a", "b"]), {"b": 7})
+        finally:
+            backend.close()
+    
+    def test_lock_handoff_is_fifo(self):
+        """Test that waiters are handed the lock on release in the order they queued."""
+        fn_id = "test_lock_queue"
+        queue_key = self.backend._get_queue_key(fn_id)
+        self.assertTrue(self.backend.acquire_lock(fn_id))
+        order = []
+        
+        def waiter(name):
+            backend = RedisBackend(prefix=self.prefix)
+            try:
+                if backend.acquire_lock(fn_id, timeout=5):
+                    order.append((name, time.monotonic()))
+                    backend.release_lock(fn_id)
+            finally:
+                backend.close()
+        
+        threads = []
+        for name in range(3):
+            threads.append(threading.Thread(target=waiter, args=(name,)))
+            threads[-1].start()
+            # Wait until the waiter has queued
+            while self.backend.client.llen(queue_key) <= name:
+                time.sleep(0.01)
+        released = time.monotonic()
+        self.assertTrue(self.backend.release_lock(fn_id))
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual([name for name, _ in order], [0, 1, 2])
+        # Handoffs do not wait for a polling interval
+        self.assertLess(order[-1][1] - released, 0.1)
+        self.assertEqual(self.backend.client.llen(queue_key), 0)
+    
+    def test_handoff_within_backend(self):
+        """Test that a release handing the lock to another thread keeps that thread's bookkeeping."""
+        fn_id = "test_handoff_threads"
+        self.backend.save_state(fn_id, {"n": 0})
+        script = self.backend._script
+        
+        def slow_script(source):
+            registered = script(source)
+            if source == _LOCK_AND_LOAD_SCRIPT:
+                return registered
+            
+            def run(**kwargs):
+                result = registered(**kwargs)
+                # Let the waiter the lock was handed to take over before the release returns
+                time.sleep(0.005)
+                return result
+            return run
+        
+        errors = []
+        
+        def increment(use_save_and_release):
+            try:
+                for _ in range(5):
+                    self.assertTrue(self.backend.acquire_lock(fn_id, timeout=10))
+                    state = self.backend.load_state(fn_id)
+                    state["n"] += 1
+                    if use_save_and_release:
+                        self.assertTrue(self.backend.save_and_release(fn_id, state)[0])
+                    else:
+                        self.assertTrue(self.backend.save_state(fn_id, state))
+                        self.assertTrue(self.backend.release_lock(fn_id))
+            except Exception as e:
+                errors.append(e)
+        
+        with mock.patch.object(self.backend, "_script", side_effect=slow_script):
+            threads = [threading.Thread(target=increment, args=(i % 2 == 0,)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        self.assertEqual(errors, [])
+        self.assertEqual(self.backend.load_state(fn_id), {"n": 20})
+        self.assertEqual(self.backend._locks, {})
+    
+    def test_lock_timeout_leaves_queue(self):
+        """Test that a waiter that times out leaves the queue."""
+        fn_id = "test_lock_timeout"
+        self.assertTrue(self.backend.acquire_lock(fn_id))
+        other = RedisBackend(prefix=self.prefix)
+        try:
+            started = time.monotonic()
+            self.assertFalse(other.acquire_lock(fn_id, timeout=0.2))
+            self.assertLess(time.monotonic() - started, 1)
+            self.assertEqual(self.backend.client.llen(self.backend._get_queue_key(fn_id)), 0)
+            self.assertTrue(self.backend.release_lock(fn_id))
+            self.assertTrue(other.acquire_lock(fn_id, timeout=0))
+            self.assertTrue(other.release_lock(fn_id))
+        finally:
+            other.close()
+    
+    def test_expired_lock_wakes_waiters(self):
+        """Test that a waiter takes over once a lock that was never released expires."""
+        fn_id = "test_lock_expiry"
+        crashed = RedisBackend(prefix=self.prefix, lock_timeout=200, renew_locks=False)
+        try:
+            self.assertTrue(crashed.acquire_lock(fn_id))
+            started = time.monotonic()
+            self.assertTrue(self.backend.acquire_lock(fn_id, timeout=2))
+            self.assertLess(time.monotonic() - started, 1)
+            self.assertTrue(self.backend.release_lock(fn_id))
+        finally:
+            crashed.close()
+    
+    def test_lock_lease_renewal(self):
+        """Test that held locks outlive their timeout while renewed in the background."""
+        fn_id = "test_lock_renewal"
+        backend = RedisBackend(prefix=self.prefix, lock_timeout=300)
+        try:
+            self.assertTrue(backend.acquire_lock(fn_id))
+            time.sleep(0.7)
+            self.assertFalse(self.backend.acquire_lock(fn_id, timeout=0))
+            self.assertEqual(backend.save_and_release(fn_id, {"n": 1}), (True, 1))
+        finally:
+            backend.close()
+        self.assertEqual(self.backend.load_state(fn_id), {"n": 1})
+    
+    def test_fencing_token_rejects_stale_saves(self):
+        """Test that a holder whose lock expired cannot save after another caller locked."""
+        fn_id = "test_fencing"
+        self.assertIsNone(self.backend.fencing_token(fn_id))
+        stalled = RedisBackend(prefix=self.prefix, lock_timeout=100, renew_locks=False)
+        try:
+            self.assertTrue(stalled.acquire_lock(fn_id))
+            stale_token = stalled.fencing_token(fn_id)
+            self.assertTrue(self.backend.acquire_lock(fn_id, timeout=2))
+            self.assertGreater(self.backend.fencing_token(fn_id), stale_token)
+            
+            with self.assertLogs("statefulpy.backends.redis", level="ERROR"):
+                self.assertEqual(stalled.save_state_versioned(fn_id, {"n": "stale"}), (False, None))
+                self.assertEqual(stalled.compare_and_swap(fn_id, {"n": "stale"}, 0), (False, None))
+            self.assertFalse(stalled.release_lock(fn_id))
+            self.assertEqual(self.backend.save_state_versioned(fn_id, {"n": 1}), (True, 1))
+            self.assertTrue(self.backend.release_lock(fn_id))
+        finally:
+            stalled.close()
+        self.assertEqual(self.backend.load_state(fn_id), {"n": 1})
+    
+    def test_invalid_lock_timeout(self):
+        """Test that a lock timeout must be positive."""
+        with self.assertRaises(ValueError):
+            RedisBackend(prefix=self.prefix, lock_timeout=0)
+    
+    def test_locked_call_round_trips(self):
+        """Test that locking, reading, saving and releasing take two round trips."""
+        fn_id = "test_round_trips"
+        self.backend.save_state(fn_id, {"n": 1})
+        # Load the scripts and forget the version, as a fresh process would
+        self.backend.acquire_lock("warm_up")
+        self.backend.save_and_release("warm_up", {"n": 0})
+        self.backend._known_versions.pop(fn_id)
+        
+        client = self.backend.client
+        with mock.patch.object(client, "execute_command", wraps=client.execute_command) as execute, \
+                mock.patch.object(client, "pipeline", side_effect=AssertionError("extra round trip")):
+            self.assertTrue(self.backend.acquire_lock(fn_id))
+            self.assertEqual(self.backend.get_version(fn_id), 1)
+            self.assertEqual(self.backend.load_state_versioned(fn_id), ({"n": 1}, 1))
+            self.assertEqual(self.backend.save_and_release(fn_id, {"n": 2}), (True, 2))
+        self.assertEqual(execute.call_count, 2)
+        self.assertIsNone(client.get(self.backend._get_lock_key(fn_id)))
+        self.assertEqual(self.backend.load_state_versioned(fn_id), ({"n": 2}, 2))
+    
+    def test_lock_skips_known_state(self):
+        """Test that the lock only carries the state if the backend lacks its version."""
+        fn_id = "test_known_state"
+        self.backend.save_state(fn_id, {"n": 1})
+        self.assertTrue(self.backend.acquire_lock(fn_id))
+        self.assertEqual(self.backend._prefetched[fn_id], (1, None))
+        # A full load still works, with a separate read
+        self.assertEqual(self.backend.load_state_versioned(fn_id), ({"n": 1}, 1))
+        self.assertTrue(self.backend.release_lock(fn_id))
+        
+        other = RedisBackend(prefix=self.prefix)
+        try:
+            self.assertTrue(other.save_state(fn_id, {"n": 2}))
+        finally:
+            other.close()
+        self.assertTrue(self.backend.acquire_lock(fn_id))
+        self.assertEqual(self.backend.load_state_versioned(fn_id), ({"n": 2}, 2))
+        self.assertTrue(self.backend.release_lock(fn_id))
+    
+    def test_save_and_release_needs_lock(self):
+        """Test that a save with the release is dropped if the lock expired."""
+        fn_id = "test_lost_lock"
+        self.backend.save_state(fn_id, {"n": 1})
+        self.assertTrue(self.backend.acquire_lock(fn_id))
+        self.backend.client.delete(self.backend._get_lock_key(fn_id))
+        with self.assertLogs("statefulpy.backends.redis", level="ERROR"):
+            self.assertEqual(self.backend.save_and_release(fn_id, {"n": 2}), (False, None))
+        self.assertEqual(self.backend.load_state_versioned(fn_id), ({"n": 1}, 1))
+        # The lock can be taken again
+        self.assertTrue(self.backend.acquire_lock(fn_id))
+        self.assertTrue(self.backend.release_lock(fn_id))
+    
+    def test_fields_layout_save_and_release(self):
+        """Test saving changed fields with the release, including over a blob."""
+        fn_id = "test_fields_release"
+        self.backend.save_state(fn_id, {"a": 1, "b": 2})
+        backend = RedisBackend(prefix=self.prefix, layout="fields")
+        try:
+            self.assertTrue(backend.acquire_lock(fn_id))
+            self.assertEqual(backend.load_state_versioned(fn_id), ({"a": 1, "b": 2}, 1))
+            self.assertEqual(backend.save_and_release(fn_id, {"a": 5, "b": 2}, changed={"a"}), (True, 2))
+            self.assertTrue(backend.acquire_lock(fn_id))
+            self.assertEqual(backend.save_and_release(fn_id, {"a": 6}, changed={"a", "b"}), (True, 3))
+            self.assertEqual(self.backend.client.get(backend._get_lock_key(fn_id)), None)
+            self.assertEqual(backend.load_fields(fn_id, ["a", "b"]), {"a": 6})
+        finally:
+            backend.close()
+    
+    def _wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+    
+    def test_near_cache(self):
+        """Test that the near cache serves repeat reads and drops states written elsewhere."""
+        fn_id = "test_near"
+        self.backend.save_state(fn_id, {"n": 1, "m": 2})
+        backend = RedisBackend(prefix=self.prefix, near_cache=True)
+        try:
+            # The first read subscribes to invalidations
+            self.assertEqual(backend.get_version(fn_id), 1)
+            self._wait_for(lambda: backend._near_ready)
+            self.assertEqual(backend.load_state_versioned(fn_id), ({"n": 1, "m": 2}, 1))
+            with mock.patch.object(backend.client, "pipeline", side_effect=AssertionError), \
+                    mock.patch.object(backend.client, "get", side_effect=AssertionError):
+                self.assertEqual(backend.load_state_versioned(fn_id), ({"n": 1, "m": 2}, 1))
+                self.assertEqual(backend.get_version(fn_id), 1)
+                self.assertEqual(backend.load_fields(fn_id, ["n"]), {"n": 1})
+            self.assertTrue(self.backend.save_state_versioned(fn_id, {"n": 3})[0])
+            self._wait_for(lambda: fn_id not in backend._near)
+            self.assertEqual(backend.load_state_versioned(fn_id), ({"n": 3}, 2))
+            # Lock holders read from Redis
+            self.assertTrue(backend.acquire_lock(fn_id))
+            self.assertIsNone(backend._near_begin(fn_id))
+            self.assertEqual(backend.save_and_release(fn_id, {"n": 4}), (True, 3))
+            self.assertEqual(backend.get_version(fn_id), 3)
+        finally:
+            backend.close()
+    
+    def test_invalidations_need_near_cache(self):
+        """Test that writes only publish invalidations while a near cache is announced."""
+        fn_id = "test_near_publish"
+        channel = self.backend._get_invalidation_key()
+        self.assertTrue(channel.startswith(self.prefix))
+        pubsub = self.backend.client.pubsub()
+        try:
+            pubsub.subscribe(channel)
+            self.assertEqual(pubsub.get_message(timeout=1)["type"], "subscribe")
+            self.backend.save_state(fn_id, {"n": 1})
+            self.assertIsNone(pubsub.get_message(timeout=0.1))
+            
+            backend = RedisBackend(prefix=self.prefix, near_cache=True)
+            try:
+                backend.get_version(fn_id)
+                self._wait_for(lambda: backend._near_ready)
+                self.backend.save_state(fn_id, {"n": 2})
+                message = pubsub.get_message(timeout=1)
+                self.assertEqual(message["data"], self.backend._get_version_key(fn_id).encode("utf-8"))
+            finally:
+                backend.close()
+        finally:
+            pubsub.close()
+    
+    def test_near_cache_fields(self):
+        """Test that the near cache keeps single fields and drops them on writes."""
+        fn_id = "test_near_fields"
+        writer = RedisBackend(prefix=self.prefix, layout="fields")
+        backend = RedisBackend(prefix=self.prefix, layout="fields", near_cache=True)
+        try:
+            writer.save_state(fn_id, {"a": 1, "b": 2})
+            backend.get_version(fn_id)
+            self._wait_for(lambda: backend._near_ready)
+            self.assertEqual(backend.load_fields(fn_id, ["a", "c"]), {"a": 1})
+            with mock.patch.object(backend.client, "pipeline", side_effect=AssertionError):
+                self.assertEqual(backend.load_fields(fn_id, ["c", "a"]), {"a": 1})
+            self.assertTrue(writer.compare_and_swap(fn_id, {"a": 5, "b": 2}, 1, changed={"a"})[0])
+            self._wait_for(lambda: fn_id not in backend._near)
+            self.assertEqual(backend.load_fields(fn_id, ["a", "b"]), {"a": 5, "b": 2})
+        finally:
+            writer.close()
+            backend.close()
+    
+    def test_relaxed_durability_defers_saves(self):
+        """Test that saves under the lock are sent together with the lock release."""
+        fn_id = "test_relaxed"
+        backend = RedisBackend(prefix=self.prefix, durability="relaxed")
+        try:
+            self.assertTrue(backend.acquire_lock(fn_id))
+            self.assertEqual(backend.get_version(fn_id), 0)
+            self.assertEqual(backend.save_state_versioned(fn_id, {"n": 1}), (True, 1))
+            self.assertEqual(self.backend.get_version(fn_id), 0)
+            # Reads by the lock holder see its own writes
+            self.assertEqual(backend.load_state_versioned(fn_id), ({"n": 1}, 1))
+            self.assertEqual(backend.save_state_versioned(fn_id, {"n": 2}), (True, 2))
+            self.assertTrue(backend.release_lock(fn_id))
+            self.assertEqual(self.backend.load_state_versioned(fn_id), ({"n": 2}, 2))
+            
+            # Without the lock saves are sent right away
+            self.assertEqual(backend.save_state_versioned(fn_id, {"n": 3}), (True, 3))
+            self.assertEqual(self.backend.load_state(fn_id), {"n": 3})
+        finally:
+            backend.close()
+    
+    def test_compressed_serializer(self):
+        """Test that large states are stored compressed."""
+        backend = RedisBackend(prefix=self.prefix, serializer="json+lzma")
+        try:
+            state = {"items": ["x"] * 1000}
+            self.assertTrue(backend.save_state("test_compressed", state))
+            self.assertEqual(backend.load_state("test_compressed"), state)
+            stored = backend.client.get(backend._get_state_key("test_compressed"))
+            self.assertTrue(stored.startswith(MAGIC))
+        finally:
+            backend.close()
+    
+    def test_strict_durability_waits_for_replicas(self):
+        """Test that strict durability waits for replica acknowledgements on the write's connection."""
+        backend = RedisBackend(prefix=self.prefix, durability="strict",
+                               wait_replicas=2, wait_timeout=50)
+        try:
+            pipe = mock.MagicMock()
+            pipe.execute.return_value = [1, 1]
+            with mock.patch.object(backend.client, "pipeline", return_value=pipe), \
+                    mock.patch.object(backend.client, "execute_command",
+                                      side_effect=AssertionError("sent on another connection")), \
+                    self.assertLogs("statefulpy.backends.redis", level="WARNING"):
+                self.assertEqual(backend.save_state_versioned("test_strict", {"n": 1}), (True, 1))
+            # The script and WAIT are sent together on one pipeline
+            self.assertEqual([call[0] for call in pipe.method_calls],
+                             ["scripts.add", "evalsha", "execute_command", "execute"])
+            pipe.execute_command.assert_called_once_with("WAIT", 2, 50)
+        finally:
+            backend.close()
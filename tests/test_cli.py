@@ -72,6 +72,8 @@ class TestCLICommands(unittest.TestCase):
         args.to_path = self.target_db.name
         args.from_serializer = None
         args.to_serializer = None
+        args.from_layout = None
+        args.to_layout = None
         
         # Run the command
         result = migrate_command(args)
@@ -0,0 +1,119 @@
+"""
+Tests for the bounded state containers.
+"""
+import copy
+import os
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+
+from statefulpy import stateful
+from statefulpy.backends.sqlite import SQLiteBackend
+from statefulpy.containers import CappedDeque, LRUDict, TTLDict
+from statefulpy.decorator import StateProxy
+from statefulpy.serializers.json_serializer import JSONSerializer
+
+
+class TestContainers(unittest.TestCase):
+    """Test suite for LRUDict, TTLDict and CappedDeque."""
+    
+    def test_lru_dict_evicts_least_recently_used(self):
+        """Test that reads refresh recency and writes evict beyond maxsize."""
+        lru = LRUDict(maxsize=2)
+        lru["a"] = 1
+        lru["b"] = 2
+        self.assertEqual(lru["a"], 1)
+        lru["c"] = 3
+        self.assertEqual(list(lru), ["a", "c"])
+        
+        # Iterating over items does not count as use
+        self.assertEqual(dict(lru.items()), {"a": 1, "c": 3})
+        lru["d"] = 4
+        self.assertEqual(list(lru), ["c", "d"])
+    
+    def test_lru_reads_keep_state_clean(self):
+        """Test that reading an LRUDict does not change its stored form or dirty the state."""
+        lru = LRUDict(maxsize=2)
+        lru["a"] = 1
+        lru["b"] = 2
+        proxy = StateProxy({"cache": lru})
+        proxy.mark_clean()
+        self.assertEqual(proxy["cache"]["a"], 1)
+        self.assertEqual(proxy.changed_keys(), set())
+        
+        # The read still counts for eviction in this process
+        lru["c"] = 3
+        self.assertEqual(list(lru), ["a", "c"])
+        restored = pickle.loads(pickle.dumps(lru))
+        restored["d"] = 4
+        self.assertEqual(list(restored), ["c", "d"])
+    
+    def test_max_bytes(self):
+        """Test that entries are evicted once the approximate size is exceeded."""
+        lru = LRUDict(maxsize=None, max_bytes=500)
+        for i in range(100):
+            lru[i] = "x" * 50
+        self.assertLess(len(lru), 10)
+        self.assertIn(99, lru)
+    
+    def test_ttl_dict_expires_keys(self):
+        """Test that keys disappear ttl seconds after they were written."""
+        with mock.patch("statefulpy.containers.time.time", return_value=100):
+            ttl = TTLDict(ttl=10)
+            ttl["a"] = 1
+        with mock.patch("statefulpy.containers.time.time", return_value=105):
+            ttl["b"] = 2
+            self.assertEqual(dict(ttl), {"a": 1, "b": 2})
+        with mock.patch("statefulpy.containers.time.time", return_value=111):
+            self.assertNotIn("a", ttl)
+            self.assertEqual(dict(ttl), {"b": 2})
+    
+    def test_capped_deque(self):
+        """Test that only the newest maxlen items are kept."""
+        events = CappedDeque(range(5), maxlen=3)
+        events.append(5)
+        self.assertEqual(list(events), [3, 4, 5])
+        with self.assertRaises(ValueError):
+            CappedDeque()
+    
+    def test_round_trips(self):
+        """Test that containers keep their bounds through pickle, deepcopy and JSON."""
+        lru = LRUDict(maxsize=2)
+        lru[1] = "one"
+        ttl = TTLDict(ttl=60, maxsize=5)
+        ttl["k"] = [1, 2]
+        state = {"lru": lru, "ttl": ttl, "events": CappedDeque([1, 2], maxlen=2)}
+        
+        json_serializer = JSONSerializer()
+        for restored in (pickle.loads(pickle.dumps(state)),
+                         copy.deepcopy(state),
+                         json_serializer.deserialize(json_serializer.serialize(state))):
+            self.assertEqual(restored, state)
+            self.assertIsInstance(restored["lru"], LRUDict)
+            self.assertEqual(restored["lru"].maxsize, 2)
+            self.assertEqual(restored["ttl"].ttl, 60)
+            self.assertEqual(restored["events"].maxlen, 2)
+    
+    def test_in_function_state(self):
+        """Test that containers persist as function state."""
+        temp_db = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
+        temp_db.close()
+        self.addCleanup(os.unlink, temp_db.name)
+        self.addCleanup(lambda: SQLiteBackend(db_path=temp_db.name).close())
+        
+        @stateful(backend="sqlite", db_path=temp_db.name, function_id="recent")
+        def remember(word):
+            if "recent" not in remember.state:
+                remember.state["recent"] = CappedDeque(maxlen=2)
+            remember.state["recent"].append(word)
+        
+        for word in ("a", "b", "c"):
+            remember(word)
+        
+        backend = SQLiteBackend(db_path=temp_db.name, serializer="json")
+        self.assertEqual(backend.load_state("recent"), {"recent": CappedDeque(["b", "c"], maxlen=2)})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,7 @@
 """
 Tests for the stateful decorator.
 """
+import asyncio
 import os
 import tempfile
 import unittest
@@ -8,7 +9,9 @@ import time
 import gc
 from unittest import mock
 
-from statefulpy import stateful
+from statefulpy import stateful, stateful_cache, StateConflictError, reset_stats, stats
+from statefulpy.backends.sqlite import AsyncSQLiteBackend, SQLiteBackend
+from statefulpy.decorator import StateProxy
 
 
 class TestStatefulDecorator(unittest.TestCase):
@@ -121,6 +124,581 @@ class TestStatefulDecorator(unittest.TestCase):
         }
         self.assertEqual(collector(), expected)
 
+    def test_read_only_calls_skip_save(self):
+        """Test that calls which do not change the state are not written back."""
+        @stateful(backend="sqlite", db_path=self.temp_db.name)
+        def reader():
+            if "value" not in reader.state:
+                reader.state["value"] = 1
+                reader.state["items"] = [1, 2]
+            return reader.state["value"], len(reader.state["items"])
+        
+        with mock.patch.object(SQLiteBackend, "save_state_versioned", autospec=True,
+                               side_effect=SQLiteBackend.save_state_versioned) as save:
+            reader()
+            self.assertEqual(save.call_count, 1)
+            reader()
+            reader()
+            self.assertEqual(save.call_count, 1)
+    
+    def test_nested_mutation_is_saved(self):
+        """Test that in-place mutations of nested containers are detected."""
+        @stateful(backend="sqlite", db_path=self.temp_db.name, function_id="nested_mutation")
+        def appender(item):
+            if "items" not in appender.state:
+                appender.state["items"] = {"seen": []}
+            appender.state["items"]["seen"].append(item)
+            return appender.state["items"]["seen"]
+        
+        appender("a")
+        appender("b")
+        
+        backend = SQLiteBackend(db_path=self.temp_db.name, serializer="json")
+        self.assertEqual(backend.load_state("nested_mutation"), {"items": {"seen": ["a", "b"]}})
+
+    def test_call_phase_stats(self):
+        """Test that every phase of a call is timed per state key."""
+        reset_stats()
+        
+        @stateful(backend="sqlite", db_path=self.temp_db.name, function_id="timed")
+        def counter():
+            counter.state["count"] = counter.state["count"] + 1 if "count" in counter.state else 1
+        
+        for _ in range(3):
+            counter()
+        
+        phases = stats("timed")
+        for phase in ("lock", "load", "call", "save", "serialize"):
+            self.assertEqual(phases[phase]["count"], 3, phase)
+        # Calls that change the state release the lock as part of the save
+        self.assertNotIn("release", phases)
+        self.assertEqual(phases["bytes_written"]["count"], 3)
+        self.assertGreater(phases["bytes_written"]["max"], 0)
+        self.assertLessEqual(phases["call"]["min"], phases["call"]["p99"])
+        self.assertIn("timed", stats())
+        
+        reset_stats("timed")
+        self.assertEqual(stats("timed"), {})
+    
+    def test_partition_stats_share_function_key(self):
+        """Test that the partitions of a key_by function are timed under the function key."""
+        reset_stats()
+        
+        @stateful(backend="sqlite", db_path=self.temp_db.name, function_id="timed_parts",
+                  key_by="user")
+        def visit(user):
+            visit.state["visits"] = visit.state["visits"] + 1 if "visits" in visit.state else 1
+        
+        for user in ("alice", "bob", "carol"):
+            visit(user)
+        
+        self.assertEqual(list(stats()), ["timed_parts"])
+        phases = stats("timed_parts")
+        self.assertEqual(phases["call"]["count"], 3)
+        self.assertEqual(phases["serialize"]["count"], 3)
+        self.assertEqual(stats("timed_parts[alice]"), {})
+        
+        @stateful(backend="sqlite", db_path=self.temp_db.name, function_id="jobs[v2]")
+        def job():
+            job.state["runs"] = job.state["runs"] + 1 if "runs" in job.state else 1
+        
+        job()
+        self.assertEqual(stats("jobs[v2]")["call"]["count"], 1)
+        self.assertEqual(stats("timed_parts")["call"]["count"], 3)
+    
+    def test_fields_layout_saves_changed_keys(self):
+        """Test that only the keys a call changed are passed to the backend."""
+        @stateful(backend="sqlite", db_path=self.temp_db.name, function_id="fields",
+                  layout="fields")
+        def tally(name):
+            if "totals" not in tally.state:
+                tally.state["totals"] = {}
+                tally.state["calls"] = 0
+            tally.state["totals"][name] = tally.state["totals"].get(name, 0) + 1
+            tally.state["calls"] += 1
+        
+        tally("a")
+        with mock.patch.object(SQLiteBackend, "save_state_versioned", autospec=True,
+                               side_effect=SQLiteBackend.save_state_versioned) as save:
+            tally("b")
+            self.assertEqual(save.call_args.kwargs["changed"], {"totals", "calls"})
+        
+        backend = SQLiteBackend(db_path=self.temp_db.name, serializer="json", layout="fields")
+        self.assertEqual(backend.load_fields("fields", ["calls"]), {"calls": 2})
+        self.assertEqual(backend.load_state("fields")["totals"], {"a": 1, "b": 1})
+    
+    def test_unchanged_version_skips_reload(self):
+        """Test that state is only reloaded when its version changed."""
+        @stateful(backend="sqlite", db_path=self.temp_db.name, function_id="versioned")
+        def counter():
+            counter.state["count"] = counter.state["count"] + 1 if "count" in counter.state else 1
+            return counter.state["count"]
+        
+        with mock.patch.object(SQLiteBackend, "load_state_versioned", autospec=True,
+                               side_effect=SQLiteBackend.load_state_versioned) as load:
+            self.assertEqual(counter(), 1)
+            self.assertEqual(counter(), 2)
+            load.assert_not_called()
+            
+            # Another writer bumps the version, so the next call must reload
+            other = SQLiteBackend(db_path=self.temp_db.name, serializer="json")
+            other.save_state("versioned", {"count": 10})
+            self.assertEqual(counter(), 11)
+            self.assertEqual(load.call_count, 1)
+
+    def test_optimistic_concurrency(self):
+        """Test that optimistic calls commit with compare-and-swap and retry on conflict."""
+        other = SQLiteBackend(db_path=self.temp_db.name, serializer="json")
+        
+        @stateful(backend="sqlite", db_path=self.temp_db.name, function_id="optimistic",
+                  concurrency="optimistic")
+        def counter(interfere=False):
+            count = counter.state["count"] if "count" in counter.state else 0
+            if interfere:
+                # A concurrent writer commits while this call is running
+                interfere_state = other.load_state("optimistic") or {}
+                if interfere_state.get("count", 0) < 100:
+                    other.save_state("optimistic", {"count": 100})
+            counter.state["count"] = count + 1
+            return counter.state["count"]
+        
+        with mock.patch.object(SQLiteBackend, "acquire_lock", autospec=True) as acquire:
+            self.assertEqual(counter(), 1)
+            self.assertEqual(counter(interfere=True), 101)
+            acquire.assert_not_called()
+        self.assertEqual(other.load_state("optimistic"), {"count": 101})
+    
+    def test_failed_call_changes_are_discarded(self):
+        """Test that changes made by a call that raises are not saved by later calls."""
+        for concurrency in ("pessimistic", "optimistic"):
+            with self.subTest(concurrency=concurrency):
+                @stateful(backend="sqlite", db_path=self.temp_db.name,
+                          function_id=f"failing_{concurrency}", concurrency=concurrency)
+                def counter(fail=False):
+                    counter.state["count"] = counter.state["count"] + 1 if "count" in counter.state else 1
+                    if fail:
+                        raise RuntimeError("boom")
+                    return counter.state["count"]
+                
+                counter()
+                counter()
+                with self.assertRaises(RuntimeError):
+                    counter(fail=True)
+                self.assertEqual(counter(), 3)
+    
+    def test_optimistic_conflict_error(self):
+        """Test that StateConflictError is raised once retries are exhausted."""
+        other = SQLiteBackend(db_path=self.temp_db.name, serializer="json")
+        
+        @stateful(backend="sqlite", db_path=self.temp_db.name, function_id="always_conflicts",
+                  concurrency="optimistic", max_retries=2)
+        def counter():
+            other.save_state("always_conflicts", {"count": time.time()})
+            counter.state["count"] = 0
+        
+        with self.assertRaises(StateConflictError):
+            counter()
+
+    def test_key_by_partitions_state(self):
+        """Test that key_by stores each partition under its own key."""
+        @stateful(backend="sqlite", db_path=self.temp_db.name, function_id="tenants",
+                  key_by="tenant")
+        def hit(tenant, amount=1):
+            if "hits" not in hit.state:
+                hit.state["hits"] = 0
+            hit.state["hits"] += amount
+            return hit.state["hits"]
+        
+        self.assertEqual(hit("a"), 1)
+        self.assertEqual(hit("b", amount=5), 5)
+        self.assertEqual(hit(tenant="a"), 2)
+        
+        backend = SQLiteBackend(db_path=self.temp_db.name, serializer="json")
+        self.assertEqual(backend.load_state("tenants[a]"), {"hits": 2})
+        self.assertEqual(backend.load_state("tenants[b]"), {"hits": 5})
+        self.assertIsNone(backend.load_state("tenants"))
+        
+        with self.assertRaises(RuntimeError):
+            hit.state["hits"]
+    
+    def test_key_by_callable(self):
+        """Test that key_by accepts a callable over the call arguments."""
+        @stateful(backend="sqlite", db_path=self.temp_db.name, function_id="by_parity",
+                  key_by=lambda n: "even" if n % 2 == 0 else "odd")
+        def collect(n):
+            if "seen" not in collect.state:
+                collect.state["seen"] = []
+            collect.state["seen"].append(n)
+        
+        for n in range(5):
+            collect(n)
+        
+        backend = SQLiteBackend(db_path=self.temp_db.name, serializer="json")
+        self.assertEqual(backend.load_state("by_parity[even]"), {"seen": [0, 2, 4]})
+        self.assertEqual(backend.load_state("by_parity[odd]"), {"seen": [1, 3]})
+    
+    def test_max_partitions_evicts_idle_partitions(self):
+        """Test that partitions beyond max_partitions are dropped and reloaded on their next call."""
+        @stateful(backend="sqlite", db_path=self.temp_db.name, function_id="capped",
+                  key_by="user", max_partitions=2)
+        def visit(user):
+            visit.state["visits"] = visit.state["visits"] + 1 if "visits" in visit.state else 1
+            return visit.state["visits"]
+        
+        with mock.patch.object(SQLiteBackend, "load_state_versioned", autospec=True,
+                               side_effect=SQLiteBackend.load_state_versioned) as load:
+            for user in ("a", "b", "c", "d"):
+                visit(user)
+            self.assertEqual(load.call_count, 4)
+            # Kept in memory: only its version is checked
+            self.assertEqual(visit("d"), 2)
+            self.assertEqual(load.call_count, 4)
+            # Evicted: loaded from the backend again
+            self.assertEqual(visit("a"), 2)
+            self.assertEqual(load.call_count, 5)
+        
+        with self.assertRaises(ValueError):
+            @stateful(backend="sqlite", db_path=self.temp_db.name, key_by="user", max_partitions=0)
+            def invalid(user):
+                pass
+    
+    def test_max_partitions_keeps_unflushed_partitions(self):
+        """Test that write-behind partitions are only evicted once their changes are flushed."""
+        @stateful(backend="sqlite", db_path=self.temp_db.name, function_id="capped_write_behind",
+                  key_by="user", max_partitions=1, cache=True, flush_interval=None)
+        def visit(user):
+            visit.state["visits"] = visit.state["visits"] + 1 if "visits" in visit.state else 1
+            return visit.state["visits"]
+        
+        visit("a")
+        visit("b")
+        self.assertTrue(visit.flush_state())
+        visit("c")
+        self.assertTrue(visit.flush_state())
+        self.assertEqual([visit("a"), visit("b"), visit("c")], [2, 2, 2])
+        self.assertTrue(visit.flush_state())
+        backend = SQLiteBackend(db_path=self.temp_db.name, serializer="json")
+        self.assertEqual(backend.load_state("capped_write_behind[a]"), {"visits": 2})
+    
+    def test_key_by_unknown_argument(self):
+        """Test that key_by must name arguments of the decorated function."""
+        with self.assertRaises(ValueError):
+            @stateful(backend="sqlite", db_path=self.temp_db.name, key_by="missing")
+            def func(tenant):
+                pass
+
+    def test_durability_option(self):
+        """Test that durability is validated and passed to the backend."""
+        with self.assertRaises(ValueError):
+            @stateful(backend="sqlite", db_path=self.temp_db.name, durability="paranoid")
+            def invalid():
+                pass
+        
+        with mock.patch.object(SQLiteBackend, "__init__", autospec=True,
+                               side_effect=SQLiteBackend.__init__) as init:
+            @stateful(backend="sqlite", db_path=self.temp_db.name, durability="relaxed")
+            def relaxed():
+                pass
+        self.assertEqual(init.call_args.kwargs["durability"], "relaxed")
+    
+    def test_write_behind_defers_saves(self):
+        """Test that cache=True keeps state in memory and flushes it later."""
+        @stateful(backend="sqlite", db_path=self.temp_db.name, function_id="write_behind",
+                  cache=True, flush_interval=None)
+        def counter():
+            counter.state["count"] = counter.state["count"] + 1 if "count" in counter.state else 1
+            return counter.state["count"]
+        
+        backend = SQLiteBackend(db_path=self.temp_db.name, serializer="json")
+        with mock.patch.object(SQLiteBackend, "load_state", autospec=True,
+                               side_effect=SQLiteBackend.load_state) as load:
+            for _ in range(5):
+                counter()
+            load.assert_not_called()
+        self.assertIsNone(backend.load_state("write_behind"))
+        
+        self.assertTrue(counter.flush_state())
+        self.assertEqual(backend.load_state("write_behind"), {"count": 5})
+    
+    def test_write_behind_flush_every(self):
+        """Test that the background flusher runs after flush_every dirty calls."""
+        @stateful(backend="sqlite", db_path=self.temp_db.name, function_id="flush_every",
+                  cache=True, flush_interval=None, flush_every=3)
+        def counter():
+            counter.state["count"] = counter.state["count"] + 1 if "count" in counter.state else 1
+            return counter.state["count"]
+        
+        backend = SQLiteBackend(db_path=self.temp_db.name, serializer="json")
+        for _ in range(3):
+            counter()
+        
+        deadline = time.time() + 5
+        while backend.load_state("flush_every") is None and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(backend.load_state("flush_every"), {"count": 3})
+    
+    def test_write_behind_skips_fingerprints(self):
+        """Test that write-behind calls mark mutable reads as changed without pickling them."""
+        @stateful(backend="sqlite", db_path=self.temp_db.name, function_id="write_behind_nested",
+                  cache=True, flush_interval=None)
+        def record(item):
+            if "seen" not in record.state:
+                record.state["seen"] = {"items": []}
+            record.state["seen"]["items"].append(item)
+        
+        with mock.patch("statefulpy.decorator._fingerprint") as fingerprint:
+            record("a")
+            record("b")
+            fingerprint.assert_not_called()
+        self.assertTrue(record.flush_state())
+        backend = SQLiteBackend(db_path=self.temp_db.name, serializer="json")
+        self.assertEqual(backend.load_state("write_behind_nested"), {"seen": {"items": ["a", "b"]}})
+
+
+class TestAsyncStatefulDecorator(unittest.TestCase):
+    """Test suite for the stateful decorator on coroutine functions."""
+    
+    def setUp(self):
+        """Set up test environment."""
+        self.temp_db = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
+        self.temp_db.close()
+    
+    def tearDown(self):
+        """Clean up test environment."""
+        if os.path.exists(self.temp_db.name):
+            os.unlink(self.temp_db.name)
+    
+    def test_async_counter(self):
+        """Test that state is saved after the coroutine has run."""
+        @stateful(backend="sqlite", db_path=self.temp_db.name, function_id="async_counter")
+        async def counter():
+            await asyncio.sleep(0)
+            counter.state["count"] = counter.state["count"] + 1 if "count" in counter.state else 1
+            return counter.state["count"]
+        
+        async def main():
+            return [await counter() for _ in range(3)]
+        
+        self.assertEqual(asyncio.run(main()), [1, 2, 3])
+        backend = SQLiteBackend(db_path=self.temp_db.name, serializer="json")
+        self.assertEqual(backend.load_state("async_counter"), {"count": 3})
+    
+    def test_async_max_partitions(self):
+        """Test that coroutine functions keep at most max_partitions idle partitions."""
+        @stateful(backend="sqlite", db_path=self.temp_db.name, function_id="async_capped",
+                  key_by="user", max_partitions=1)
+        async def visit(user):
+            visit.state["visits"] = visit.state["visits"] + 1 if "visits" in visit.state else 1
+            return visit.state["visits"]
+        
+        async def main():
+            return [await visit(user) for user in ("a", "b", "a", "b")]
+        
+        with mock.patch.object(AsyncSQLiteBackend, "load_state_versioned", autospec=True,
+                               side_effect=AsyncSQLiteBackend.load_state_versioned) as load:
+            self.assertEqual(asyncio.run(main()), [1, 1, 2, 2])
+        # Every call found its partition evicted by the previous one
+        self.assertEqual(load.call_count, 4)
+    
+    def test_async_failed_call_changes_are_discarded(self):
+        """Test that changes made by a coroutine that raises are not saved by later calls."""
+        @stateful(backend="sqlite", db_path=self.temp_db.name, function_id="async_failing")
+        async def counter(fail=False):
+            counter.state["count"] = counter.state["count"] + 1 if "count" in counter.state else 1
+            if fail:
+                raise RuntimeError("boom")
+            return counter.state["count"]
+        
+        async def main():
+            await counter()
+            await counter()
+            with self.assertRaises(RuntimeError):
+                await counter(fail=True)
+            return await counter()
+        
+        self.assertEqual(asyncio.run(main()), 3)
+    
+    def test_async_concurrent_tasks(self):
+        """Test that concurrent tasks are serialized and do not lose updates."""
+        for concurrency in ("pessimistic", "optimistic"):
+            @stateful(backend="sqlite", db_path=self.temp_db.name,
+                      function_id=f"async_{concurrency}", concurrency=concurrency)
+            async def counter():
+                count = counter.state["count"] if "count" in counter.state else 0
+                await asyncio.sleep(0.001)
+                counter.state["count"] = count + 1
+            
+            async def main():
+                await asyncio.gather(*(counter() for _ in range(10)))
+            
+            asyncio.run(main())
+            backend = SQLiteBackend(db_path=self.temp_db.name, serializer="json")
+            self.assertEqual(backend.load_state(f"async_{concurrency}"), {"count": 10})
+    
+    def test_async_key_by(self):
+        """Test that partitions work for coroutine functions."""
+        @stateful(backend="sqlite", db_path=self.temp_db.name, function_id="async_tenants",
+                  key_by="tenant")
+        async def hit(tenant):
+            await asyncio.sleep(0)
+            hit.state["hits"] = hit.state["hits"] + 1 if "hits" in hit.state else 1
+        
+        async def main():
+            await asyncio.gather(hit("a"), hit("b"), hit("a"))
+        
+        asyncio.run(main())
+        backend = SQLiteBackend(db_path=self.temp_db.name, serializer="json")
+        self.assertEqual(backend.load_state("async_tenants[a]"), {"hits": 2})
+        self.assertEqual(backend.load_state("async_tenants[b]"), {"hits": 1})
+
+class TestStatefulCache(unittest.TestCase):
+    """Test suite for the stateful_cache decorator."""
+    
+    def setUp(self):
+        """Set up test environment."""
+        self.temp_db = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
+        self.temp_db.close()
+        self.calls = []
+    
+    def tearDown(self):
+        """Clean up test environment."""
+        if os.path.exists(self.temp_db.name):
+            os.unlink(self.temp_db.name)
+    
+    def make_square(self, **options):
+        @stateful_cache(backend="sqlite", db_path=self.temp_db.name, function_id="square", **options)
+        def square(x, scale=1):
+            self.calls.append(x)
+            return x * x * scale
+        return square
+    
+    def test_results_survive_restart(self):
+        """Test that results are reused by a freshly decorated function."""
+        square = self.make_square()
+        self.assertEqual(square(3), 9)
+        self.assertEqual(square(x=3, scale=1), 9)
+        self.assertEqual(self.calls, [3])
+        
+        restarted = self.make_square()
+        with mock.patch.object(SQLiteBackend, "load_state", autospec=True,
+                               side_effect=SQLiteBackend.load_state) as load:
+            self.assertEqual(restarted(3), 9)
+            load.assert_not_called()
+        self.assertEqual(self.calls, [3])
+        self.assertEqual(restarted.cache_info(), (1, 0, 128, 1))
+    
+    def test_lru_eviction(self):
+        """Test that the least recently used result is evicted at maxsize."""
+        square = self.make_square(maxsize=2)
+        with mock.patch("statefulpy.cache.time.time", side_effect=range(100, 200)):
+            square(1)
+            square(2)
+            square(1)  # Hit: 1 is now more recent than 2
+            square(3)  # Evicts 2
+            square(1)
+            square(2)
+        self.assertEqual(self.calls, [1, 2, 3, 2])
+        self.assertEqual(square.cache_info().currsize, 2)
+    
+    def test_ttl_expiry(self):
+        """Test that expired results are recomputed."""
+        square = self.make_square(ttl=10)
+        with mock.patch("statefulpy.cache.time.time", return_value=100):
+            square(2)
+            square(2)
+        with mock.patch("statefulpy.cache.time.time", return_value=111):
+            square(2)
+        self.assertEqual(self.calls, [2, 2])
+        
+        square.cache_clear()
+        square(2)
+        self.assertEqual(self.calls, [2, 2, 2])
+    
+    def test_miss_returns_stored_form(self):
+        """Test that a miss returns the same value as later hits."""
+        @stateful_cache(backend="sqlite", db_path=self.temp_db.name, function_id="pair")
+        def pair(x):
+            return (x, x)
+        
+        self.assertEqual(pair(1), [1, 1])
+        self.assertEqual(pair(1), [1, 1])
+    
+    def test_uncacheable_results_are_returned(self):
+        """Test that results the serializer or backend cannot store are returned uncached."""
+        @stateful_cache(backend="sqlite", db_path=self.temp_db.name, function_id="uncacheable")
+        def tags(x):
+            self.calls.append(x)
+            return {x}
+        
+        with self.assertLogs("statefulpy.cache", level="ERROR"):
+            self.assertEqual(tags(1), {1})
+            self.assertEqual(tags(1), {1})
+        self.assertEqual(self.calls, [1, 1])
+        
+        square = self.make_square()
+        with mock.patch.object(SQLiteBackend, "save_state_versioned", side_effect=OSError("disk full")):
+            with self.assertLogs("statefulpy.cache", level="ERROR"):
+                self.assertEqual(square(4), 16)
+        self.assertEqual(square(4), 16)
+        self.assertEqual(self.calls, [1, 1, 4, 4])
+    
+    def test_default_backend(self):
+        """Test that the configured default backend is used when none is given."""
+        @stateful_cache(db_path=self.temp_db.name, function_id="square")
+        def square(x, scale=1):
+            self.calls.append(x)
+            return x * x * scale
+        
+        self.assertEqual(square(3), 9)
+        self.assertEqual(self.make_square()(3), 9)
+        self.assertEqual(self.calls, [3])
+
+
+class TestStateProxy(unittest.TestCase):
+    """Test suite for StateProxy change tracking."""
+    
+    def test_tracks_assignments_and_deletions(self):
+        """Test that top-level writes and deletions mark keys as changed."""
+        proxy = StateProxy({"a": 1, "b": 2})
+        self.assertFalse(proxy.is_dirty())
+        proxy["a"] = 3
+        proxy.c = 4
+        del proxy["b"]
+        self.assertEqual(proxy.changed_keys(), {"a", "b", "c"})
+        proxy.mark_clean()
+        self.assertFalse(proxy.is_dirty())
+    
+    def test_reads_do_not_mark_dirty(self):
+        """Test that reading values, mutable or not, keeps the state clean."""
+        proxy = StateProxy({"n": 1, "items": [1, 2], "nested": {"x": [1]}})
+        _ = proxy["n"], proxy.items, proxy["nested"]["x"][0]
+        self.assertFalse(proxy.is_dirty())
+        proxy["nested"]["x"].append(2)
+        self.assertEqual(proxy.changed_keys(), {"nested"})
+    
+    def test_unpicklable_reads_mark_dirty(self):
+        """Test that values without a fingerprint are conservatively treated as changed."""
+        proxy = StateProxy({"callback": lambda: None, "n": 1})
+        _ = proxy["n"]
+        self.assertFalse(proxy.is_dirty())
+        _ = proxy["callback"]
+        self.assertEqual(proxy.changed_keys(), {"callback"})
+    
+    def test_changes_after_save_are_detected(self):
+        """Test that fingerprints kept across a save still catch later in-place mutations."""
+        proxy = StateProxy({"items": [1]})
+        proxy["items"].append(2)
+        self.assertEqual(proxy.changed_keys(), {"items"})
+        proxy.mark_clean()
+        self.assertFalse(proxy.is_dirty())
+        proxy["items"].append(3)
+        self.assertEqual(proxy.changed_keys(), {"items"})
+        proxy.mark_clean()
+        proxy["items"] = []
+        proxy.mark_clean()
+        proxy["items"].append(4)
+        self.assertEqual(proxy.changed_keys(), {"items"})
+
 
 if __name__ == "__main__":
     unittest.main()